@@ -0,0 +1,157 @@
+import hashlib
+import io
+import lzma
+import mmap
+import os
+import zlib
+from pathlib import Path
+from typing import IO, Callable, Iterator, Optional, Union
+from zipfile import BadZipFile, ZipFile
+
+
+DEFAULT_HASH_ALGORITHM = "md5"
+HASH_ALGORITHMS = ("md5", "sha1", "sha256", "blake2b", "blake2s")
+DIGEST_BUFFER = 1048576  # 1mb
+# Raised by opening or reading a damaged or unsupported archive or member:
+# encrypted (RuntimeError), compressed by an unknown method or written by an
+# unknown ZIP version (NotImplementedError), named in invalid UTF-8, or with a
+# corrupted or truncated stream
+MEMBER_ERRORS = (BadZipFile, RuntimeError, NotImplementedError, EOFError,
+                 OSError, UnicodeDecodeError, zlib.error, lzma.LZMAError)
+
+
+def map_file(path: Path) -> Union[mmap.mmap, io.BytesIO]:
+    """Maps a whole file read-only; empty files cannot be mapped."""
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return io.BytesIO(b"")
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if hasattr(mapping, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+        mapping.madvise(mmap.MADV_SEQUENTIAL)
+    return mapping
+
+
+def mapping_size(mapping: Union[mmap.mmap, io.BytesIO]) -> int:
+    if isinstance(mapping, io.BytesIO):
+        return len(mapping.getbuffer())
+    return len(mapping)
+
+
+def digest_mapping(mapping: Union[mmap.mmap, io.BytesIO],
+                   algorithm: str = DEFAULT_HASH_ALGORITHM) -> str:
+    """Hashes a mapped file in blocks, without copying them."""
+    hasher = hashlib.new(algorithm)
+    if isinstance(mapping, io.BytesIO):
+        hasher.update(mapping.getbuffer())
+        return hasher.hexdigest()
+
+    with memoryview(mapping) as view:
+        for start in range(0, len(view), DIGEST_BUFFER):
+            with view[start:start + DIGEST_BUFFER] as block:
+                hasher.update(block)
+    return hasher.hexdigest()
+
+
+class ArchiveView(io.RawIOBase):
+    """Read-only, seekable view of a file starting at a byte offset.
+
+    `ZipFile` reads the central directory and members straight from disk
+    through the view, so an archive preceded by a CRX header is neither
+    copied into memory nor exposed together with its header bytes. The
+    source is either a path, opened by the view, or a memory map shared with
+    the digest and header stages.
+    """
+
+    def __init__(self, source: Union[Path, mmap.mmap, io.BytesIO],
+                 offset: int = 0, length: Optional[int] = None):
+        super().__init__()
+        self._file: Optional[IO[bytes]] = None
+        self._mapping: Optional[Union[mmap.mmap, io.BytesIO]] = None
+        if isinstance(source, (mmap.mmap, io.BytesIO)):
+            self._mapping = source
+            file_size = mapping_size(source)
+        else:
+            self._file = open(source, "rb", buffering=0)
+            file_size = os.fstat(self._file.fileno()).st_size
+
+        self.offset = min(offset, file_size)
+        self.length = file_size - self.offset if length is None \
+            else min(length, file_size - self.offset)
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, position: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_SET:
+            target = position
+        elif whence == os.SEEK_CUR:
+            target = self._position + position
+        elif whence == os.SEEK_END:
+            target = self.length + position
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+
+        if target < 0:
+            raise OSError(f"Negative seek position: {target}")
+        self._position = target
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        remaining = self.length - self._position
+        if remaining <= 0:
+            return 0
+
+        view = memoryview(buffer).cast("B")
+        size = min(len(view), remaining)
+        start = self.offset + self._position
+        if self._mapping is not None:
+            with memoryview(self._mapping.getbuffer()
+                            if isinstance(self._mapping, io.BytesIO)
+                            else self._mapping) as source:
+                view[:size] = source[start:start + size]
+            read = size
+        else:
+            self._file.seek(start)
+            read = self._file.readinto(view[:size])
+
+        self._position += read
+        return read
+
+    def close(self) -> None:
+        # A shared memory map is left to its owner
+        if not self.closed and self._file is not None:
+            self._file.close()
+        super().close()
+
+
+def iter_archive_resources(zip_archive: ZipFile, resource_type: Callable,
+                           filter_list: Optional[list[str]] = None) -> Iterator:
+    """Yields a resource per file member, opening its content on demand.
+
+    Members outside the filter list are yielded without content. The content
+    of a resource is closed as soon as the next resource is requested, so at
+    most one member and its decompressor are open at a time.
+    """
+    with zip_archive:
+        for resource_info in zip_archive.infolist():
+            if resource_info.is_dir(): continue
+
+            filename = resource_info.filename
+            resource = resource_type(filename, info=resource_info)
+            if (filter_list is None
+                    or filename.split(".")[-1] in filter_list):
+                resource.content = zip_archive.open(resource_info)
+            try:
+                yield resource
+            finally:
+                if resource.content is not None:
+                    resource.content.close()
+                    resource.content = None
@@ -0,0 +1,83 @@
+"""Peak memory of opening and reading an extension archive.
+
+Compares the former `ZipFile(BytesIO(buffer.read()))` archive access with
+the in-place `ArchiveView` used by `CrxFile` and `XpiFile`, on a synthetic
+CRX3 file of configurable size.
+
+    python -m benchmarks.bench_archive_memory [--size-mb 128]
+"""
+import os
+import struct
+import sys
+import tempfile
+import tracemalloc
+import zipfile
+from io import BytesIO
+from optparse import OptionParser
+from pathlib import Path
+from crx3_pb2 import CrxFileHeader, SignedData
+from crx_file import CrxFile
+
+READ_CHUNK = 1024 * 1024  # 1mb
+
+
+def write_crx3(path: Path, size_mb: int) -> None:
+    """Writes a CRX3 file whose archive holds `size_mb` of stored data."""
+    signed_data = SignedData(crx_id=bytes(16)).SerializeToString()
+    header = CrxFileHeader(signed_header_data=signed_data).SerializeToString()
+    with open(path, "wb") as crx:
+        crx.write(b"Cr24" + struct.pack("<II", 3, len(header)) + header)
+        with zipfile.ZipFile(crx, "w", zipfile.ZIP_STORED) as archive:
+            chunk = os.urandom(READ_CHUNK)
+            for index in range(size_mb):
+                archive.writestr(f"assets/blob{index}.js", chunk)
+
+
+def drain(archive: zipfile.ZipFile) -> None:
+    for info in archive.infolist():
+        with archive.open(info) as member:
+            while member.read(READ_CHUNK):
+                pass
+
+
+def legacy_access(path: Path) -> None:
+    crx = CrxFile(path)
+    crx.setup(setup_resources=False)
+    with crx as buffer:
+        drain(zipfile.ZipFile(BytesIO(buffer.read())))
+
+
+def view_access(path: Path) -> None:
+    crx = CrxFile(path)
+    crx.setup(setup_resources=False)
+    drain(crx.get_zip_archive())
+
+
+def peak_megabytes(function, path: Path) -> float:
+    tracemalloc.start()
+    function(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / (1024 * 1024)
+
+
+def main() -> int:
+    parser = OptionParser(usage="python -m benchmarks.bench_archive_memory")
+    parser.add_option("--size-mb", type="int", dest="size_mb", default=128,
+                      help="size of the synthetic archive [default: %default]")
+    options, _ = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory, "synthetic.crx")
+        write_crx3(path, options.size_mb)
+        print(f"archive size: {path.stat().st_size / (1024 * 1024):.1f} MB")
+        before = peak_megabytes(legacy_access, path)
+        after = peak_megabytes(view_access, path)
+
+    print(f"peak memory before (BytesIO copy): {before:8.2f} MB")
+    print(f"peak memory after (ArchiveView):   {after:8.2f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""Throughput of a corpus scan with pathological members under time budgets.
+
+Adds extensions holding a member on which the broad query string pattern
+backtracks quadratically to a synthetic corpus, and scans it through the
+watchdog. Without budgets such a member stalls its worker for minutes; with
+a member time budget the wall time must stay within the time of the clean
+corpus plus one budget per pathological member and worker.
+
+    python -m benchmarks.bench_budgets [--pathological 4] [--member-timeout 0.5]
+"""
+import sys
+import tempfile
+import time
+import zipfile
+from optparse import OptionParser
+from pathlib import Path
+from benchmarks.synthetic import CorpusGenerator, CorpusOptions
+from corpus import CorpusStatistics, scan_corpus
+from scanner import ScanOptions
+
+# "?" followed by a long run of keywords and no "=" is quadratic for
+# [&?][a-zA-Z0-9\-_]*(?:(?i:key|...))[a-z0-9\-_]*=
+PATHOLOGICAL_MEMBER = "fetch('https://api.edenai.run');?" + "key" * 400000
+
+
+def write_pathological(path: Path) -> None:
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("js/vendor.min.js", PATHOLOGICAL_MEMBER)
+        archive.writestr("js/app.js", 'const key = "AIzaSy' + "x" * 33 + '";')
+
+
+def scan(paths: list[Path], jobs: int,
+         options: ScanOptions) -> CorpusStatistics:
+    statistics = CorpusStatistics()
+    for result in scan_corpus(paths, jobs, options):
+        statistics.add(result)
+    statistics.stop()
+    return statistics
+
+
+def main() -> int:
+    parser = OptionParser(usage="python -m benchmarks.bench_budgets")
+    parser.add_option("--files", type="int", dest="files", default=40,
+                      help="clean extension files [default: %default]")
+    parser.add_option("--pathological", type="int", dest="pathological",
+                      default=4,
+                      help="pathological extension files [default: %default]")
+    parser.add_option("--member-timeout", type="float", dest="member_timeout",
+                      default=0.5,
+                      help="member time budget in seconds [default: %default]")
+    parser.add_option("-j", "--jobs", type="int", dest="jobs", default=2,
+                      help="worker processes [default: %default]")
+    options, _ = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        CorpusGenerator(CorpusOptions(files=options.files)).write(directory)
+        clean = sorted(path for path in directory.iterdir()
+                       if path.suffix in (".crx", ".xpi"))
+        pathological = []
+        for index in range(options.pathological):
+            path = directory.joinpath(f"pathological{index}.xpi")
+            write_pathological(path)
+            pathological.append(path)
+
+        budgets = ScanOptions(member_timeout=options.member_timeout)
+        baseline = scan(clean, options.jobs, budgets)
+        adversarial = scan(clean + pathological, options.jobs, budgets)
+
+    allowed = baseline.elapsed + options.member_timeout * (
+        -(-options.pathological // options.jobs) + 1) + 1.0
+    print(f"clean corpus:       {baseline.summary()}")
+    print(f"adversarial corpus: {adversarial.summary()}")
+    print(f"wall time {adversarial.elapsed:.2f}s, allowed {allowed:.2f}s")
+    if adversarial.incomplete_members != options.pathological:
+        print("FAIL: pathological members were not abandoned")
+        return 1
+    if adversarial.elapsed > allowed:
+        print("FAIL: pathological members stalled the corpus scan")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
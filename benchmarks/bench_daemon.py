@@ -0,0 +1,135 @@
+"""Dispatch overhead and throughput of the scan daemon.
+
+Starts `main.py --serve` on a Unix socket, scans a synthetic corpus (see
+`benchmarks.synthetic`) through it from concurrent clients, and compares the
+latency with spawning `main.py -f` once per file. A burst beyond the queue
+size must be rejected with 503 rather than queued.
+
+    python -m benchmarks.bench_daemon [--files 20] [--clients 2] [-j 2]
+"""
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from optparse import OptionParser
+from pathlib import Path
+from typing import Optional
+from benchmarks.synthetic import CorpusGenerator, corpus_options, parse_options
+from scan_daemon import connect
+
+REPOSITORY = Path(__file__).resolve().parent.parent
+
+
+def request(address: str, method: str, route: str,
+            body: Optional[bytes] = None) -> tuple[int, dict]:
+    connection = connect(address, timeout=600)
+    try:
+        connection.request(method, route, body=body)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def start_daemon(address: str, jobs: int, queue_size: int) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "main.py", "--serve", address, "-j", str(jobs),
+         "--queue-size", str(queue_size)],
+        cwd=REPOSITORY, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if request(address, "GET", "/health")[0] == 200:
+                return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("The daemon did not start")
+
+
+def scan_through_daemon(address: str, paths: list[Path],
+                        clients: int) -> list[float]:
+    def scan(path: Path) -> float:
+        started = time.perf_counter()
+        status, record = request(address, "POST", "/scan", json.dumps(
+            {"path": str(path)}).encode("utf-8"))
+        if status != 200 or record["error"] is not None:
+            raise RuntimeError(f"Could not scan {path}: {record}")
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        return list(executor.map(scan, paths))
+
+
+def burst(address: str, path: Path, requests: int) -> list[int]:
+    body = json.dumps({"path": str(path)}).encode("utf-8")
+    with ThreadPoolExecutor(max_workers=requests) as executor:
+        return list(executor.map(
+            lambda _: request(address, "POST", "/scan", body)[0],
+            range(requests)))
+
+
+def main() -> int:
+    parser = OptionParser(usage="python -m benchmarks.bench_daemon")
+    parse_options(parser)
+    parser.set_defaults(member_kb=16)
+    parser.add_option("--clients", type="int", dest="clients",
+                      help="concurrent clients; more than the workers adds "
+                           "queueing to the overhead [default: jobs]")
+    parser.add_option("-j", "--jobs", type="int", dest="jobs", default=2,
+                      help="daemon worker processes [default: %default]")
+    parser.add_option("--spawned", type="int", dest="spawned", default=5,
+                      help="files scanned by spawning main.py "
+                           "[default: %default]")
+    options, _ = parser.parse_args()
+    clients = options.clients if options.clients is not None else options.jobs
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        try:
+            CorpusGenerator(corpus_options(options)).write(directory)
+        except ValueError as error:
+            parser.error(str(error))
+        paths = sorted(path for path in directory.iterdir()
+                       if path.suffix in (".crx", ".xpi"))
+
+        spawned = []
+        for path in paths[:options.spawned]:
+            started = time.perf_counter()
+            subprocess.run([sys.executable, "main.py", "-f", str(path)],
+                           cwd=REPOSITORY, check=True,
+                           stdout=subprocess.DEVNULL)
+            spawned.append(time.perf_counter() - started)
+
+        address = f"unix:{directory.joinpath('daemon.sock')}"
+        queue_size = options.jobs * 2
+        daemon = start_daemon(address, options.jobs, queue_size)
+        try:
+            started = time.perf_counter()
+            latencies = scan_through_daemon(address, paths, clients)
+            elapsed = time.perf_counter() - started
+            _, summary = request(address, "GET", "/stats")
+            statuses = burst(address, paths[0], queue_size * 4)
+        finally:
+            daemon.terminate()
+            daemon.wait()
+
+    print(f"spawned main.py -f:  median {statistics.median(spawned) * 1000:8.1f} ms")
+    print(f"daemon request:      median {statistics.median(latencies) * 1000:8.1f} ms, "
+          f"{len(paths) / elapsed:.2f} files/sec with {clients} clients")
+    print(f"daemon overhead:     {summary['overhead_ms']}")
+    print(f"daemon latency:      {summary['latency_ms']}")
+    print(f"burst of {len(statuses)}: {statuses.count(200)} scanned, "
+          f"{statuses.count(503)} rejected with 503")
+    if statuses.count(200) + statuses.count(503) != len(statuses) \
+            or not statuses.count(503):
+        print("FAIL: a burst beyond the queue size was not rejected")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
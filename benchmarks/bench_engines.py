@@ -0,0 +1,132 @@
+"""Equivalence and speed of the regular expression engines, per pattern.
+
+Generates a synthetic corpus (see `benchmarks.synthetic`), or reads an
+existing one, and runs the bytes expression of every pattern and
+sub-service under every installed engine over all of its members. An
+engine is equivalent for a pattern when it finds the same spans and groups
+as `re` in every member; the fastest equivalent engine is recommended for
+the `engine` key of that pattern in `configuration.yml`. Finally, the
+matcher runs with every engine for all patterns and must report the same
+findings as with `re`.
+
+    python -m benchmarks.bench_engines [--files 20] [--corpus corpus/]
+"""
+import copy
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+from pathlib import Path
+from typing import Any
+from benchmarks.bench_pipeline import pattern_name, read_members
+from benchmarks.synthetic import CorpusGenerator, corpus_options, parse_options
+from configuration import API_PATTERNS, KEYWORD_AUTOMATON, ApiKeyPattern
+from matcher import CompiledMatcher
+from regex_engines import DEFAULT_ENGINE, available_engines, compile_expression
+
+
+def expressions() -> dict[str, str]:
+    """Returns the source of every pattern and sub-service, by name."""
+    sources = {}
+    for index, api_pattern in enumerate(API_PATTERNS):
+        sources[pattern_name(index, api_pattern)] = api_pattern.pattern
+        for service in api_pattern.sub_services:
+            sources.setdefault(service.service_name, service.pattern)
+    return sources
+
+
+def find_spans(expression: Any, contents: list[bytes]) -> list[tuple]:
+    return [(index, result.start(), result.end(), result.groups())
+            for index, content in enumerate(contents)
+            for result in expression.finditer(content)]
+
+
+def measure(expression: Any, contents: list[bytes], repeat: int
+            ) -> tuple[float, list[tuple]]:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        spans = find_spans(expression, contents)
+        best = min(best, time.perf_counter() - started)
+    return best, spans
+
+
+def with_engine(engine: str) -> list[ApiKeyPattern]:
+    """Copies the ruleset with every pattern compiled by one engine."""
+    api_patterns = copy.deepcopy(API_PATTERNS)
+    for api_pattern in api_patterns:
+        for service in [api_pattern, *api_pattern.sub_services]:
+            if service.pattern is not None:
+                service.engine = engine
+                service.pattern = service.pattern
+    return api_patterns
+
+
+def findings(matcher: CompiledMatcher, contents: list[bytes]) -> list:
+    return [matcher.find_matches_with_context(content)
+            for content in contents]
+
+
+def main() -> int:
+    parser = OptionParser(usage="python -m benchmarks.bench_engines")
+    parse_options(parser)
+    parser.add_option("--corpus", type="string", dest="corpus",
+                      help="read an existing corpus instead of generating one")
+    parser.add_option("--repeat", type="int", dest="repeat", default=3,
+                      help="runs per engine and pattern, the best is kept "
+                           "[default: %default]")
+    options, _ = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        corpus_directory = Path(options.corpus or directory)
+        if options.corpus is None:
+            try:
+                CorpusGenerator(corpus_options(options)).write(corpus_directory)
+            except ValueError as error:
+                parser.error(str(error))
+        contents = read_members(sorted(
+            path for path in corpus_directory.iterdir()
+            if path.suffix in (".crx", ".xpi")))
+
+    engines = available_engines()
+    print(f"{len(contents)} members, engines installed: {', '.join(engines)}")
+    failed = False
+    for name, source in expressions().items():
+        baseline_seconds, baseline = measure(
+            compile_expression(source.encode("utf-8"))[0], contents,
+            options.repeat)
+        fastest = (baseline_seconds, DEFAULT_ENGINE)
+        for engine in engines:
+            expression, compiled_by = compile_expression(
+                source.encode("utf-8"), engine)
+            if compiled_by != engine:
+                print(f"  {name:<14} {engine:<6} cannot compile the pattern")
+                continue
+            seconds, spans = measure(expression, contents, options.repeat) \
+                if engine != DEFAULT_ENGINE else (baseline_seconds, baseline)
+            equivalent = spans == baseline
+            failed |= not equivalent
+            print(f"  {name:<14} {engine:<6} {seconds:8.4f}s "
+                  f"{len(spans):6} matches"
+                  + ("" if equivalent else "  DIFFERENT FROM re"))
+            if equivalent and seconds < fastest[0]:
+                fastest = (seconds, engine)
+        print(f"{name}: fastest equivalent engine {fastest[1]}")
+
+    expected = findings(CompiledMatcher(API_PATTERNS, KEYWORD_AUTOMATON),
+                        contents)
+    for engine in engines:
+        if engine == DEFAULT_ENGINE:
+            continue
+        if findings(CompiledMatcher(with_engine(engine), KEYWORD_AUTOMATON),
+                    contents) != expected:
+            print(f"FAIL: findings under {engine} differ from re")
+            failed = True
+    if failed:
+        print("FAIL: some engines are not equivalent to re")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
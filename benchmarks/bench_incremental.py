@@ -0,0 +1,110 @@
+"""Incremental rescans of new extension versions against full scans.
+
+Writes a synthetic XPI corpus (see `benchmarks.synthetic`) as version 1.0 of
+one extension id per file, and a version 1.1 of each in which a fraction of
+the members changed. After version 1.0 is recorded in a fresh version
+history, version 1.1 is scanned in full and incrementally; both must report
+the same findings.
+
+    python -m benchmarks.bench_incremental [--files 40] [--changed 0.1]
+"""
+import random
+import sys
+import tempfile
+import zipfile
+from optparse import OptionParser
+from pathlib import Path
+from typing import Optional
+from benchmarks.synthetic import CorpusGenerator, corpus_options, parse_options
+from corpus import CorpusStatistics, scan_corpus
+from reporting import finding_record
+from scanner import ScanResult
+from version_history import VersionHistory
+
+
+def write_versions(corpus_directory: Path, directory: Path, changed: float,
+                   seed: int) -> tuple[list[Path], list[Path]]:
+    """Lays the corpus out as <id>/<version>/<file> in two versions."""
+    generator = random.Random(seed)
+    first, second = [], []
+    for path in sorted(corpus_directory.glob("*.xpi")):
+        old = directory.joinpath(path.stem, "1.0", path.name)
+        new = directory.joinpath(path.stem, "1.1", path.name)
+        old.parent.mkdir(parents=True)
+        new.parent.mkdir(parents=True)
+        old.write_bytes(path.read_bytes())
+        with zipfile.ZipFile(path) as source, \
+                zipfile.ZipFile(new, "w", zipfile.ZIP_DEFLATED) as target:
+            for info in source.infolist():
+                content = source.read(info)
+                if generator.random() < changed:
+                    content += b"\n// 1.1\n"
+                target.writestr(info.filename, content)
+        first.append(old)
+        second.append(new)
+    return first, second
+
+
+def scan(paths: list[Path], jobs: int,
+         version_history: Optional[VersionHistory] = None
+         ) -> tuple[CorpusStatistics, list[ScanResult]]:
+    statistics = CorpusStatistics()
+    results = []
+    for result in scan_corpus(paths, jobs, version_history=version_history):
+        statistics.add(result)
+        results.append(result)
+    statistics.stop()
+    return statistics, results
+
+
+def records(results: list[ScanResult]) -> list[str]:
+    return sorted(str(finding_record(result, finding))
+                  for result in results for finding in result.findings)
+
+
+def main() -> int:
+    parser = OptionParser(usage="python -m benchmarks.bench_incremental")
+    parse_options(parser)
+    parser.set_defaults(files=40, member_kb=32)
+    parser.add_option("--changed", type="float", dest="changed", default=0.1,
+                      help="fraction of members changed in the new versions "
+                           "[default: %default]")
+    parser.add_option("-j", "--jobs", type="int", dest="jobs", default=1,
+                      help="worker processes [default: %default]")
+    options, _ = parser.parse_args()
+    # The id of a CRX file is that of its random key, so only XPI files
+    # keep their id across versions
+    options.formats = "xpi"
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        corpus_directory = directory.joinpath("corpus")
+        try:
+            CorpusGenerator(corpus_options(options)).write(corpus_directory)
+        except ValueError as error:
+            parser.error(str(error))
+        first, second = write_versions(
+            corpus_directory, directory.joinpath("versions"),
+            options.changed, options.seed)
+
+        version_history = VersionHistory(directory.joinpath("versions.sqlite3"))
+        try:
+            scan(first, options.jobs, version_history)
+            full, full_results = scan(second, options.jobs)
+            incremental, incremental_results = scan(
+                second, options.jobs, version_history)
+        finally:
+            version_history.close()
+
+    print(f"full scan:        {full.summary()}")
+    print(f"incremental scan: "
+          f"{incremental.summary(include_versions=True)}")
+    print(f"speedup {full.elapsed / incremental.elapsed:.2f}x")
+    if records(full_results) != records(incremental_results):
+        print("FAIL: incremental findings differ from the full scan")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
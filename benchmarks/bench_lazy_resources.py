@@ -0,0 +1,67 @@
+"""Peak memory of iterating the resources of an extension with many members.
+
+Compares `XpiFile.setup_resources`, which opens every member up front, with
+the lazy `XpiFile.iter_resources`, on a synthetic XPI of deflated members.
+
+    python -m benchmarks.bench_lazy_resources [--members 5000]
+"""
+import os
+import sys
+import tempfile
+import tracemalloc
+import zipfile
+from optparse import OptionParser
+from pathlib import Path
+from xpi_file import XpiFile
+
+
+def write_xpi(path: Path, members: int) -> None:
+    """Writes an XPI file with `members` small deflated scripts."""
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for index in range(members):
+            archive.writestr(f"scripts/module{index}.js",
+                             os.urandom(256).hex() * 4)
+
+
+def eager_access(path: Path) -> None:
+    xpi = XpiFile(path)
+    xpi.setup()
+    for resource in xpi.resources:
+        resource.content.read()
+
+
+def lazy_access(path: Path) -> None:
+    xpi = XpiFile(path)
+    xpi.setup(setup_resources=False)
+    for resource in xpi.iter_resources():
+        resource.content.read()
+
+
+def peak_megabytes(function, path: Path) -> float:
+    tracemalloc.start()
+    function(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / (1024 * 1024)
+
+
+def main() -> int:
+    parser = OptionParser(usage="python -m benchmarks.bench_lazy_resources")
+    parser.add_option("--members", type="int", dest="members", default=5000,
+                      help="number of archive members [default: %default]")
+    options, _ = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory, "synthetic.xpi")
+        write_xpi(path, options.members)
+        print(f"archive members: {options.members}")
+        before = peak_megabytes(eager_access, path)
+        after = peak_megabytes(lazy_access, path)
+
+    print(f"peak memory before (setup_resources): {before:8.2f} MB")
+    print(f"peak memory after (iter_resources):   {after:8.2f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
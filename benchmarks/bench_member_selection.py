@@ -0,0 +1,87 @@
+"""Scans with the default member selection against scans of every member.
+
+Writes a synthetic XPI corpus (see `benchmarks.synthetic`) and adds binary
+assets to every file: images, fonts and WebAssembly by extension, and
+extension-less binaries that only the content sniff recognizes. Assets are
+random bytes, so they hold no planted tokens, and both scans must report the
+same findings.
+
+    python -m benchmarks.bench_member_selection [--files 20] [--asset-kb 256]
+"""
+import random
+import sys
+import tempfile
+import zipfile
+from optparse import OptionParser
+from pathlib import Path
+from benchmarks.synthetic import CorpusGenerator, corpus_options, parse_options
+from corpus import CorpusStatistics, scan_corpus
+from reporting import finding_record
+from scanner import ScanOptions, ScanResult
+
+ASSETS = ("images/icon.png", "images/banner.jpg", "fonts/icons.woff2",
+          "lib/engine.wasm", "data/model", "data/blob.dat")
+ASSET_HEADERS = {".png": b"\x89PNG\r\n\x1a\n", ".jpg": b"\xff\xd8\xff\xe0",
+                 ".woff2": b"wOF2", ".wasm": b"\x00asm\x01\x00\x00\x00"}
+
+
+def add_assets(path: Path, asset_size: int, generator: random.Random) -> None:
+    with zipfile.ZipFile(path, "a", zipfile.ZIP_DEFLATED) as archive:
+        for name in ASSETS:
+            header = ASSET_HEADERS.get(Path(name).suffix, b"\x00\x01")
+            archive.writestr(name, header + generator.randbytes(asset_size))
+
+
+def scan(paths: list[Path], options: ScanOptions
+         ) -> tuple[CorpusStatistics, list[ScanResult]]:
+    statistics = CorpusStatistics()
+    results = []
+    for result in scan_corpus(paths, 1, options):
+        statistics.add(result)
+        results.append(result)
+    statistics.stop()
+    return statistics, results
+
+
+def records(results: list[ScanResult]) -> list[str]:
+    return sorted(str(finding_record(result, finding))
+                  for result in results for finding in result.findings)
+
+
+def main() -> int:
+    parser = OptionParser(usage="python -m benchmarks.bench_member_selection")
+    parse_options(parser)
+    parser.set_defaults(members=10)
+    parser.add_option("--asset-kb", type="int", dest="asset_kb", default=256,
+                      help="size of every binary asset in KB [default: %default]")
+    options, _ = parser.parse_args()
+    options.formats = "xpi"
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        try:
+            CorpusGenerator(corpus_options(options)).write(directory)
+        except ValueError as error:
+            parser.error(str(error))
+        paths = sorted(directory.glob("*.xpi"))
+        generator = random.Random(options.seed)
+        for path in paths:
+            add_assets(path, options.asset_kb * 1024, generator)
+
+        every_member, every_results = scan(paths, ScanOptions(member_policy=None))
+        selected, selected_results = scan(paths, ScanOptions())
+
+    print(f"every member: {every_member.summary()}")
+    print(f"selected:     {selected.summary()}")
+    print(f"speedup {every_member.elapsed / selected.elapsed:.2f}x")
+    if records(every_results) != records(selected_results):
+        print("FAIL: findings differ when binary members are skipped")
+        return 1
+    if sum(selected.skipped_members.values()) != len(ASSETS) * len(paths):
+        print("FAIL: not every binary asset was skipped")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+"""Throughput and peak memory of every stage of the scan pipeline.
+
+Generates a synthetic corpus (see `benchmarks.synthetic`), or reads an
+existing one, and times each stage over all of its files:
+
+- digest: hashing the mapped file
+- header: `setup(setup_resources=False)`, which maps and digests the file
+  and parses the CRX header from the same mapping
+- archive: `get_zip_archive`, i.e. reading the central directory
+- decode: decompressing every member
+- match:<service>: each `ApiKeyPattern` on its own, over every member
+- matcher: the compiled matcher over every member
+- scan: `scan_extension_file` end to end
+
+Times are the best of `--repeat` runs; peak memory is traced in a separate
+run, so tracing does not distort the times. Results are saved as JSON and
+can be compared with an earlier run.
+
+    python -m benchmarks.bench_pipeline [--files 20] [--compare old.json]
+"""
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from optparse import OptionParser
+from pathlib import Path
+from typing import Callable, Optional
+from archive_io import digest_mapping, map_file
+from benchmarks.synthetic import CorpusGenerator, corpus_options, parse_options
+from configuration import API_PATTERNS, MatchCache
+from matcher import API_MATCHER
+from scanner import open_extension, scan_extension_file
+
+RESULTS_DIRECTORY = Path(__file__).parent.joinpath("results")
+
+
+def setup_extensions(paths: list[Path]) -> list:
+    extensions = []
+    for path in paths:
+        extension = open_extension(path)
+        extension.setup(setup_resources=False)
+        extensions.append(extension)
+    return extensions
+
+
+def read_members(paths: list[Path]) -> list[bytes]:
+    contents: list[bytes] = []
+    for extension in setup_extensions(paths):
+        for resource in extension.iter_resources():
+            if resource.content is not None:
+                contents.append(resource.content.read())
+    return contents
+
+
+def pattern_name(index: int, api_pattern) -> str:
+    if api_pattern.service_name != "Unknown":
+        return api_pattern.service_name
+    return f"broad[{index}]"
+
+
+def stages(paths: list[Path], contents: list[bytes]) -> dict[str, Callable]:
+    """Returns a callable per stage, which returns its number of matches."""
+
+    def digest() -> int:
+        for path in paths:
+            digest_mapping(map_file(path))
+        return 0
+
+    def header() -> int:
+        setup_extensions(paths)
+        return 0
+
+    def archive() -> int:
+        for extension in setup_extensions(paths):
+            extension.get_zip_archive()
+        return 0
+
+    def decode() -> int:
+        read_members(paths)
+        return 0
+
+    def pattern(api_pattern) -> Callable[[], int]:
+        def match() -> int:
+            return sum(len(api_pattern.find_matches_with_context(
+                content, cache=MatchCache())) for content in contents)
+        return match
+
+    def matcher() -> int:
+        return sum(len(API_MATCHER.find_matches_with_context(content))
+                   for content in contents)
+
+    def scan() -> int:
+        return sum(len(scan_extension_file(path).findings) for path in paths)
+
+    timed = {"digest": digest, "header": header, "archive": archive,
+             "decode": decode}
+    broad_index = 0
+    for api_pattern in API_PATTERNS:
+        timed[f"match:{pattern_name(broad_index, api_pattern)}"] = \
+            pattern(api_pattern)
+        broad_index += api_pattern.service_name == "Unknown"
+    timed["matcher"] = matcher
+    timed["scan"] = scan
+    return timed
+
+
+def measure(stage: Callable[[], int], repeat: int) -> tuple[float, float, int]:
+    """Returns the best time, the peak traced memory in MB and the matches."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        matches = stage()
+        best = min(best, time.perf_counter() - started)
+
+    tracemalloc.start()
+    stage()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak / (1024 * 1024), matches
+
+
+def run(paths: list[Path], repeat: int) -> dict:
+    contents = read_members(paths)
+    archive_bytes = sum(path.stat().st_size for path in paths)
+    member_bytes = sum(map(len, contents))
+
+    results: dict[str, dict] = {}
+    for name, stage in stages(paths, contents).items():
+        stage_bytes = archive_bytes \
+            if name in ("digest", "header", "archive") else member_bytes
+        seconds, peak, matches = measure(stage, repeat)
+        results[name] = {
+            "seconds": seconds,
+            "megabytes_per_second":
+                stage_bytes / (1024 * 1024) / max(seconds, 1e-9),
+            "peak_megabytes": peak,
+            "matches": matches,
+        }
+        print(f"{name:<24} {seconds:>9.4f}s "
+              f"{results[name]['megabytes_per_second']:>10.2f} MB/s "
+              f"{peak:>9.2f} MB peak {matches:>7} matches")
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "files": len(paths),
+        "archive_bytes": archive_bytes,
+        "member_bytes": member_bytes,
+        "stages": results,
+    }
+
+
+def compare(report: dict, baseline: dict) -> None:
+    """Prints the speedup of every stage over a baseline report."""
+    print(f"\n{'stage':<24} {'baseline':>10} {'current':>10} {'speedup':>8}")
+    for name, result in report["stages"].items():
+        previous = baseline["stages"].get(name)
+        if previous is None:
+            continue
+        speedup = previous["seconds"] / max(result["seconds"], 1e-9)
+        print(f"{name:<24} {previous['seconds']:>9.4f}s "
+              f"{result['seconds']:>9.4f}s {speedup:>7.2f}x")
+
+
+def main() -> int:
+    parser = OptionParser(usage="python -m benchmarks.bench_pipeline")
+    parse_options(parser)
+    parser.add_option("--corpus", type="string", dest="corpus",
+                      help="scan an existing corpus instead of generating one")
+    parser.add_option("--repeat", type="int", dest="repeat", default=3,
+                      help="runs of every stage [default: %default]")
+    parser.add_option("--output", type="string", dest="output",
+                      help="result file [default: "
+                           "benchmarks/results/pipeline-<time>.json]")
+    parser.add_option("--compare", type="string", dest="compare",
+                      help="earlier result file to compare with")
+    options, _ = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        corpus: Optional[dict] = None
+        if options.corpus is not None:
+            corpus_directory = Path(options.corpus)
+        else:
+            try:
+                generator = CorpusGenerator(corpus_options(options))
+            except ValueError as error:
+                parser.error(str(error))
+            corpus_directory = Path(directory)
+            generator.write(corpus_directory)
+            corpus = json.loads(
+                corpus_directory.joinpath("planted.json").read_text())["options"]
+
+        paths = sorted(path for path in corpus_directory.iterdir()
+                       if path.suffix in (".crx", ".xpi"))
+        report = run(paths, options.repeat)
+        report["corpus"] = corpus if corpus is not None else str(
+            corpus_directory)
+
+    output = Path(options.output) if options.output else \
+        RESULTS_DIRECTORY.joinpath(
+            f"pipeline-{datetime.now():%Y%m%d-%H%M%S}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"\nsaved {output}")
+
+    if options.compare:
+        compare(report, json.loads(Path(options.compare).read_text()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
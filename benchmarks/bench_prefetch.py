@@ -0,0 +1,77 @@
+"""Corpus scans with and without the prefetch pipeline.
+
+Scans a synthetic corpus (see `benchmarks.synthetic`) in sequence, then with
+threads reading and hashing upcoming files and inflating upcoming members
+while others are matched. Both scans must report the same findings; the
+pipelined one reports the busy threads of every stage.
+
+    python -m benchmarks.bench_prefetch [--files 20] [--prefetch 2] [--inflate-ahead 4]
+"""
+import sys
+import tempfile
+from dataclasses import replace
+from optparse import OptionParser
+from pathlib import Path
+from benchmarks.synthetic import CorpusGenerator, corpus_options, parse_options
+from corpus import CorpusStatistics, scan_corpus
+from reporting import finding_record
+from scanner import ScanOptions, ScanResult
+
+
+def scan(paths: list[Path], jobs: int, options: ScanOptions, prefetch: int
+         ) -> tuple[CorpusStatistics, list[ScanResult]]:
+    statistics = CorpusStatistics()
+    results = []
+    for result in scan_corpus(paths, jobs, options, prefetch=prefetch):
+        statistics.add(result)
+        results.append(result)
+    statistics.stop()
+    return statistics, results
+
+
+def records(results: list[ScanResult]) -> list[str]:
+    return sorted(str(finding_record(result, finding))
+                  for result in results for finding in result.findings)
+
+
+def main() -> int:
+    parser = OptionParser(usage="python -m benchmarks.bench_prefetch")
+    parse_options(parser)
+    parser.set_defaults(files=20, member_kb=64, compression_level=9)
+    parser.add_option("-j", "--jobs", type="int", dest="jobs", default=1,
+                      help="worker processes [default: %default]")
+    parser.add_option("--prefetch", type="int", dest="prefetch", default=2,
+                      help="threads reading and hashing files ahead "
+                           "[default: %default]")
+    parser.add_option("--inflate-ahead", type="int", dest="inflate_ahead",
+                      default=4, help="members inflated ahead "
+                                      "[default: %default]")
+    options, _ = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        try:
+            CorpusGenerator(corpus_options(options)).write(directory)
+        except ValueError as error:
+            parser.error(str(error))
+        paths = sorted(path for path in directory.iterdir()
+                       if path.suffix in (".crx", ".xpi"))
+
+        sequential, sequential_results = scan(paths, options.jobs,
+                                              ScanOptions(), 0)
+        pipelined, pipelined_results = scan(
+            paths, options.jobs,
+            replace(ScanOptions(), inflate_ahead=options.inflate_ahead),
+            options.prefetch)
+
+    print(f"sequential: {sequential.summary()}")
+    print(f"pipelined:  {pipelined.summary(include_pipeline=True)}")
+    print(f"speedup {sequential.elapsed / pipelined.elapsed:.2f}x")
+    if records(sequential_results) != records(pipelined_results):
+        print("FAIL: pipelined findings differ from the sequential scan")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
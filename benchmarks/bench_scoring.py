@@ -0,0 +1,114 @@
+"""Cost and yield of candidate scoring on a flood of broad-pattern matches.
+
+Builds members full of URL parameters and bearer tokens that the broad
+patterns match: hex digests, property paths and identifiers, mixed with
+random keys. Matches them with the ruleset as configured, and with every
+threshold removed, and times the token features with NumPy and in pure
+Python. Every random key must still be reported.
+
+    python -m benchmarks.bench_scoring [--members 20] [--candidates 2000]
+"""
+import copy
+import hashlib
+import random
+import string
+import sys
+import time
+from optparse import OptionParser
+from candidate_scoring import (numpy_module, python_token_features,
+                               token_features)
+from configuration import API_PATTERNS, KEYWORD_AUTOMATON
+from matcher import CompiledMatcher
+
+KEYWORDS = "// api.ai21.com api.edenai.run api.cohere.ai\n"
+ALPHANUMERIC = string.ascii_letters + string.digits
+
+
+def noise(generator: random.Random) -> str:
+    kind = generator.randrange(3)
+    if kind == 0:
+        return hashlib.md5(generator.randbytes(8)).hexdigest()
+    if kind == 1:
+        return ".".join(generator.choice(("window", "document", "location",
+                                          "href", "navigator", "language"))
+                        for _ in range(3))
+    return "".join(generator.choice(string.ascii_lowercase)
+                   for _ in range(32))
+
+
+def member(candidates: int, keys: int, generator: random.Random
+           ) -> tuple[bytes, list[str]]:
+    planted = ["".join(generator.choice(ALPHANUMERIC) for _ in range(32))
+               for _ in range(keys)]
+    tokens = [noise(generator) for _ in range(candidates - keys)] + planted
+    generator.shuffle(tokens)
+    lines = [KEYWORDS] + [f'fetch("https://example.com/?apikey={token}&");\n'
+                          for token in tokens]
+    return "".join(lines).encode("utf-8"), planted
+
+
+def without_thresholds():
+    api_patterns = copy.deepcopy(API_PATTERNS)
+    for api_pattern in api_patterns:
+        for service in [api_pattern, *api_pattern.sub_services]:
+            service.thresholds = None
+    return api_patterns
+
+
+def timed(function, *arguments) -> tuple[float, object]:
+    started = time.perf_counter()
+    result = function(*arguments)
+    return time.perf_counter() - started, result
+
+
+def main() -> int:
+    parser = OptionParser(usage="python -m benchmarks.bench_scoring")
+    parser.add_option("--members", type="int", dest="members", default=20,
+                      help="members to match [default: %default]")
+    parser.add_option("--candidates", type="int", dest="candidates",
+                      default=2000, help="broad matches per member "
+                                         "[default: %default]")
+    parser.add_option("--keys", type="int", dest="keys", default=20,
+                      help="random keys among them [default: %default]")
+    parser.add_option("--seed", type="int", dest="seed", default=0,
+                      help="random seed [default: %default]")
+    options, _ = parser.parse_args()
+
+    generator = random.Random(options.seed)
+    members = [member(options.candidates, options.keys, generator)
+               for _ in range(options.members)]
+    scored = CompiledMatcher(API_PATTERNS, KEYWORD_AUTOMATON)
+    unscored = CompiledMatcher(without_thresholds(), KEYWORD_AUTOMATON)
+
+    def match(matcher: CompiledMatcher) -> list:
+        return [match for content, _ in members
+                for match in matcher.find_matches_with_context(content)]
+
+    unscored_seconds, unscored_matches = timed(match, unscored)
+    scored_seconds, scored_matches = timed(match, scored)
+    tokens = [token.encode("utf-8") for _, token, _, _, _ in unscored_matches]
+    python_seconds, _ = timed(python_token_features, tokens)
+
+    print(f"without thresholds: {len(unscored_matches)} findings in "
+          f"{unscored_seconds:.3f}s")
+    print(f"with thresholds:    {len(scored_matches)} findings in "
+          f"{scored_seconds:.3f}s")
+    if numpy_module() is not None:
+        numpy_seconds, _ = timed(token_features, tokens)
+        print(f"features of {len(tokens)} tokens: NumPy {numpy_seconds:.4f}s, "
+              f"Python {python_seconds:.4f}s")
+    else:
+        print(f"features of {len(tokens)} tokens: Python {python_seconds:.4f}s "
+              f"(NumPy not installed)")
+
+    reported = {token for _, token, _, _, _ in scored_matches}
+    missing = [key for _, planted in members for key in planted
+               if key not in reported]
+    if missing:
+        print(f"FAIL: {len(missing)} random keys were dropped")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""Sharded, checkpointed corpus runs against a single unsharded run.
+
+Writes a synthetic corpus (see `benchmarks.synthetic`) and a manifest of it,
+scans it in one process, then scans it again as several shard processes
+running side by side on this machine. One shard is killed once it has
+checkpointed part of its files and restarted, so it resumes from its
+checkpoint. The merged results of every shard must match the unsharded run
+byte for byte.
+
+    python -m benchmarks.bench_shards [--files 60] [--shards 3]
+"""
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+from pathlib import Path
+from benchmarks.synthetic import CorpusGenerator, corpus_options, parse_options
+from shards import Checkpoint, checkpoint_path
+
+MAIN = Path(__file__).resolve().parents[1].joinpath("main.py")
+
+
+def command(*arguments) -> list[str]:
+    return [sys.executable, str(MAIN), "--format", "jsonl", *map(str, arguments)]
+
+
+def completed_files(path: Path) -> int:
+    if not path.exists():
+        return 0
+    checkpoint = Checkpoint(path, read_only=True)
+    try:
+        return len(checkpoint.completed())
+    except sqlite3.OperationalError:
+        return 0  # The shard did not create its tables yet
+    finally:
+        checkpoint.close()
+
+
+def main() -> int:
+    parser = OptionParser(usage="python -m benchmarks.bench_shards")
+    parse_options(parser)
+    parser.set_defaults(files=60, member_kb=32)
+    parser.add_option("--shards", type="int", dest="shards", default=3,
+                      help="shard processes [default: %default]")
+    parser.add_option("--shard-key", type="choice", dest="shard_key",
+                      choices=["path", "digest"], default="path",
+                      help="path or digest [default: %default]")
+    options, _ = parser.parse_args()
+    if options.shards < 1:
+        parser.error("--shards must be positive")
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        corpus_directory = directory.joinpath("corpus")
+        try:
+            CorpusGenerator(corpus_options(options)).write(corpus_directory)
+        except ValueError as error:
+            parser.error(str(error))
+        manifest = directory.joinpath("manifest.txt")
+        manifest.write_text("".join(
+            f"{path}\n" for path in sorted(corpus_directory.iterdir())
+            if path.suffix in (".crx", ".xpi")))
+        checkpoints = directory.joinpath("checkpoints")
+
+        started = time.perf_counter()
+        unsharded = subprocess.run(command("-m", manifest, "-j", 1),
+                                   capture_output=True, check=True).stdout
+        unsharded_elapsed = time.perf_counter() - started
+
+        def shard(index: int) -> subprocess.Popen:
+            return subprocess.Popen(
+                command("-m", manifest, "-j", 1,
+                        "--shard", f"{index}/{options.shards}",
+                        "--shard-key", options.shard_key,
+                        "--checkpoint-dir", checkpoints),
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        started = time.perf_counter()
+        processes = [shard(index) for index in range(options.shards)]
+        # Kill the first shard halfway through its share of the corpus
+        killed = checkpoint_path(checkpoints, 0, options.shards)
+        while processes[0].poll() is None and \
+                completed_files(killed) < options.files // options.shards // 2:
+            time.sleep(0.01)
+        processes[0].kill()
+        processes[0].wait()
+        before_restart = completed_files(killed)
+        processes[0] = shard(0)
+        failed = [index for index, process in enumerate(processes)
+                  if process.wait() != 0]
+        sharded_elapsed = time.perf_counter() - started
+
+        merged = subprocess.run(
+            command("--merge", checkpoints, "-m", manifest),
+            capture_output=True, check=True).stdout
+
+    print(f"unsharded run: {unsharded_elapsed:.2f}s")
+    print(f"{options.shards} shards by {options.shard_key}: "
+          f"{sharded_elapsed:.2f}s, shard 0 killed after {before_restart} "
+          f"files and resumed")
+    if failed:
+        print(f"FAIL: shards {failed} exited with errors")
+        return 1
+    if merged != unsharded:
+        print("FAIL: merged results differ from the unsharded run")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""Start-up time of the command line tool with a cold and a warm ruleset cache.
+
+Times `import main` and a scan of one small extension file in fresh
+interpreters. A cold run gets an empty `CRX_RAY_CACHE_DIR`, so the ruleset is
+parsed from YAML and its JSON cache written; warm runs reuse that directory.
+Also lists the heavy modules a warm `import main` still imports, and fails
+if it imports one of those only a mode or a scored token needs.
+
+    python -m benchmarks.bench_startup [--repeat 15]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from optparse import OptionParser
+from pathlib import Path
+
+REPOSITORY = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ("yaml", "google.protobuf", "multiprocessing",
+                 "concurrent.futures", "sqlite3", "pprint", "numpy")
+# Imported by the modes and stages that need them, never by `import main`
+DEFERRED_MODULES = ("yaml", "numpy", "csv", "metadata_index", "shards",
+                    "token_index", "version_history", "scan_daemon")
+
+
+def run(arguments: list[str], cache_directory: str) -> float:
+    environment = dict(os.environ, CRX_RAY_CACHE_DIR=cache_directory)
+    started = time.perf_counter()
+    subprocess.run([sys.executable, *arguments], cwd=REPOSITORY,
+                   env=environment, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def timings(arguments: list[str], repeat: int) -> tuple[float, float]:
+    """Returns the median cold and warm wall time of a command."""
+    cold = []
+    warm = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as directory:
+            cold.append(run(arguments, directory))
+            warm.append(run(arguments, directory))
+    return statistics.median(cold), statistics.median(warm)
+
+
+def imported_modules(cache_directory: str,
+                     names: tuple[str, ...] = HEAVY_MODULES) -> list[str]:
+    environment = dict(os.environ, CRX_RAY_CACHE_DIR=cache_directory)
+    output = subprocess.run(
+        [sys.executable, "-c", "import main, sys; print(*sys.modules)"],
+        cwd=REPOSITORY, env=environment, check=True,
+        capture_output=True, text=True).stdout.split()
+    return [name for name in names if name in output]
+
+
+def main() -> int:
+    parser = OptionParser(usage="python -m benchmarks.bench_startup")
+    parser.add_option("--repeat", type="int", dest="repeat", default=15,
+                      help="runs of every command [default: %default]")
+    options, _ = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        extension = Path(directory, "small.xpi")
+        with zipfile.ZipFile(extension, "w") as archive:
+            archive.writestr("background.js", "const api = 'example';")
+
+        commands = {
+            "import main": ["-c", "import main"],
+            "scan one file": ["main.py", "-f", str(extension)],
+        }
+        for name, arguments in commands.items():
+            cold, warm = timings(arguments, options.repeat)
+            print(f"{name:<16} cold {cold * 1000:>8.1f} ms "
+                  f"warm {warm * 1000:>8.1f} ms")
+
+        cache_directory = Path(directory, "cache")
+        run(["-c", "import main"], str(cache_directory))
+        heavy = imported_modules(str(cache_directory))
+        deferred = imported_modules(str(cache_directory), DEFERRED_MODULES)
+    print(f"heavy modules imported: {', '.join(heavy) or 'none'}")
+    if deferred:
+        print(f"FAIL: import main imports {', '.join(deferred)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""Regression benchmark for sub-service resolution of the broad patterns.
+
+Every `Authorization: Bearer` hit of a minified bundle is resolved against
+the broad sub-services. The time per match must stay flat as the number of
+matches grows, i.e. scanning scales linearly and not with
+matches x content size.
+
+    python -m benchmarks.bench_subservices [--max-slowdown 3.0]
+"""
+import random
+import string
+import sys
+import time
+from optparse import OptionParser
+from matcher import API_MATCHER
+
+MATCH_COUNTS = (250, 500, 1000, 2000, 4000)
+ALPHABET = string.ascii_letters + string.digits
+
+
+def build_bundle(match_count: int, seed: int = 0) -> str:
+    """Returns a minified-looking bundle with `match_count` bearer tokens."""
+    generator = random.Random(seed)
+
+    def word(length: int) -> str:
+        return "".join(generator.choice(ALPHABET) for _ in range(length))
+
+    statements = ["fetch('https://api.edenai.run/v2/text');"]
+    for _ in range(match_count):
+        statements.append(
+            f"h({{Authorization:'Bearer {word(12)}.{word(16)}.{word(8)}'}});"
+            f"var {word(6)}=function(){{return {word(20)}}};"
+        )
+    return "".join(statements)
+
+
+def measure(match_count: int, repeat: int = 3) -> tuple[int, float]:
+    """Returns the number of findings and the best scan time in seconds."""
+    bundle = build_bundle(match_count)
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        matches = API_MATCHER.find_matches_with_context(bundle)
+        best = min(best, time.perf_counter() - started)
+    return len(matches), best
+
+
+def main() -> int:
+    parser = OptionParser(usage="python -m benchmarks.bench_subservices")
+    parser.add_option("--max-slowdown", type="float", dest="max_slowdown",
+                      default=3.0,
+                      help="maximum growth of the time per match between the "
+                           "smallest and largest bundle [default: %default]")
+    options, _ = parser.parse_args()
+
+    per_match: list[float] = []
+    print(f"{'matches':>8} {'findings':>9} {'seconds':>9} {'us/match':>9}")
+    for match_count in MATCH_COUNTS:
+        findings, seconds = measure(match_count)
+        per_match.append(seconds / match_count)
+        print(f"{match_count:>8} {findings:>9} {seconds:>9.4f} "
+              f"{per_match[-1] * 1e6:>9.2f}")
+
+    slowdown = per_match[-1] / per_match[0]
+    print(f"time per match grew {slowdown:.2f}x "
+          f"over a {MATCH_COUNTS[-1] // MATCH_COUNTS[0]}x larger bundle")
+    if slowdown > options.max_slowdown:
+        print("FAIL: sub-service resolution no longer scales linearly")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
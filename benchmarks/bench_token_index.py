@@ -0,0 +1,109 @@
+"""Build and query speed of the token index.
+
+Indexes synthetic results over several runs: every run finds a share of the
+tokens of earlier runs again, in other extensions, and some new ones. Then
+times "seen before" lookups of unseen tokens and the tokens new since every
+run. The tokens new since a run must be exactly those first added after it.
+
+    python -m benchmarks.bench_token_index [--runs 5] [--results 2000]
+"""
+import random
+import string
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+from pathlib import Path
+from scanner import Finding, ScanResult
+from token_index import TokenIndex
+
+ALPHANUMERIC = string.ascii_letters + string.digits
+
+
+def random_token(generator: random.Random) -> str:
+    return "".join(generator.choice(ALPHANUMERIC) for _ in range(32))
+
+
+def result(index: int, tokens: list[str]) -> ScanResult:
+    extension_id = f"{index:032x}"
+    return ScanResult(
+        Path(f"corpus/{extension_id}.crx"), "crx", 0, f"{index:064x}",
+        extension_id,
+        [Finding("AI21", f'"{token}"', "", "background.js", "crx")
+         for token in tokens])
+
+
+def main() -> int:
+    parser = OptionParser(usage="python -m benchmarks.bench_token_index")
+    parser.add_option("--runs", type="int", dest="runs", default=5,
+                      help="runs indexed [default: %default]")
+    parser.add_option("--results", type="int", dest="results", default=2000,
+                      help="results per run [default: %default]")
+    parser.add_option("--tokens", type="int", dest="tokens", default=5,
+                      help="tokens per result [default: %default]")
+    parser.add_option("--reused", type="float", dest="reused", default=0.8,
+                      help="share of tokens found in an earlier run "
+                           "[default: %default]")
+    parser.add_option("--lookups", type="int", dest="lookups", default=20000,
+                      help="lookups of unseen tokens [default: %default]")
+    parser.add_option("--seed", type="int", dest="seed", default=0,
+                      help="random seed [default: %default]")
+    options, _ = parser.parse_args()
+
+    generator = random.Random(options.seed)
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        index_path = Path(directory, "tokens.sqlite3")
+        index = TokenIndex(index_path)
+        known: list[str] = []
+        new_by_run: dict[int, set[str]] = {}
+        for _ in range(options.runs):
+            run = index.start_run()
+            new = set()
+            started = time.perf_counter()
+            for number in range(options.results):
+                tokens = []
+                for _ in range(options.tokens):
+                    if known and generator.random() < options.reused:
+                        tokens.append(generator.choice(known))
+                    else:
+                        tokens.append(random_token(generator))
+                        new.add(tokens[-1])
+                index.add(result(run * options.results + number, tokens))
+                known.extend(token for token in tokens if token in new)
+            seconds = time.perf_counter() - started
+            print(f"run {run}: {options.results / seconds:.0f} results/sec, "
+                  f"{index.new_tokens} new tokens")
+            failed |= index.new_tokens != len(new)
+            new_by_run[run] = new
+            index.finish_run()
+        index.close()
+
+        index = TokenIndex(index_path, read_only=True)
+        unseen = [random_token(generator) for _ in range(options.lookups)]
+        started = time.perf_counter()
+        seen = sum(index.seen(token) for token in unseen)
+        seconds = time.perf_counter() - started
+        print(f"{options.lookups} unseen lookups in {seconds:.3f}s")
+        failed |= seen != 0
+        failed |= not all(index.seen(token) for token in known[:1000])
+
+        for run in range(options.runs):
+            started = time.perf_counter()
+            tokens = {record.token for record in index.tokens_since(run)}
+            seconds = time.perf_counter() - started
+            expected = set().union(*(new_by_run[later] for later in new_by_run
+                                     if later > run))
+            print(f"new since run {run}: {len(tokens)} tokens in "
+                  f"{seconds:.3f}s")
+            failed |= tokens != expected
+        index.close()
+
+    if failed:
+        print("FAIL: the index disagrees with the tokens added")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""Throughput of header-only triage against a full scan of the same corpus.
+
+Indexes a synthetic corpus (see `benchmarks.synthetic`) into a fresh
+metadata index, with and without file digests, and scans it in full. Every
+file of the corpus must be indexed without errors.
+
+    python -m benchmarks.bench_triage [--files 100] [--member-kb 32]
+"""
+import sys
+import tempfile
+from optparse import OptionParser
+from pathlib import Path
+from typing import Optional
+from benchmarks.synthetic import CorpusGenerator, corpus_options, parse_options
+from corpus import CorpusStatistics, scan_corpus
+from metadata_index import MetadataIndex, TriageStatistics, triage_corpus
+
+
+def triage(paths: list[Path], directory: Path, name: str, jobs: int,
+           hash_algorithm: Optional[str] = None) -> TriageStatistics:
+    statistics = TriageStatistics()
+    index = MetadataIndex(directory.joinpath(name))
+    try:
+        for _ in triage_corpus(paths, index, jobs, hash_algorithm, statistics):
+            pass
+    finally:
+        index.close()
+    statistics.stop()
+    return statistics
+
+
+def main() -> int:
+    parser = OptionParser(usage="python -m benchmarks.bench_triage")
+    parse_options(parser)
+    parser.add_option("-j", "--jobs", type="int", dest="jobs", default=1,
+                      help="worker processes [default: %default]")
+    options, _ = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        corpus_directory = directory.joinpath("corpus")
+        try:
+            CorpusGenerator(corpus_options(options)).write(corpus_directory)
+        except ValueError as error:
+            parser.error(str(error))
+        paths = sorted(path for path in corpus_directory.iterdir()
+                       if path.suffix in (".crx", ".xpi"))
+
+        header_only = triage(paths, directory, "metadata.sqlite3",
+                             options.jobs)
+        with_digests = triage(paths, directory, "digests.sqlite3",
+                              options.jobs, "md5")
+        full_scan = CorpusStatistics()
+        for result in scan_corpus(paths, options.jobs):
+            full_scan.add(result)
+        full_scan.stop()
+
+    print(f"triage:              {header_only.summary()}")
+    print(f"triage with digests: {with_digests.summary()}")
+    print(f"full scan:           {full_scan.summary()}")
+    if header_only.errors or header_only.files != len(paths):
+        print("FAIL: not every file was indexed")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
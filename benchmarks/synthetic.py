@@ -0,0 +1,341 @@
+"""Reproducible synthetic CRX2, CRX3 and XPI corpora with planted API keys.
+
+Every file is a deterministic function of the seed and the options: members
+are JavaScript-like filler at a given size and compression level, with
+tokens planted at a given density. Tokens are sampled from the expressions
+of `configuration.yml` and cycle through every strict service and every
+broad sub-service, so each one is planted once the corpus holds enough
+tokens. A `planted.json` file lists the planted tokens of every file.
+
+    python -m benchmarks.synthetic <directory> [--files 20] [--seed 0] ...
+"""
+import hashlib
+import json
+import random
+import re
+import string
+import struct
+import sys
+import zipfile
+from dataclasses import asdict, dataclass
+from io import BytesIO
+from optparse import OptionParser
+from pathlib import Path
+from typing import Optional
+from configuration import API_PATTERNS, ApiKeyPattern
+from crx3_pb2 import AsymmetricKeyProof, CrxFileHeader, SignedData
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+    from re import _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+
+FORMATS = ("crx2", "crx3", "xpi")
+SUFFIXES = {"crx2": ".crx", "crx3": ".crx", "xpi": ".xpi"}
+ZIP_DATE_TIME = (2020, 1, 1, 0, 0, 0)
+MAXIMUM_REPEAT = 24  # Unbounded repeats are sampled up to this many times
+FILLER_WORDS = ("function", "return", "var", "const", "this", "null",
+                "document", "window", "length", "push", "map", "then",
+                "value", "index", "data", "item", "node", "event")
+
+CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: string.digits,
+    sre_constants.CATEGORY_WORD: string.ascii_letters + string.digits + "_",
+    sre_constants.CATEGORY_SPACE: " ",
+}
+
+
+@dataclass
+class CorpusOptions:
+    files: int = 20
+    formats: tuple[str, ...] = FORMATS
+    members: int = 20
+    member_size: int = 64 * 1024  # 64kb
+    compression_level: int = 6  # 0 stores the members uncompressed
+    tokens_per_megabyte: float = 50.0
+    seed: int = 0
+
+
+@dataclass
+class PlantedToken:
+    service_name: str
+    token: str
+    repository_path: str
+
+
+def character_set(items: list, generator: random.Random) -> str:
+    """Samples one character of a parsed character class."""
+    characters: list[str] = []
+    negate = False
+    for operation, argument in items:
+        if operation is sre_constants.NEGATE:
+            negate = True
+        elif operation is sre_constants.LITERAL:
+            characters.append(chr(argument))
+        elif operation is sre_constants.RANGE:
+            characters.extend(map(chr, range(argument[0], argument[1] + 1)))
+        elif operation is sre_constants.CATEGORY:
+            characters.extend(CATEGORIES.get(argument, ""))
+    if negate:
+        characters = [character for character in string.ascii_letters
+                      if character not in characters]
+    return generator.choice(characters)
+
+
+def sample_parsed(parsed, generator: random.Random) -> str:
+    parts: list[str] = []
+    for operation, argument in parsed:
+        if operation is sre_constants.LITERAL:
+            parts.append(chr(argument))
+        elif operation is sre_constants.NOT_LITERAL:
+            parts.append(generator.choice(
+                string.ascii_letters.replace(chr(argument), "")))
+        elif operation is sre_constants.ANY:
+            parts.append(generator.choice(string.ascii_letters))
+        elif operation is sre_constants.IN:
+            parts.append(character_set(argument, generator))
+        elif operation is sre_constants.CATEGORY:
+            parts.append(generator.choice(CATEGORIES[argument]))
+        elif operation in (sre_constants.MAX_REPEAT,
+                           sre_constants.MIN_REPEAT):
+            minimum, maximum, item = argument
+            maximum = min(maximum, max(minimum, MAXIMUM_REPEAT))
+            for _ in range(generator.randint(minimum, maximum)):
+                parts.append(sample_parsed(item, generator))
+        elif operation is sre_constants.SUBPATTERN:
+            parts.append(sample_parsed(argument[-1], generator))
+        elif operation is sre_constants.BRANCH:
+            parts.append(sample_parsed(generator.choice(argument[1]),
+                                       generator))
+        # Anchors and lookarounds add nothing to the sample
+    return "".join(parts)
+
+
+def sample_match(expression: re.Pattern, generator: random.Random) -> str:
+    """Returns a random string matched in full by the expression."""
+    parsed = sre_parse.parse(expression.pattern, expression.flags)
+    for _ in range(100):
+        sample = sample_parsed(parsed, generator)
+        if expression.fullmatch(sample) is not None:
+            return sample
+    raise ValueError(f"Could not sample {expression.pattern!r}")
+
+
+def plantable_services(api_patterns: list[ApiKeyPattern]
+                       ) -> list[tuple[ApiKeyPattern, bool]]:
+    """Returns every strict service and broad sub-service to be planted.
+
+    The flag tells whether the service is only found through a broad
+    pattern, i.e. its token must be planted in an authorization header.
+    """
+    services: list[tuple[ApiKeyPattern, bool]] = []
+    seen: set[int] = set()
+    for api_pattern in api_patterns:
+        broad = api_pattern.service_name == "Unknown"
+        candidates = api_pattern.sub_services if broad \
+            else [api_pattern] + api_pattern.sub_services
+        for service in candidates:
+            if id(service) not in seen:
+                seen.add(id(service))
+                services.append((service, broad))
+    return services
+
+
+def plant(service: ApiKeyPattern, broad: bool,
+          generator: random.Random) -> tuple[str, str]:
+    """Returns a token of the service and a statement holding it."""
+    token = sample_match(service.expression, generator)
+    keyword = service.keywords[0] if service.keywords else None
+    if broad:
+        if generator.random() < 0.5:
+            statement = (f'fetch("https://{keyword}/v1", {{headers: '
+                         f'{{"Authorization": "Bearer {token}"}}}});')
+        else:
+            statement = f'fetch("https://{keyword}/v1?api_key={token}&q=1");'
+    elif keyword is not None:
+        statement = f'const endpoint = "https://{keyword}", key = "{token}";'
+    else:
+        statement = f'const key = "{token}";'
+    return token, statement
+
+
+def filler(size: int, generator: random.Random) -> str:
+    statements: list[str] = []
+    length = 0
+    while length < size:
+        words = generator.choices(FILLER_WORDS, k=generator.randint(2, 6))
+        statement = (f"{words[0]}.{words[1]}({', '.join(words[2:])});"
+                     f"{generator.choice((' ', chr(10)))}")
+        statements.append(statement)
+        length += len(statement)
+    return "".join(statements)[:size]
+
+
+class CorpusGenerator:
+    """Writes a reproducible corpus of synthetic extension files."""
+
+    def __init__(self, options: Optional[CorpusOptions] = None,
+                 api_patterns: Optional[list[ApiKeyPattern]] = None):
+        self.options = options if options is not None else CorpusOptions()
+        self.generator = random.Random(self.options.seed)
+        self.services = plantable_services(
+            api_patterns if api_patterns is not None else API_PATTERNS)
+        self.next_service = 0
+
+    def member(self, repository_path: str,
+               planted: list[PlantedToken]) -> bytes:
+        """Returns the content of one member, with its tokens planted."""
+        size = self.options.member_size
+        token_count = int(self.options.tokens_per_megabyte * size
+                          / (1024 * 1024))
+        if self.generator.random() < (self.options.tokens_per_megabyte * size
+                                      / (1024 * 1024)) - token_count:
+            token_count += 1
+
+        statements: list[str] = []
+        for _ in range(token_count):
+            service, broad = self.services[
+                self.next_service % len(self.services)]
+            self.next_service += 1
+            token, statement = plant(service, broad, self.generator)
+            statements.append(statement)
+            planted.append(PlantedToken(service.service_name, token,
+                                        repository_path))
+
+        planted_length = sum(len(statement) + 1 for statement in statements)
+        pieces = [filler(max(size - planted_length, 0) // (token_count + 1),
+                         self.generator) for _ in range(token_count + 1)]
+        content = pieces[0]
+        for statement, piece in zip(statements, pieces[1:]):
+            content += f"\n{statement}\n{piece}"
+        return content.encode("utf-8")
+
+    def archive(self, planted: list[PlantedToken]) -> bytes:
+        """Returns a ZIP archive of `options.members` script members."""
+        compression = zipfile.ZIP_DEFLATED \
+            if self.options.compression_level > 0 else zipfile.ZIP_STORED
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            manifest = zipfile.ZipInfo("manifest.json", ZIP_DATE_TIME)
+            archive.writestr(manifest, json.dumps(
+                {"manifest_version": 3, "name": "synthetic"}))
+            for index in range(self.options.members):
+                repository_path = f"js/module{index}.js"
+                info = zipfile.ZipInfo(repository_path, ZIP_DATE_TIME)
+                info.compress_type = compression
+                archive.writestr(
+                    info, self.member(repository_path, planted),
+                    compresslevel=self.options.compression_level or None)
+        return buffer.getvalue()
+
+    def key_pair(self) -> tuple[bytes, bytes]:
+        return (self.generator.randbytes(294), self.generator.randbytes(256))
+
+    def crx2(self, archive: bytes) -> bytes:
+        public_key, signature = self.key_pair()
+        return (b"Cr24" + struct.pack("<III", 2, len(public_key),
+                                      len(signature))
+                + public_key + signature + archive)
+
+    def crx3(self, archive: bytes) -> bytes:
+        public_key, signature = self.key_pair()
+        # Chrome derives the id from the first 16 bytes of the key's SHA-256
+        crx_id = hashlib.sha256(public_key).digest()[:16]
+        header = CrxFileHeader(
+            sha256_with_rsa=[AsymmetricKeyProof(public_key=public_key,
+                                                signature=signature)],
+            signed_header_data=SignedData(crx_id=crx_id).SerializeToString())
+        header_bytes = header.SerializeToString()
+        return (b"Cr24" + struct.pack("<II", 3, len(header_bytes))
+                + header_bytes + archive)
+
+    def write(self, directory: Path) -> dict[str, list[dict]]:
+        """Writes the corpus and returns the planted tokens of every file."""
+        directory.mkdir(parents=True, exist_ok=True)
+        planted_tokens: dict[str, list[dict]] = {}
+        for index in range(self.options.files):
+            file_format = self.options.formats[
+                index % len(self.options.formats)]
+            planted: list[PlantedToken] = []
+            archive = self.archive(planted)
+            if file_format == "crx2":
+                data = self.crx2(archive)
+            elif file_format == "crx3":
+                data = self.crx3(archive)
+            else:
+                data = archive
+
+            name = f"extension{index:04d}-{file_format}" \
+                   f"{SUFFIXES[file_format]}"
+            directory.joinpath(name).write_bytes(data)
+            planted_tokens[name] = [asdict(token) for token in planted]
+
+        with open(directory.joinpath("planted.json"), "w") as planted_file:
+            json.dump({"options": asdict(self.options),
+                       "files": planted_tokens}, planted_file, indent=1)
+        return planted_tokens
+
+
+def parse_options(parser: OptionParser) -> None:
+    """Adds the corpus options shared by the benchmark scripts."""
+    defaults = CorpusOptions()
+    parser.add_option("--files", type="int", dest="files",
+                      default=defaults.files,
+                      help="number of extension files [default: %default]")
+    parser.add_option("--formats", type="string", dest="formats",
+                      default=",".join(defaults.formats),
+                      help="comma separated file formats [default: %default]")
+    parser.add_option("--members", type="int", dest="members",
+                      default=defaults.members,
+                      help="script members per file [default: %default]")
+    parser.add_option("--member-kb", type="int", dest="member_kb",
+                      default=defaults.member_size // 1024,
+                      help="size of every member in KB [default: %default]")
+    parser.add_option("--compression-level", type="int",
+                      dest="compression_level",
+                      default=defaults.compression_level,
+                      help="deflate level, 0 to store [default: %default]")
+    parser.add_option("--tokens-per-mb", type="float", dest="tokens_per_mb",
+                      default=defaults.tokens_per_megabyte,
+                      help="planted tokens per MB of member content "
+                           "[default: %default]")
+    parser.add_option("--seed", type="int", dest="seed",
+                      default=defaults.seed,
+                      help="random seed [default: %default]")
+
+
+def corpus_options(options) -> CorpusOptions:
+    formats = tuple(name.strip() for name in options.formats.split(","))
+    for name in formats:
+        if name not in FORMATS:
+            raise ValueError(f"Unknown format: {name}")
+    return CorpusOptions(files=options.files, formats=formats,
+                         members=options.members,
+                         member_size=options.member_kb * 1024,
+                         compression_level=options.compression_level,
+                         tokens_per_megabyte=options.tokens_per_mb,
+                         seed=options.seed)
+
+
+def main() -> int:
+    parser = OptionParser(usage="python -m benchmarks.synthetic <directory>")
+    parse_options(parser)
+    options, arguments = parser.parse_args()
+    if len(arguments) != 1:
+        parser.error("expected the output directory")
+
+    try:
+        corpus = corpus_options(options)
+    except ValueError as error:
+        parser.error(str(error))
+    planted = CorpusGenerator(corpus).write(Path(arguments[0]))
+    print(f"wrote {len(planted)} files with "
+          f"{sum(map(len, planted.values()))} planted tokens")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+import importlib
+import math
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Optional
+
+
+LOWER, UPPER, DIGIT, SYMBOL = range(4)
+CHARACTER_CLASSES = 4
+
+
+def character_class(byte: int) -> int:
+    if 97 <= byte <= 122:
+        return LOWER
+    if 65 <= byte <= 90:
+        return UPPER
+    if 48 <= byte <= 57:
+        return DIGIT
+    return SYMBOL
+
+
+CLASS_TABLE = bytes(character_class(byte) for byte in range(256))
+
+_numpy: dict[str, Any] = {}
+
+
+def numpy_module() -> Optional[Any]:
+    """Imports NumPy on first use; returns None if it is not installed.
+
+    Loading it takes longer than parsing the ruleset, so it is not imported
+    until a token is scored.
+    """
+    if "numpy" not in _numpy:
+        try:
+            _numpy["numpy"] = importlib.import_module("numpy")
+        except ImportError:
+            _numpy["numpy"] = None
+    return _numpy["numpy"]
+
+
+@dataclass(frozen=True)
+class CandidateThresholds:
+    """Least features a token of a service must have to be reported.
+
+    The entropy is the Shannon entropy of the token's bytes, in bits per
+    byte; the classes count which of lower case letters, upper case letters,
+    digits and other bytes occur in it.
+    """
+    min_length: int = 0
+    min_entropy: float = 0.0
+    min_classes: int = 0
+
+    @classmethod
+    def parse(cls, data: Optional[dict]) -> Optional["CandidateThresholds"]:
+        if data is None:
+            return None
+        return cls(int(data.get("min_length", 0)),
+                   float(data.get("min_entropy", 0.0)),
+                   int(data.get("min_classes", 0)))
+
+    def accepts(self, length: int, entropy: float, classes: int) -> bool:
+        return length >= self.min_length and classes >= self.min_classes \
+            and entropy >= self.min_entropy - 1e-9
+
+
+def loosest(thresholds: list[Optional[CandidateThresholds]]
+            ) -> Optional[CandidateThresholds]:
+    """Returns the least of every threshold; a token below it fails them all.
+
+    A missing threshold accepts every token, and so does the result.
+    """
+    if not thresholds or None in thresholds:
+        return None
+    return CandidateThresholds(
+        min(threshold.min_length for threshold in thresholds),
+        min(threshold.min_entropy for threshold in thresholds),
+        min(threshold.min_classes for threshold in thresholds))
+
+
+def token_features(tokens: list[bytes]
+                   ) -> tuple[list[int], list[float], list[int]]:
+    """Returns the length, entropy and class count of every token.
+
+    With NumPy, all tokens are scored at once: their bytes are joined into
+    one array, tagged with their token, sorted, and the runs of equal
+    (token, byte) pairs counted, so the work grows with the total length of
+    the tokens rather than with 256 counters per token.
+    """
+    if not tokens:
+        return python_token_features(tokens)
+    numpy = numpy_module()
+    if numpy is None:
+        return python_token_features(tokens)
+
+    lengths = numpy.fromiter(map(len, tokens), dtype=numpy.int64,
+                             count=len(tokens))
+    joined = numpy.frombuffer(b"".join(tokens), dtype=numpy.uint8)
+    rows = numpy.repeat(numpy.arange(len(tokens)), lengths)
+
+    pairs = numpy.sort(rows * 256 + joined)
+    starts = numpy.flatnonzero(numpy.diff(pairs, prepend=-1))
+    counts = numpy.diff(starts, append=len(pairs))
+    pair_rows = pairs[starts] // 256
+    probabilities = counts / lengths[pair_rows]
+    entropies = -numpy.bincount(
+        pair_rows, weights=probabilities * numpy.log2(probabilities),
+        minlength=len(tokens))
+
+    classes = numpy.frombuffer(CLASS_TABLE, dtype=numpy.uint8)[joined]
+    class_counts = numpy.bincount(
+        rows * CHARACTER_CLASSES + classes,
+        minlength=len(tokens) * CHARACTER_CLASSES
+    ).reshape(len(tokens), CHARACTER_CLASSES)
+    return (lengths.tolist(), entropies.tolist(),
+            (class_counts > 0).sum(axis=1).tolist())
+
+
+def python_token_features(tokens: list[bytes]
+                          ) -> tuple[list[int], list[float], list[int]]:
+    lengths, entropies, classes = [], [], []
+    for token in tokens:
+        entropy = 0.0
+        for count in Counter(token).values():
+            probability = count / len(token)
+            entropy -= probability * math.log2(probability)
+        lengths.append(len(token))
+        entropies.append(entropy)
+        classes.append(len(set(token.translate(CLASS_TABLE))))
+    return lengths, entropies, classes
+
+
+def accepted_candidates(tokens: list[bytes],
+                        thresholds: list[Optional[CandidateThresholds]]
+                        ) -> list[bool]:
+    """Scores a batch of candidate tokens against their service thresholds.
+
+    Tokens without thresholds are always accepted and are not scored.
+    """
+    accepted = [True] * len(tokens)
+    scored = [index for index, threshold in enumerate(thresholds)
+              if threshold is not None]
+    if not scored:
+        return accepted
+
+    lengths, entropies, classes = token_features(
+        [tokens[index] for index in scored])
+    for position, index in enumerate(scored):
+        accepted[index] = thresholds[index].accepts(
+            lengths[position], entropies[position], classes[position])
+    return accepted
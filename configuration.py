@@ -1,27 +1,72 @@
+import hashlib
+import json
+import os
 import re
+import tempfile
 from typing import Optional, Self
-import yaml
 from pathlib import Path
-from pprint import pprint
+from keywords import (Content, KeywordAutomaton, contains_keyword,
+                      required_prefix)
+from regex_engines import DEFAULT_ENGINE, compile_expression
+from candidate_scoring import CandidateThresholds, accepted_candidates
 
 
 cwd = Path(__file__).parent
 configuration_path = cwd.joinpath("configuration.yml")
 with open(configuration_path, "r") as configuraiton_file:
-    configuration_dict = yaml.safe_load(configuraiton_file)
+    configuration_text = configuraiton_file.read()
 
-assert configuration_dict is not None
+# Changes whenever the ruleset changes; invalidates cached scan results
+RULESET_VERSION = hashlib.sha256(configuration_text.encode("utf-8")).hexdigest()
+CACHE_DIRECTORY = Path(os.environ.get(
+    "CRX_RAY_CACHE_DIR", Path.home().joinpath(".cache", "crx-ray")))
+
+# The databases and shard keys of the other modes, defined here so the
+# command line offers them without importing those modes
+DEFAULT_METADATA_INDEX = CACHE_DIRECTORY.joinpath("metadata.sqlite3")
+DEFAULT_VERSION_HISTORY = CACHE_DIRECTORY.joinpath("versions.sqlite3")
+DEFAULT_TOKEN_INDEX = CACHE_DIRECTORY.joinpath("tokens.sqlite3")
+SHARD_KEYS = ("path", "digest")
+
+RULESET_CACHE_VERSION = 4  # Bump when the cached form of the ruleset changes
+RULESET_CACHE = CACHE_DIRECTORY.joinpath(
+    f"ruleset-{RULESET_VERSION[:16]}-{RULESET_CACHE_VERSION}.json")
+
+
+class MatchCache:
+    """Per-content memo of lookups shared by the patterns scanning it."""
+
+    def __init__(self, present_keywords: Optional[set[str]] = None,
+                    automaton: Optional[KeywordAutomaton] = None):
+        self.present_keywords = present_keywords
+        self.automaton = automaton
+        self.service_matches: dict[int, bool] = {}
+        self.resolved_services: dict[tuple[int, str], Optional[str]] = {}
+
+    def has_keyword(self, keyword: str, content: Content) -> bool:
+        """Looks the keyword up in the automaton scan of the content."""
+        if self.automaton is not None and keyword in self.automaton:
+            return keyword in self.present_keywords
+        return contains_keyword(keyword, content)
 
 
 class ApiKeyPattern:
 
     def __init__(self, service_name, pattern, keywords=None,
-                    sub_services=None):
+                    sub_services=None, engine: str = DEFAULT_ENGINE,
+                    thresholds: Optional[CandidateThresholds] = None):
         self.service_name = "Unknown" if service_name is None else service_name
+        # The engine asked for, and the one that compiled the bytes pattern
+        self.engine = engine
         self.expression = re.compile(pattern) if pattern is not None else None
+        self.byte_expression, self.byte_engine = \
+            self.compile_bytes(pattern, engine)
+        self.prefix: Optional[str] = required_prefix(self.expression)
         self.keywords: list[str] = keywords if keywords is not None else []
         self.sub_services: list[Self] = \
             sub_services if sub_services is not None else []
+        # Tokens of the service scoring below these are not reported
+        self.thresholds = thresholds
 
     @property
     def pattern(self) -> str:
@@ -32,70 +77,198 @@ class ApiKeyPattern:
     @pattern.setter
     def pattern(self, value) -> None:
         self.expression = re.compile(value)
+        self.byte_expression, self.byte_engine = \
+            self.compile_bytes(value, self.engine)
+        self.prefix = required_prefix(self.expression)
+
+    @staticmethod
+    def compile_bytes(pattern: Optional[str], engine: str = DEFAULT_ENGINE
+                      ) -> tuple[Optional[re.Pattern], str]:
+        """Compiles the pattern for raw bytes; every pattern is ASCII.
+
+        Other engines than `re` fall back to it when they are not installed
+        or cannot compile the pattern. Text is always matched with `re`.
+        """
+        if pattern is None:
+            return None, DEFAULT_ENGINE
+        return compile_expression(pattern.encode("utf-8"), engine)
+
+    def __getstate__(self) -> dict:
+        # Patterns of other engines may not pickle; they compile on load,
+        # which also picks up an engine installed since
+        state = self.__dict__.copy()
+        if self.engine != DEFAULT_ENGINE:
+            state["byte_expression"] = None
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        if self.engine != DEFAULT_ENGINE and self.expression is not None:
+            self.byte_expression, self.byte_engine = self.compile_bytes(
+                self.expression.pattern, self.engine)
+
+    def expression_for(self, content: Content) -> re.Pattern:
+        if isinstance(content, str):
+            return self.expression
+        return self.byte_expression
+
+    def engine_for(self, content: Content) -> str:
+        if isinstance(content, str):
+            return DEFAULT_ENGINE
+        return self.byte_engine
     
     def __repr__(self) -> str:
         return str(self.__dict__)
     
-    def check_all_keywords(self, content) -> bool:
+    def check_all_keywords(self, content,
+                            cache: Optional[MatchCache] = None) -> bool:
         if len(self.keywords) == 0:
             return True
         for keyword in self.keywords:
-            if keyword not in content:
+            if cache is not None:
+                if not cache.has_keyword(keyword, content):
+                    return False
+            elif not contains_keyword(keyword, content):
                 return False
         return True
 
-    def check_any_keyword(self, content) -> bool:
+    def check_any_keyword(self, content,
+                            cache: Optional[MatchCache] = None) -> bool:
         if len(self.keywords) == 0:
             return True
         for keyword in self.keywords:
-            if keyword in content:
+            if cache is not None:
+                if cache.has_keyword(keyword, content):
+                    return True
+            elif contains_keyword(keyword, content):
                 return True
         return False
+
+    def literals(self) -> set[str]:
+        """Returns the keywords and prefixes of the service and sub-services."""
+        literals = set(self.keywords)
+        if self.prefix is not None:
+            literals.add(self.prefix)
+        for service in self.sub_services:
+            literals |= service.literals()
+        return literals
     
-    def match_subservices(self, match_string: str,
-                            content: str) -> Optional[str]:
+    def has_match(self, content: Content,
+                    cache: Optional[MatchCache] = None) -> bool:
+        """Returns whether the service matches anywhere in the content."""
+        if cache is not None and id(self) in cache.service_matches:
+            return cache.service_matches[id(self)]
+
+        found = (self.check_any_keyword(content, cache)
+                 and self.expression_for(content).search(content) is not None)
+        if cache is not None:
+            cache.service_matches[id(self)] = found
+        return found
+
+    def match_subservices(self, match_string: str, content: Content,
+                            cache: Optional[MatchCache] = None
+                            ) -> Optional[str]:
+        if cache is None:
+            cache = MatchCache()
+
+        key = (id(self), match_string)
+        if key in cache.resolved_services:
+            return cache.resolved_services[key]
+
+        service_name = None
         for service in self.sub_services:
             if service.expression.match(match_string) is None:
                 continue
-            matches = service.find_matches_with_context(content,
-                                                        context_length=0)
-            if len(matches) > 0:
-                return service.service_name
+            if service.has_match(content, cache):
+                service_name = service.service_name
+                break
 
-        return None
+        cache.resolved_services[key] = service_name
+        return service_name
     
     def find_matches_with_context(
-            self, content: str, context_length=250) -> list[(str, str, str)]:
-        if not self.check_any_keyword(content):
+            self, content: Content, context_length=250,
+            cache: Optional[MatchCache] = None
+    ) -> list[(str, str, str, int, int)]:
+        """Returns (service name, token, context, start, end) for every match.
+
+        Raw bytes are matched with the compiled bytes pattern; only the token
+        and the context window of each match are decoded, and the context
+        length and the token offsets then count bytes. Tokens scoring below
+        the thresholds of their service are dropped before their context is
+        built.
+        """
+        if cache is None:
+            cache = MatchCache()
+        if not self.check_any_keyword(content, cache):
             return []
         
-        found_matches = self.expression.finditer(content)
-        matches_with_context: list[(str, str)] = []
+        found_matches = self.expression_for(content).finditer(content)
+        matches_with_context: list[(str, str, str, int, int)] = []
+        content_view = None if isinstance(content, str) \
+            else memoryview(content)
 
+        candidates = []
         for result in found_matches:
-            match_string = \
-                result.group(1) if result.groups() else result.group(0)
-            
+            token_group = 1 if result.groups() else 0
+            match_string = result.group(token_group)
+            if content_view is not None:
+                match_string = match_string.decode("utf-8", errors="replace")
+            service_name = self.match_subservices(match_string, content,
+                                                  cache)
+            candidates.append((result, token_group, match_string,
+                               service_name))
+
+        # Scored in one batch, before any context is built
+        accepted = accepted_candidates(
+            [result.group(token_group) if content_view is not None
+             else match_string.encode("utf-8")
+             for result, token_group, match_string, _ in candidates],
+            [self.thresholds_for(service_name)
+             for _, _, _, service_name in candidates])
+        for (result, token_group, match_string, service_name), keep in zip(
+                candidates, accepted):
+            if not keep:
+                continue
             start_index = max(0, result.start() - context_length)
             end_index = min(len(content), result.end() + context_length)
-            context_before = content[start_index:result.start()]
-            context_after = content[result.end():end_index]
-            service_name = self.match_subservices(match_string, content)
+            if content_view is None:
+                context_before = content[start_index:result.start()]
+                context_after = content[result.end():end_index]
+                context = context_before + result.group(0) + context_after
+            else:
+                context = str(content_view[start_index:end_index],
+                              "utf-8", "replace")
 
             matches_with_context.append((
                 service_name if service_name is not None else self.service_name,
                 match_string, 
-                context_before + result.group(0) + context_after
+                context,
+                result.start(token_group),
+                result.end(token_group)
             ))
 
         return matches_with_context
     
+    def thresholds_for(self, service_name: Optional[str]
+                       ) -> Optional[CandidateThresholds]:
+        """Returns the thresholds of a resolved sub-service, or our own."""
+        if service_name is not None:
+            for service in self.sub_services:
+                if service.service_name == service_name:
+                    return service.thresholds
+        return self.thresholds
+
     @classmethod
-    def parse_service(cls, service_name, service_data: dict|str) -> Self:
+    def parse_service(cls, service_name, service_data: dict|str,
+                      engine: str = DEFAULT_ENGINE) -> Self:
         if isinstance(service_data, str):
-            return cls(service_name, service_data)
+            return cls(service_name, service_data, engine=engine)
         elif isinstance(service_data, dict):
             pattern = service_data.get("pattern")
+            engine = service_data.get("engine", engine)
+            thresholds = CandidateThresholds.parse(
+                service_data.get("thresholds"))
             keywords = service_data.get("keywords")
             if isinstance(keywords, str):
                 keywords = [keywords]
@@ -103,29 +276,40 @@ class ApiKeyPattern:
             if service_data.get("subservices") is not None:
                 for sub_name, sub_data in service_data["subservices"].items():
                     full_name = service_name + sub_name
-                    sub_service = cls.parse_service(full_name, sub_data)
+                    sub_service = cls.parse_service(full_name, sub_data,
+                                                    engine)
                     if sub_service.pattern is None:
                         sub_service.pattern = pattern
+                    if sub_service.thresholds is None:
+                        sub_service.thresholds = thresholds
                     sub_services.append(sub_service)
-            return cls(service_name, pattern, keywords, sub_services)
+            return cls(service_name, pattern, keywords, sub_services, engine,
+                       thresholds)
     
     @classmethod
-    def parse_configuration(cls, configuration: dict) -> list[Self]:
+    def parse_configuration(cls, configuration: dict,
+                            engine: str = DEFAULT_ENGINE) -> list[Self]:
         api_services: list[Self] = []
         for service_name, service_data in configuration["strict"].items():
             api_services.append(
-                cls.parse_service(service_name, service_data)
+                cls.parse_service(service_name, service_data, engine)
             )
 
         broad_services: list[Self] = []
         for (service_name,
                 service_data) in configuration["broad"]["services"].items():
             broad_services.append(
-                cls.parse_service(service_name, service_data)
+                cls.parse_service(service_name, service_data, engine)
             )
 
         for pattern in configuration["broad"]["patterns"]:
-            service = cls(None, pattern)
+            if isinstance(pattern, dict):
+                service = cls(None, pattern["pattern"],
+                              engine=pattern.get("engine", engine),
+                              thresholds=CandidateThresholds.parse(
+                                  pattern.get("thresholds")))
+            else:
+                service = cls(None, pattern, engine=engine)
             service.sub_services = broad_services
             for sub_service in broad_services:
                 service.keywords.extend(sub_service.keywords)
@@ -133,11 +317,82 @@ class ApiKeyPattern:
 
         return api_services
 
+    @staticmethod
+    def build_keyword_automaton(api_patterns: list[Self]) -> KeywordAutomaton:
+        """Builds one automaton over the literals of every pattern."""
+        literals: set[str] = set()
+        for api_pattern in api_patterns:
+            literals |= api_pattern.literals()
+        return KeywordAutomaton(literals)
+
+
+def parse_ruleset(configuration_dict: dict
+                  ) -> tuple[list[ApiKeyPattern], KeywordAutomaton]:
+    """Builds the patterns and their automaton from the parsed ruleset."""
+    api_patterns = ApiKeyPattern.parse_configuration(
+        configuration_dict["service_patterns"],
+        configuration_dict.get("regex_engine", DEFAULT_ENGINE))
+    automaton = ApiKeyPattern.build_keyword_automaton(api_patterns)
+    # Contents are scanned as bytes, so cache that backend as well
+    automaton.build_binary_backend()
+    return api_patterns, automaton
+
 
-API_PATTERNS = ApiKeyPattern.parse_configuration(
-    configuration_dict["service_patterns"])
+def engine_fallbacks(api_patterns: list[ApiKeyPattern]
+                     ) -> dict[str, list[str]]:
+    """Services whose bytes pattern fell back to `re`, by engine asked for."""
+    fallbacks: dict[str, list[str]] = {}
+    for api_pattern in api_patterns:
+        for service in [api_pattern, *api_pattern.sub_services]:
+            if service.expression is not None \
+                    and service.byte_engine != service.engine:
+                fallbacks.setdefault(service.engine, []).append(
+                    service.service_name)
+    return fallbacks
+
+
+def load_ruleset(cache_path: Optional[Path] = RULESET_CACHE
+                 ) -> tuple[list[ApiKeyPattern], KeywordAutomaton]:
+    """Loads the ruleset, caching the parsed YAML as JSON.
+
+    The cache file is named after the hash of the YAML ruleset, so editing
+    the ruleset never loads a stale cache. It only holds plain data, so a
+    file planted in the cache directory cannot run code; the patterns and
+    the automaton are built from it on every start.
+    """
+    configuration_dict = None
+    if cache_path is not None:
+        try:
+            with open(cache_path, "r", encoding="utf-8") as cache_file:
+                configuration_dict = json.load(cache_file)
+        except (OSError, ValueError):
+            pass  # Missing or corrupted; rebuild it
+
+    if not isinstance(configuration_dict, dict):
+        import yaml  # Only needed when the ruleset cache is cold
+
+        configuration_dict = yaml.safe_load(configuration_text)
+        assert configuration_dict is not None
+        if cache_path is not None:
+            try:
+                cache_path.parent.mkdir(parents=True, exist_ok=True)
+                # Written aside and renamed, so readers never see a partial
+                # file
+                with tempfile.NamedTemporaryFile(
+                        "w", encoding="utf-8", dir=cache_path.parent,
+                        delete=False) as cache_file:
+                    json.dump(configuration_dict, cache_file)
+                os.replace(cache_file.name, cache_path)
+            except OSError:
+                pass  # A read-only cache directory only costs the parse
+    return parse_ruleset(configuration_dict)
+
+
+API_PATTERNS, KEYWORD_AUTOMATON = load_ruleset()
 
 if __name__ == "__main__":
+    from pprint import pprint
+
     # Print the configuration
     for pattern in API_PATTERNS:
         pprint(pattern)
\ No newline at end of file
@@ -0,0 +1,286 @@
+import glob
+import os
+import time
+from collections import deque
+from dataclasses import replace
+from functools import partial
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Optional
+from archive_io import digest_mapping, map_file
+from pipeline import READ_STAGE, STAGES
+from profiling import ScanProfile
+from scan_cache import MemberCache, ResultCache
+from scanner import (ScanOptions, ScanResult, cache_scan_result,
+                     record_scan_version, scan_extension_file)
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
+    from version_history import VersionHistory
+
+
+EXTENSION_SUFFIXES = (".crx", ".xpi")
+GLOB_CHARACTERS = ("*", "?", "[")
+
+
+def collect_extension_paths(inputs: Iterable[str],
+                            manifest_path: Optional[Path] = None) -> list[Path]:
+    """Expands directories, globs and manifest entries into file paths."""
+
+    def expand(entry: str) -> list[Path]:
+        path = Path(entry)
+        if path.is_dir():
+            return sorted(
+                file_path for file_path in path.rglob("*")
+                if file_path.suffix in EXTENSION_SUFFIXES
+                and file_path.is_file()
+            )
+        if any(character in entry for character in GLOB_CHARACTERS):
+            return [Path(match)
+                    for match in sorted(glob.glob(entry, recursive=True))
+                    if Path(match).is_file()]
+        return [path]
+
+    entries = list(inputs)
+    if manifest_path is not None:
+        with open(manifest_path, "r") as manifest_file:
+            for line in manifest_file:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    entries.append(line)
+
+    paths: list[Path] = []
+    seen: set[Path] = set()
+    for entry in entries:
+        for path in expand(entry):
+            if path not in seen:
+                seen.add(path)
+                paths.append(path)
+    return paths
+
+
+def ordered_map(executor: "Executor", function: Callable, items: Iterable,
+                window: int) -> Iterator:
+    """Maps items over an executor, yielding results in submission order.
+
+    Unlike `Executor.map`, at most `window` items are in flight, so huge
+    corpora do not queue a future for every file up front.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def read_archive(path: Path, hash_algorithm: str
+                 ) -> tuple[Path, Optional[str], float]:
+    """Reads a file through the page cache and returns its digest."""
+    started = time.perf_counter()
+    try:
+        mapping = map_file(path)
+        try:
+            digest = digest_mapping(mapping, hash_algorithm)
+        finally:
+            mapping.close()
+    except OSError:
+        digest = None  # Reported by the scan
+    return path, digest, time.perf_counter() - started
+
+
+def prefetch_archives(paths: Iterable[Path], hash_algorithm: str,
+                      threads: int, window: int
+                      ) -> Iterator[tuple[Path, Optional[str], float]]:
+    """Reads and hashes upcoming files in threads, in input order.
+
+    Hashing releases the GIL, so the threads keep the storage busy while
+    the scans run, and the scans find the files in the page cache with
+    their digests already computed.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    executor = ThreadPoolExecutor(max_workers=threads,
+                                  thread_name_prefix="archive-prefetch")
+    try:
+        yield from ordered_map(executor,
+                               partial(read_archive,
+                                       hash_algorithm=hash_algorithm),
+                               paths, window)
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def scan_prefetched(item: tuple[Path, Optional[str], float],
+                    options: ScanOptions) -> ScanResult:
+    path, digest, read_seconds = item
+    result = scan_extension_file(path, options, digest=digest)
+    result.stage_seconds[READ_STAGE] = read_seconds
+    return result
+
+
+def scan_corpus(paths: Iterable[Path], jobs: Optional[int] = None,
+                options: Optional[ScanOptions] = None,
+                result_cache: Optional[ResultCache] = None,
+                member_cache: Optional[MemberCache] = None,
+                version_history: Optional["VersionHistory"] = None,
+                prefetch: int = 0) -> Iterator[ScanResult]:
+    """Scans extension files across worker processes in input order.
+
+    Workers only read the result and member caches and the version history;
+    new findings are stored by the calling process, which is their single
+    writer. Versions of an extension scanned at the same time are compared
+    with the version stored before either. With a time budget, the scans
+    run in watched workers, even with one job. Otherwise, `prefetch`
+    threads read and hash the upcoming files while the workers scan.
+    """
+    jobs = jobs if jobs is not None else os.cpu_count() or 1
+    options = replace(
+        options if options is not None else ScanOptions(),
+        result_cache_path=result_cache.path
+        if result_cache is not None else None,
+        deduplicate_members=member_cache is not None,
+        member_cache_path=member_cache.path
+        if member_cache is not None else None,
+        version_history_path=version_history.path
+        if version_history is not None else None)
+    scan = partial(scan_extension_file, options=options)
+    if prefetch > 0 and options.member_timeout is None \
+            and options.extension_timeout is None:
+        paths = prefetch_archives(paths, options.hash_algorithm, prefetch,
+                                  window=(jobs + prefetch) * 4)
+        scan = partial(scan_prefetched, options=options)
+
+    # Process pools are only imported by the runs that need them
+    executor = None
+    if options.member_timeout is not None \
+            or options.extension_timeout is not None:
+        from scan_watchdog import WatchdogPool
+        executor = WatchdogPool(jobs, options)
+        results = executor.map(paths)
+    elif jobs <= 1:
+        results = map(scan, paths)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        results = ordered_map(executor, scan, paths, window=jobs * 4)
+
+    try:
+        for result in results:
+            if result_cache is not None or member_cache is not None:
+                cache_scan_result(result_cache, result,
+                                  options.hash_algorithm, member_cache)
+            if version_history is not None:
+                record_scan_version(version_history, result)
+            yield result
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+class CorpusStatistics:
+    """Throughput counters of a corpus scan.
+
+    The profiles of profiled scans are merged into `profile`.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.findings = 0
+        self.errors = 0
+        self.incomplete_files = 0
+        self.incomplete_members = 0
+        self.skipped_members: dict[str, int] = {}
+        self.stage_seconds: dict[str, float] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.member_hits = 0
+        self.member_misses = 0
+        self.unchanged_members = 0
+        self.changed_members = 0
+        self.profile: Optional[ScanProfile] = None
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    def add(self, result: ScanResult) -> None:
+        self.files += 1
+        self.bytes += result.size
+        self.findings += len(result.findings)
+        self.member_hits += result.member_hits
+        self.member_misses += result.member_misses
+        if result.version_changes is not None:
+            self.unchanged_members += result.version_changes.unchanged
+            self.changed_members += len(result.version_changes.added) \
+                + len(result.version_changes.changed)
+        if result.profile is not None:
+            if self.profile is None:
+                self.profile = ScanProfile()
+            self.profile.merge(result.profile, result.size)
+        for name, seconds in result.stage_seconds.items():
+            self.stage_seconds[name] = \
+                self.stage_seconds.get(name, 0.0) + seconds
+        for reason, count in result.skipped_members.items():
+            self.skipped_members[reason] = \
+                self.skipped_members.get(reason, 0) + count
+        if result.incomplete:
+            self.incomplete_files += 1
+            self.incomplete_members += len(result.incomplete)
+        if result.error is not None:
+            self.errors += 1
+        elif result.cached:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+
+    def stop(self) -> None:
+        self.finished = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        finished = self.finished if self.finished is not None \
+            else time.perf_counter()
+        return max(finished - self.started, 1e-9)
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.elapsed
+
+    @property
+    def megabytes_per_second(self) -> float:
+        return self.bytes / (1024 * 1024) / self.elapsed
+
+    def summary(self, include_cache: bool = False,
+                include_members: bool = False,
+                include_versions: bool = False,
+                include_pipeline: bool = False) -> str:
+        summary = (f"Scanned {self.files} files "
+                   f"({self.bytes / (1024 * 1024):.2f} MB) "
+                   f"in {self.elapsed:.2f}s: "
+                   f"{self.files_per_second:.2f} files/sec, "
+                   f"{self.megabytes_per_second:.2f} MB/sec, "
+                   f"{self.findings} findings, {self.errors} errors")
+        if self.incomplete_files:
+            summary += (f", {self.incomplete_members} members of "
+                        f"{self.incomplete_files} files incomplete")
+        if self.skipped_members:
+            summary += (f", {sum(self.skipped_members.values())} members "
+                        f"skipped (" + ", ".join(
+                            f"{count} by {reason}" for reason, count
+                            in sorted(self.skipped_members.items())) + ")")
+        if include_cache:
+            summary += (f", cache {self.cache_hits} hits / "
+                        f"{self.cache_misses} misses")
+        if include_members:
+            summary += (f", members {self.member_hits} deduplicated / "
+                        f"{self.member_misses} scanned")
+        if include_versions:
+            summary += (f", members {self.unchanged_members} unchanged / "
+                        f"{self.changed_members} added or changed since "
+                        f"previous versions")
+        if include_pipeline:
+            # Busy threads on average; compare with the threads of a stage
+            summary += ", busy threads " + " / ".join(
+                f"{name} {self.stage_seconds[name] / self.elapsed:.2f}"
+                for name in STAGES if name in self.stage_seconds)
+        return summary
@@ -1,23 +1,29 @@
 from io import BufferedReader, BytesIO, TextIOWrapper
 import os
-from typing import IO, Optional
-from zipfile import BadZipFile, ZipFile
-from hashlib import md5
+from typing import IO, TYPE_CHECKING, Iterator, Optional
+from zipfile import BadZipFile, ZipFile, ZipInfo
+import hashlib
 from pathlib import Path
 from dataclasses import dataclass
-from crx3_pb2 import CrxFileHeader, SignedData
+from archive_io import (ArchiveView, DEFAULT_HASH_ALGORITHM, digest_mapping,
+                        iter_archive_resources, map_file, mapping_size)
+from profiling import ScanProfile, stage
 import struct
 
+if TYPE_CHECKING:
+    from crx3_pb2 import CrxFileHeader
+
 
 DEFAULT_FILTER_LIST = [
     "html", "css", "js", "json"
 ]
 
 
-@dataclass
+@dataclass(slots=True)
 class CrxResource:
     repository_path: str
     content: Optional[IO[bytes]] = None
+    info: Optional[ZipInfo] = None
 
 
 @dataclass
@@ -44,26 +50,32 @@ class CrxFile:
     }
 
     def __init__(self, crx_path: Path, filter_list: Optional[list[str]] = None,
-                    unpack_headers: Optional[bool] = True):
+                    unpack_headers: Optional[bool] = True,
+                    hash_algorithm: str = DEFAULT_HASH_ALGORITHM):
         
         assert crx_path.exists()
         self.path = crx_path
         self.crx_version: Optional[int] = None
         self._header_length: Optional[int] = None
+        self.archive_offset: int = 0
         self._file_buffer: Optional[BufferedReader] = None
+        self._mapping = None
         
         self.is_setup = False
         self.is_corrupted = False
         self.reader: BufferedReader = None
 
         self.rsa_proof: tuple[bytes, bytes] = None
+        self.ecdsa_proof = None
         self.digest: str = None
+        self.hash_algorithm = hash_algorithm
         
         self.should_unpack_headers = unpack_headers
-        self.header: Optional[CrxFileHeader] = None
+        self.header: Optional["CrxFileHeader"] = None
         self.extension_id: Optional[str] = None
         self.resources: list[CrxResource] = None
         self.filter_list: Optional[list[str]] = filter_list
+        self.profile: Optional[ScanProfile] = None
 
 
     def __enter__(self) -> BufferedReader:
@@ -76,12 +88,23 @@ class CrxFile:
     
 
     def __exit__(self, *exception_args) -> bool:
-        """Closes the file buffer without raised exceptions."""
+        """Closes the file buffer and the mapping without raised exceptions."""
+        self.close()
+        return False  # Do not suppress raised exceptions
+
+
+    def close(self) -> None:
+        """Closes the file buffer and the mapping the archive is read from.
+
+        Members still open read from the mapping, so the archive is closed
+        once they are done.
+        """
         if self._file_buffer is not None:
             self._file_buffer.close()
             self._file_buffer = None
-
-        return False  # Do not suppress raised exceptions
+        if self._mapping is not None:
+            self._mapping.close()
+            self._mapping = None
 
 
     @property
@@ -94,11 +117,14 @@ class CrxFile:
         
     @header_length.setter
     def header_length(self, length_bytes: bytes):
-        self.header_length = self.little_endian_to_int(length_bytes)
+        self._header_length = self.little_endian_to_int(length_bytes)
     
 
     def compute_digest(self) -> str:
-        hasher = md5()
+        if self._mapping is not None:
+            return digest_mapping(self._mapping, self.hash_algorithm)
+
+        hasher = hashlib.new(self.hash_algorithm)
         with open(self.path, "rb") as file_bytes:
             while True:
                 block = file_bytes.read(self.DIGEST_BUFFER)
@@ -109,13 +135,14 @@ class CrxFile:
 
 
     def setup(self, setup_resources: Optional[bool] = True,
-                force_setup: Optional[bool] = False) -> None:
+                force_setup: Optional[bool] = False,
+                with_digest: bool = True) -> None:
         
         def assert_magic_number(buffer: BufferedReader) -> None:
             """Checks the magic number in the initial CRX header bytes."""
             crx_bytes = buffer.read(4)
 
-            magic_number = crx_bytes.decode("utf-8")
+            magic_number = crx_bytes.decode("utf-8", errors="replace")
             if magic_number != "Cr24":
                 raise BadCrx(f"'Unexpected magic number: {magic_number}.")
             
@@ -126,16 +153,30 @@ class CrxFile:
 
         if self.is_setup and not force_setup: return
 
-        self.digest = self.compute_digest()
-
-        self._file_buffer = None  # reset the file buffer
-        with self as crx_buffer:
+        # The digest, the header and the archive all read the same mapping,
+        # so the file is read from storage only once
+        self.close()
+        self._mapping = map_file(self.path)
+        if with_digest:
+            with stage(self.profile, "compute_digest") as timing:
+                self.digest = self.compute_digest()
+                timing.bytes += mapping_size(self._mapping)
+
+        with stage(self.profile, "header") as timing:
+            crx_buffer = self._mapping
+            crx_buffer.seek(0)
             assert_magic_number(crx_buffer)
-            self.crx_version = get_crx_version(crx_buffer)
-            self._route_crx_setup(self.crx_version, crx_buffer)
-            if setup_resources:
-                self.setup_resources()
-            self.is_setup = True
+            try:
+                self.crx_version = get_crx_version(crx_buffer)
+                self._route_crx_setup(self.crx_version, crx_buffer)
+            except (IndexError, struct.error) as error:
+                raise BadCrx(f"Truncated header. {error}") from error
+            # The ZIP archive starts right after the CRX header
+            self.archive_offset = crx_buffer.tell()
+            timing.bytes += self.archive_offset
+        self.is_setup = True
+        if setup_resources:
+            self.setup_resources()
 
 
     def _route_crx_setup(self, crx_version, file_buffer):
@@ -144,7 +185,7 @@ class CrxFile:
         elif crx_version == 2:
             self.setup_crx2(file_buffer)
         else:
-            raise NotImplementedError(f"Unknown version: {crx_version}")
+            raise BadCrx(f"Unknown version: {crx_version}")
 
 
     def setup_crx2(self, buffer: BufferedReader) -> None:
@@ -159,6 +200,9 @@ class CrxFile:
             buffer.read(public_key_length),
             buffer.read(signature_length)
         )
+        # A CRX2 id is the start of the SHA-256 of its public key
+        self.extension_id = self.decode_extension_id(
+            hashlib.sha256(self.rsa_proof[0]).digest()[:16])
         
 
     def decode_extension_id(self, extension_id: bytes):
@@ -175,14 +219,21 @@ class CrxFile:
     def setup_crx3(self, buffer: BufferedReader) -> None:
         if not self.should_unpack_headers: return self.strip_crx3(buffer)
 
+        # Protobuf is only imported once a CRX3 header has to be parsed
+        from google.protobuf.message import DecodeError
+        from crx3_pb2 import CrxFileHeader, SignedData
+
         header_length_bytes = buffer.read(4)
-        header_length = self.little_endian_to_int(header_length_bytes)
-        header_bytes = buffer.read(header_length)
+        self.header_length = header_length_bytes
+        header_bytes = buffer.read(self._header_length)
         self.header = CrxFileHeader()
-        self.header.ParseFromString(header_bytes)
-
         signed_data = SignedData()
-        signed_data.ParseFromString(self.header.signed_header_data)
+        try:
+            self.header.ParseFromString(header_bytes)
+            signed_data.ParseFromString(self.header.signed_header_data)
+        except DecodeError as error:
+            raise BadCrx(f"Could not parse the CRX3 header. {error}") \
+                from error
         self.extension_id = self.decode_extension_id(signed_data.crx_id)
         self.rsa_proof = self.header.sha256_with_rsa
         self.ecdsa_proof = self.header.sha256_with_ecdsa
@@ -220,13 +271,13 @@ class CrxFile:
             # self.setup_resources()
             self.setup(setup_resources=False)
 
-        with self as zip_buffer:
-            try:
-                zip_file = ZipFile(BytesIO(zip_buffer.read()))
+        try:
+            # Read the archive in place instead of copying it into memory
+            zip_file = ZipFile(ArchiveView(self._mapping, self.archive_offset))
 
-            except (BadZipFile, BadCrx):
-                self.is_corrupted = True
-                return None
+        except (BadZipFile, BadCrx):
+            self.is_corrupted = True
+            return None
 
         self.is_corrupted = False
         return zip_file
@@ -239,7 +290,7 @@ class CrxFile:
         public_key_length = struct.unpack("<I", public_key_length_bytes)[0]
         signature_length = struct.unpack("<I", signature_length_bytes)[0]
 
-        crx_file.seek(public_key_length, signature_length, os.SEEK_CUR)
+        crx_file.seek(public_key_length + signature_length, os.SEEK_CUR)
 
     @staticmethod
     def strip_crx3(crx_file: BufferedReader) -> None:
@@ -249,6 +300,20 @@ class CrxFile:
         crx_file.seek(header_length, os.SEEK_CUR)
 
         
+    def iter_resources(self) -> Iterator[CrxResource]:
+        """Yields the resources one at a time, opening each member lazily.
+
+        Unlike `setup_resources`, no member is opened up front and each one
+        is closed once the next is requested. A missing archive is reported
+        immediately rather than on the first iteration.
+        """
+        zip_archive = self.get_zip_archive()
+        if zip_archive is None:
+            raise BadCrx("Could not identify the ZIP archive.")
+
+        return iter_archive_resources(zip_archive, CrxResource, self.filter_list)
+
+
     def setup_resources(self) -> None:
 
         zip_archive = self.get_zip_archive()
@@ -260,7 +325,7 @@ class CrxFile:
             if resource_info.is_dir(): continue
             
             filename = resource_info.filename
-            resource = CrxResource(filename)
+            resource = CrxResource(filename, info=resource_info)
             if (self.filter_list is None
                 or filename.split(".")[-1] in self.filter_list):
                 # If there is no filter list specified or the extension of the
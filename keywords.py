@@ -0,0 +1,162 @@
+import re
+from typing import Any, Iterable, Optional, Union
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+MINIMUM_PREFIX_LENGTH = 2
+
+Content = Union[str, bytes, bytearray]
+
+
+def contains_keyword(keyword: str, content: Content) -> bool:
+    """Substring test of a keyword in decoded text or in raw bytes."""
+    if isinstance(content, str):
+        return keyword in content
+    return keyword.encode("utf-8") in content
+
+
+def required_prefix(expression: Optional[re.Pattern]) -> Optional[str]:
+    """Returns the literal that every match of the expression starts with."""
+    if expression is None or expression.flags & re.IGNORECASE:
+        return None
+
+    prefix: list[str] = []
+    for operation, argument in sre_parse.parse(expression.pattern,
+                                               expression.flags):
+        if operation is sre_parse.AT and not prefix:
+            continue  # Zero-width assertions such as \b before the literal
+        if operation is not sre_parse.LITERAL:
+            break
+        prefix.append(chr(argument))
+
+    if len(prefix) < MINIMUM_PREFIX_LENGTH:
+        return None
+    return "".join(prefix)
+
+
+class _AhoCorasickBackend:
+    """Keyword automaton backed by the pyahocorasick C extension.
+
+    The extension only scans text, so a binary backend scans raw bytes
+    decoded as Latin-1, one character per byte, for the UTF-8 encoded
+    keywords decoded the same way. The decoded copy is as large as the
+    content.
+    """
+
+    def __init__(self, keywords: list[str], binary: bool = False):
+        self.binary = binary
+        self.automaton = ahocorasick.Automaton()
+        for keyword in keywords:
+            word = keyword.encode("utf-8").decode("latin-1") if binary \
+                else keyword
+            self.automaton.add_word(word, keyword)
+        self.automaton.make_automaton()
+
+    def scan(self, content: Content, keyword_count: int) -> set[str]:
+        if self.binary:
+            content = content.decode("latin-1")
+        present: set[str] = set()
+        for _, keyword in self.automaton.iter(content):
+            present.add(keyword)
+            if len(present) == keyword_count:
+                break
+        return present
+
+
+class _RegexBackend:
+    """Keyword automaton backed by one alternation of all keywords.
+
+    A binary backend scans raw bytes for the UTF-8 encoded keywords and
+    reports the keywords as text.
+    """
+
+    def __init__(self, keywords: list[str], binary: bool = False):
+        if binary:
+            self.names = {keyword.encode("utf-8"): keyword
+                          for keyword in keywords}
+        else:
+            self.names = {keyword: keyword for keyword in keywords}
+        # Longest first, so a keyword is never shadowed by one of its prefixes
+        keywords = sorted(self.names, key=lambda x: (-len(x), x))
+        separator = b"|" if binary else "|"
+        self.expression = re.compile(
+            separator.join(re.escape(keyword) for keyword in keywords))
+
+        # The scan is non-overlapping, so a found keyword also accounts for
+        # the keywords it contains and must check those it may overlap with
+        self.contained: dict[Union[str, bytes], set] = {}
+        self.overlapping: dict[Union[str, bytes], list[tuple[int, Any]]] = {}
+        for keyword in keywords:
+            self.contained[keyword] = {
+                other for other in keywords if other in keyword
+            }
+            self.overlapping[keyword] = [
+                (offset, other)
+                for offset in range(1, len(keyword))
+                for other in keywords
+                if len(other) > len(keyword) - offset
+                and other.startswith(keyword[offset:])
+            ]
+
+    def scan(self, content: Content, keyword_count: int) -> set[str]:
+        present = set()
+        for result in self.expression.finditer(content):
+            keyword = result.group(0)
+            present |= self.contained[keyword]
+            for offset, other in self.overlapping[keyword]:
+                if (other not in present
+                        and content.startswith(other, result.start() + offset)):
+                    present.add(other)
+            if len(present) == keyword_count:
+                break
+        return {self.names[keyword] for keyword in present}
+
+
+class KeywordAutomaton:
+    """Reports every keyword present in a text in a single scan.
+
+    Uses a real Aho-Corasick automaton when `pyahocorasick` is installed and
+    falls back to a single compiled alternation otherwise. Raw bytes, which
+    every scan of an archive member passes, are scanned by a binary backend
+    built on first use.
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords: frozenset[str] = frozenset(
+            keyword for keyword in keywords if keyword)
+        self.backend_type = _AhoCorasickBackend if ahocorasick is not None \
+            else _RegexBackend
+        self.backend = self.backend_type(sorted(self.keywords)) \
+            if self.keywords else None
+        self.binary_backend: Optional[
+            Union[_AhoCorasickBackend, _RegexBackend]] = None
+
+    def __contains__(self, keyword: str) -> bool:
+        return keyword in self.keywords
+
+    def __len__(self) -> int:
+        return len(self.keywords)
+
+    def scan(self, content: Content) -> set[str]:
+        if self.backend is None:
+            return set()
+        if isinstance(content, str):
+            return self.backend.scan(content, len(self.keywords))
+
+        return self.build_binary_backend().scan(content, len(self.keywords))
+
+    def build_binary_backend(
+            self) -> Optional[Union[_AhoCorasickBackend, _RegexBackend]]:
+        if self.binary_backend is None and self.keywords:
+            self.binary_backend = self.backend_type(sorted(self.keywords),
+                                                    binary=True)
+        return self.binary_backend
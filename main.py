@@ -1,12 +1,28 @@
-import shutil
+import json
+import os
 import sys
+from dataclasses import asdict
 from optparse import OptionParser
 from pathlib import Path
-from crx_file import CrxFile, BadCrx, BadZipFile
-from xpi_file import XpiFile
-from configuration import API_PATTERNS
+from typing import TYPE_CHECKING, Optional
+from archive_io import DEFAULT_HASH_ALGORITHM, HASH_ALGORITHMS
+from configuration import DEFAULT_METADATA_INDEX, DEFAULT_TOKEN_INDEX, DEFAULT_VERSION_HISTORY, SHARD_KEYS
+from corpus import CorpusStatistics, collect_extension_paths, scan_corpus
+from scan_cache import (DEFAULT_CACHE_SIZE, DEFAULT_MEMBER_CACHE, DEFAULT_MEMBER_CACHE_SIZE,
+                        DEFAULT_RESULT_CACHE, MemberCache, ResultCache)
+from reporting import REPORT_FORMATS, Reporter, TextReporter
+from scanner import ScanOptions
+from member_selection import DEFAULT_MEMBER_POLICY, MemberPolicy
+from matcher import DEFAULT_CHUNK_SIZE, DEFAULT_MAX_TOKEN_LENGTH
+from profiling import ScanProfile
 
-terminal_width = shutil.get_terminal_size().columns
+# The modules of the other modes are imported by the branches that run them
+if TYPE_CHECKING:
+    from shards import Checkpoint
+    from token_index import TokenIndex
+    from version_history import VersionHistory
+
+__version__ = "1.0.1"
 
 
 class CommandLineParser:
@@ -15,94 +31,467 @@ class CommandLineParser:
     def __init__(self):
         self.parser = self.setup_parser()
         self.options, self.args = self.parser.parse_args()
+        if self.options.serve is not None and (self.options.member_timeout is not None
+                                               or self.options.extension_timeout is not None):
+            self.parser.error("time budgets are not supported with --serve")
+        if self.options.shard is not None:
+            from shards import parse_shard
+            try:
+                self.options.shard = parse_shard(self.options.shard)
+            except ValueError as error:
+                self.parser.error(f"--shard: {error}")
+        if self.options.queue_size is not None and self.options.queue_size < 1:
+            self.parser.error("--queue-size must be positive")
+        if self.options.chunk_size < 1:
+            self.parser.error("--chunk-size must be at least 1 MB")
+        if self.options.prefetch < 0 or self.options.inflate_ahead < 0:
+            self.parser.error("--prefetch and --inflate-ahead must not be negative")
+        if self.options.max_asset_size < 0:
+            self.parser.error("--max-asset-size must not be negative")
+        for budget in ("member_timeout", "extension_timeout", "max_member_size", "max_extension_size"):
+            value = getattr(self.options, budget)
+            if value is not None and value <= 0:
+                self.parser.error(f"--{budget.replace('_', '-')} must be positive")
 
     def setup_parser(self) -> OptionParser:
         """Set up the command line option parser."""
-        usage = "python main.py -f <file> [-o <output_file>]"
-        version = "1.0.1"
+        usage = ("python main.py -f <file> [-o <output_file>]\n"
+                 "       python main.py -d <directory|glob> [-d ...] "
+                 "[-m <manifest>] [-j <jobs>] [-o <output_file>]\n"
+                 "       python main.py --triage -d <directory|glob> [-d ...] [-m <manifest>] [-j <jobs>]\n"
+                 "       python main.py -m <manifest> --shard <index>/<count> --checkpoint-dir <directory>\n"
+                 "       python main.py --merge <directory> [-m <manifest>] [-o <output_file>]\n"
+                 "       python main.py --select <condition>\n"
+                 "       python main.py --tokens-since <run> [-o <output_file>]\n"
+                 "       python main.py --serve <host:port|unix:path> [-j <jobs>] [--queue-size <scans>]")
+        version = __version__
         description = "Scan the API Keys of all AI platforms present in the extension file"
         parser = OptionParser(usage=usage, version=version, description=description, add_help_option=True)
         parser.add_option("-f", "--file", type="string", dest="file", help="extension file to be scanned")
         parser.add_option("-o", "--output", type="string", dest="output_file", help="output file to save the scan results")
+        parser.add_option("--format", type="choice", dest="report_format", choices=list(REPORT_FORMATS),
+                          default="text",
+                          help="report format: " + ", ".join(REPORT_FORMATS) + " [default: %default]")
+        parser.add_option("-d", "--input", type="string", dest="inputs", action="append", default=[],
+                          help="directory or glob of extension files to be scanned in corpus mode (repeatable)")
+        parser.add_option("-m", "--manifest", type="string", dest="manifest",
+                          help="file listing one extension path per line to be scanned in corpus mode")
+        parser.add_option("-j", "--jobs", type="int", dest="jobs", default=os.cpu_count(),
+                          help="number of worker processes in corpus mode [default: %default]")
+        parser.add_option("--hash", type="choice", dest="hash_algorithm", choices=list(HASH_ALGORITHMS),
+                          default=DEFAULT_HASH_ALGORITHM,
+                          help="digest algorithm of the extension files: " + ", ".join(HASH_ALGORITHMS)
+                               + " [default: %default]")
+        parser.add_option("-c", "--cache", action="store_true", dest="cache", default=False,
+                          help="reuse the findings of files already scanned under the current ruleset")
+        parser.add_option("--cache-file", type="string", dest="cache_file", default=str(DEFAULT_RESULT_CACHE),
+                          help="result cache database [default: %default]")
+        parser.add_option("--cache-size", type="int", dest="cache_size", default=DEFAULT_CACHE_SIZE // (1024 * 1024),
+                          help="maximum size of the cached findings in MB [default: %default]")
+        parser.add_option("--dedup-members", action="store_true", dest="dedup_members", default=False,
+                          help="skip archive members identical to ones already scanned, by CRC32, sizes and "
+                               "compression method")
+        parser.add_option("--member-cache-file", type="string", dest="member_cache_file",
+                          default=str(DEFAULT_MEMBER_CACHE),
+                          help="member cache database persisted across runs [default: %default]")
+        parser.add_option("--member-cache-size", type="int", dest="member_cache_size",
+                          default=DEFAULT_MEMBER_CACHE_SIZE // (1024 * 1024),
+                          help="maximum size of the cached member findings in MB [default: %default]")
+        parser.add_option("--chunk-size", type="int", dest="chunk_size", default=DEFAULT_CHUNK_SIZE // (1024 * 1024),
+                          help="members larger than this many MB are scanned in chunks of this size "
+                               "[default: %default]")
+        parser.add_option("--max-token-length", type="int", dest="max_token_length",
+                          default=DEFAULT_MAX_TOKEN_LENGTH,
+                          help="longest token guaranteed to be found across chunk boundaries [default: %default]")
+        parser.add_option("--member-timeout", type="float", dest="member_timeout",
+                          help="seconds after which a member is abandoned and recorded as incomplete")
+        parser.add_option("--extension-timeout", type="float", dest="extension_timeout",
+                          help="seconds after which the remaining members of an extension are abandoned")
+        parser.add_option("--max-member-size", type="int", dest="max_member_size",
+                          help="members larger than this many MB are recorded as incomplete")
+        parser.add_option("--max-extension-size", type="int", dest="max_extension_size",
+                          help="MB of members scanned per extension before the rest are recorded as incomplete")
+        parser.add_option("--scan-all-members", action="store_true", dest="scan_all_members", default=False,
+                          help="decompress and match every member, including images, fonts and other binaries")
+        parser.add_option("--max-asset-size", type="int", dest="max_asset_size", default=4,
+                          help="members without a script, markup, style or data extension larger than this many "
+                               "MB are skipped [default: %default]")
+        parser.add_option("--scan-extensions", type="string", dest="scan_extensions", metavar="LIST",
+                          help="comma separated member extensions always scanned, in addition to scripts, source "
+                               "maps, markup, styles and manifests")
+        parser.add_option("--skip-extensions", type="string", dest="skip_extensions", metavar="LIST",
+                          help="comma separated member extensions never scanned, in addition to images, fonts, "
+                               "media, WebAssembly and archives")
+        parser.add_option("--prefetch", type="int", dest="prefetch", default=0, metavar="THREADS",
+                          help="in corpus mode, read and hash upcoming files in this many threads while others "
+                               "are scanned [default: %default]")
+        parser.add_option("--inflate-ahead", type="int", dest="inflate_ahead", default=0, metavar="MEMBERS",
+                          help="decompress up to this many members in a thread while others are matched "
+                               "[default: %default]")
+        parser.add_option("--profile", type="string", dest="profile_file", metavar="PROFILE_FILE",
+                          help="time every stage, pattern and member and write the profile as JSON")
+        parser.add_option("--incremental", action="store_true", dest="incremental", default=False,
+                          help="only scan the members added or changed since the last scanned version of the "
+                               "same extension id, carrying forward the findings of the others")
+        parser.add_option("--history-file", type="string", dest="history_file",
+                          default=str(DEFAULT_VERSION_HISTORY),
+                          help="version history database [default: %default]")
+        parser.add_option("--changes-file", type="string", dest="changes_file",
+                          help="with --incremental, write the members added, changed and removed since the "
+                               "previous version of every extension as JSON lines")
+        parser.add_option("--shard", type="string", dest="shard", metavar="INDEX/COUNT",
+                          help="in corpus mode, only scan the files of shard INDEX of COUNT, from 0")
+        parser.add_option("--shard-key", type="choice", dest="shard_key", choices=list(SHARD_KEYS),
+                          default="path",
+                          help="assign files to shards by a stable hash of their path as listed, or of their "
+                               "digest: " + ", ".join(SHARD_KEYS) + " [default: %default]")
+        parser.add_option("--checkpoint-dir", type="string", dest="checkpoint_dir",
+                          help="record every completed file and its findings in this directory, and skip the "
+                               "files already recorded when the run is restarted")
+        parser.add_option("--merge", type="string", dest="merge", metavar="CHECKPOINT_DIR",
+                          help="report the combined results of every shard checkpoint in a directory, in the "
+                               "order of -d and -m if given")
+        parser.add_option("--serve", type="string", dest="serve", metavar="ADDRESS",
+                          help="serve scan requests over HTTP on host:port, or on a Unix socket with "
+                               "unix:<path>, from -j warm worker processes")
+        parser.add_option("--queue-size", type="int", dest="queue_size",
+                          help="with --serve, scans pending at most before requests are rejected "
+                               "[default: 16 per job]")
+        parser.add_option("--triage", action="store_true", dest="triage", default=False,
+                          help="index the CRX header and ZIP central directory of every file into the metadata "
+                               "index, without decompressing any member")
+        parser.add_option("--index-file", type="string", dest="index_file", default=str(DEFAULT_METADATA_INDEX),
+                          help="metadata index database [default: %default]")
+        parser.add_option("--index-digests", action="store_true", dest="index_digests", default=False,
+                          help="also read and hash whole files while triaging, with the --hash algorithm")
+        parser.add_option("--select", type="string", dest="select", metavar="CONDITION",
+                          help="print the indexed paths matching an SQL condition on the extensions table, "
+                               "one per line, e.g. as a manifest for a full scan")
+        parser.add_option("--token-index", action="store_true", dest="index_tokens", default=False,
+                          help="record every token found in the token index, with the extension ids and digests "
+                               "it was found in and its first and last sightings")
+        parser.add_option("--token-index-file", type="string", dest="token_index_file",
+                          default=str(DEFAULT_TOKEN_INDEX), help="token index database [default: %default]")
+        parser.add_option("--tokens-since", type="int", dest="tokens_since", metavar="RUN",
+                          help="print the tokens first found after token index run RUN as JSON lines, one per "
+                               "token; run 0 prints every token")
         return parser
 
 
-def search_api_keys_in_extension_file(extension_file_path: Path, output_file=None):
+def megabytes(size: Optional[int]) -> Optional[int]:
+    return size * 1024 * 1024 if size is not None else None
+
+
+def extension_list(text: Optional[str]) -> frozenset[str]:
+    return frozenset(extension.strip().lstrip(".").lower() for extension in (text or "").split(",")
+                     if extension.strip())
+
+
+def member_policy(options) -> Optional[MemberPolicy]:
+    """Returns the member selection policy of the options, if any."""
+    if options.scan_all_members:
+        return None
+    scan_extensions = extension_list(options.scan_extensions)
+    skip_extensions = extension_list(options.skip_extensions)
+    return MemberPolicy(
+        scan_extensions=(DEFAULT_MEMBER_POLICY.scan_extensions - skip_extensions) | scan_extensions,
+        skip_extensions=(DEFAULT_MEMBER_POLICY.skip_extensions - scan_extensions) | skip_extensions,
+        max_asset_size=megabytes(options.max_asset_size) or None)
+
+
+def open_reporter(report_format: str, output_file: Optional[str] = None):
+    """Opens the one buffered writer and the reporter of a run."""
+    if report_format == "text":
+        file_output = open(output_file, "a") if output_file else None
+        return TextReporter(sys.stdout, file_output), file_output
+
+    # Structured reports are complete documents, so an output file is replaced
+    file_output = open(output_file, "w", newline="", encoding="utf-8") if output_file else None
+    output = file_output if file_output is not None else sys.stdout
+    if report_format == "sarif":
+        return REPORT_FORMATS["sarif"](output, tool_version=__version__), file_output
+    return REPORT_FORMATS[report_format](output), file_output
+
+
+def write_profile(profile: ScanProfile, profile_file: str) -> None:
+    """Writes the profile summary as JSON and flags the slowest scans."""
+    with open(profile_file, "w") as profile_output:
+        json.dump(profile.summary(), profile_output, indent=2)
+    print(profile.report(), file=sys.stderr)
+    print(f"Profile written to {profile_file}", file=sys.stderr)
+
+
+def search_api_keys_in_extension_file(extension_file_path: Path, reporter: Reporter,
+                                      scan_options: Optional[ScanOptions] = None,
+                                      result_cache: Optional[ResultCache] = None,
+                                      member_cache: Optional[MemberCache] = None,
+                                      version_history: Optional["VersionHistory"] = None,
+                                      token_index: Optional["TokenIndex"] = None) -> CorpusStatistics:
     """Search API keys in an extension file based on its type."""
- 
+    statistics = CorpusStatistics()
+    result, = scan_corpus([extension_file_path], 1, scan_options, result_cache, member_cache, version_history)
+    statistics.add(result)
+    if token_index is not None:
+        token_index.add(result)
+    reporter.write_result(result)
+
+    statistics.stop()
+    return statistics
+
+
+def search_api_keys_in_corpus(paths: list[Path], jobs: int, reporter: Reporter,
+                              scan_options: Optional[ScanOptions] = None,
+                              result_cache: Optional[ResultCache] = None,
+                              member_cache: Optional[MemberCache] = None,
+                              version_history: Optional["VersionHistory"] = None,
+                              checkpoint: Optional["Checkpoint"] = None,
+                              prefetch: int = 0,
+                              token_index: Optional["TokenIndex"] = None) -> CorpusStatistics:
+    """Search API keys in many extension files across worker processes."""
+    statistics = CorpusStatistics()
+    for result in scan_corpus(paths, jobs, scan_options, result_cache, member_cache, version_history,
+                              prefetch):
+        statistics.add(result)
+        if checkpoint is not None:
+            checkpoint.add(result)
+        if token_index is not None:
+            token_index.add(result)
+        reporter.write_result(result)
+
+    statistics.stop()
+    return statistics
+
+
+def triage(options) -> None:
+    """Indexes the metadata of a corpus, or selects paths from the index."""
+    from metadata_index import MetadataIndex, TriageStatistics, triage_corpus
+    index = MetadataIndex(Path(options.index_file), read_only=options.select is not None)
     try:
-        extension_type = extension_file_path.suffix
-        if extension_type == ".crx":
-            extension = CrxFile(extension_file_path, filter_list=None)
-        elif extension_type == ".xpi":
-            extension = XpiFile(extension_file_path, filter_list=None)
-        else:
-            print("Unsupported file type")
+        if options.select is not None:
+            for path in index.select_paths(options.select):
+                print(path)
             return
 
-        extension.setup()
-    except (BadCrx, BadZipFile) as error:
-        print(f"Could not read {extension_type} {extension_file_path}. {error}")
-        return
+        statistics = TriageStatistics()
+        paths = collect_extension_paths(options.inputs, options.manifest)
+        hash_algorithm = options.hash_algorithm if options.index_digests else None
+        for metadata in triage_corpus(paths, index, options.jobs, hash_algorithm, statistics):
+            if metadata.error is not None:
+                print(metadata.error, file=sys.stderr)
+        statistics.stop()
+        print(statistics.summary())
+    finally:
+        index.close()
+
 
-    print(f"Searching in {extension_file_path} ...")
+def list_tokens(options) -> None:
+    """Prints the tokens of the index first found after a run."""
+    from token_index import TokenIndex
+    index = TokenIndex(Path(options.token_index_file), read_only=True)
+    output = open(options.output_file, "w", encoding="utf-8") if options.output_file else sys.stdout
+    try:
+        for record in index.tokens_since(options.tokens_since):
+            output.write(json.dumps(asdict(record), ensure_ascii=False))
+            output.write("\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        index.close()
 
-    with sys.stdout as terminal_output:
-        for resource in extension.resources:
-            if resource.content is None:
-                continue
 
-            try:
-                content_bytes = resource.content.read()
-                content_string = content_bytes.decode("utf-8", errors="replace")
-            except UnicodeDecodeError:
-                print(f"Decode error in {extension.digest} for {resource.repository_path}")
-                continue
-
-            for api_pattern in API_PATTERNS:
-                matches = api_pattern.find_matches_with_context(content_string)
-
-                for service_name, token, context in matches:
-                    
-                    # NOTE: removed the unknown service pattern
-                    if service_name == "Unknown":
-                        continue
-
-                    # Highlight token in context
-                    highlighted_context = context.replace(token, f"\033[91m{token}\033[0m")
-
-                    # Print to terminal
-                    terminal_output.write(f"\033[94mFound API Keys\033[0m\n")
-                    terminal_output.write(f"  \033[92mService Name:\033[0m {service_name}\n")
-                    terminal_output.write(f"  \033[93mToken:\033[0m {token}\n")
-                    terminal_output.write(f"  \033[91mExtension Type:\033[0m {extension_type}\n")
-                    terminal_output.write(f"  \033[95mRepository Path:\033[0m {resource.repository_path}\n")
-                    terminal_output.write(f"  \033[96mContext:\033[0m\n{highlighted_context}\n")
-                    terminal_output.write("-" * terminal_width + "\n")  # Dynamic separator based on terminal width
-
-                    # Write to output file if specified
-                    if output_file:
-                        with open(output_file, "a") as file_output:
-                            file_output.write(f"Found API Keys\n")
-                            file_output.write(f"  Service Name: {service_name}\n")
-                            file_output.write(f"  Token: {token}\n")
-                            file_output.write(f"  Extension Type: {extension_type}\n")
-                            file_output.write(f"  Repository Path: {resource.repository_path}\n")
-                            file_output.write(f"  Context:\n{context}\n")
-                            file_output.write("-" * terminal_width + "\n")
+def finish_token_index(token_index: "TokenIndex", output) -> None:
+    run, findings, new_tokens = token_index.run, token_index.findings, token_index.new_tokens
+    token_index.finish_run()
+    print(f"Token index run {run}: {new_tokens} new tokens in {findings} findings", file=output)
+
+
+def merge(options) -> None:
+    """Reports the combined results of the shard checkpoints of a run."""
+    from shards import CheckpointError, merge_checkpoints, open_checkpoints
+    try:
+        checkpoints = open_checkpoints(Path(options.merge))
+    except CheckpointError as error:
+        sys.exit(f"Could not merge. {error}")
+    paths = None
+    if options.inputs or options.manifest:
+        paths = collect_extension_paths(options.inputs, options.manifest)
+
+    token_index = None
+    if options.index_tokens:
+        from token_index import TokenIndex
+        token_index = TokenIndex(Path(options.token_index_file))
+        token_index.start_run()
+    reporter, file_output = open_reporter(options.report_format, options.output_file)
+    try:
+        statistics = CorpusStatistics()
+        for result in merge_checkpoints(checkpoints, paths):
+            statistics.add(result)
+            if token_index is not None:
+                token_index.add(result)
+            reporter.write_result(result)
+        reporter.finish()
+        statistics.stop()
+        summary_output = sys.stdout if options.report_format == "text" else sys.stderr
+        print(statistics.summary(), file=summary_output)
+        if token_index is not None:
+            finish_token_index(token_index, summary_output)
+    finally:
+        if file_output is not None:
+            file_output.close()
+        if token_index is not None:
+            token_index.close()
+        for checkpoint in checkpoints:
+            checkpoint.close()
+
+
+def warn_engine_fallbacks() -> None:
+    """Warns about the patterns matched with `re` instead of their engine."""
+    from configuration import API_PATTERNS, engine_fallbacks
+    from regex_engines import engine_module
+    for engine, services in engine_fallbacks(API_PATTERNS).items():
+        if engine_module(engine) is None:
+            print(f"Warning: {engine} is not installed, so {len(services)} patterns are matched with re",
+                  file=sys.stderr)
+        else:
+            print(f"Warning: {engine} could not compile the patterns of {', '.join(sorted(set(services)))}, "
+                  f"which are matched with re", file=sys.stderr)
 
 
 def main():
     """Main function to handle the scanning process."""
     parser = CommandLineParser()
-    file_path = parser.options.file
-    output_file = parser.options.output_file
-
-    if not file_path:
+    options = parser.options
+    if options.serve is not None:
+        from scan_daemon import serve  # The HTTP server is only imported here
+        warn_engine_fallbacks()
+        serve(options.serve, options.jobs, ScanOptions(
+            hash_algorithm=options.hash_algorithm,
+            chunk_size=options.chunk_size * 1024 * 1024,
+            max_token_length=options.max_token_length,
+            max_member_size=megabytes(options.max_member_size),
+            max_extension_size=megabytes(options.max_extension_size),
+            member_policy=member_policy(options),
+            inflate_ahead=options.inflate_ahead), options.queue_size)
+        return
+    if options.select is not None or options.triage:
+        if options.triage and not (options.inputs or options.manifest):
+            parser.parser.error("--triage needs -d or -m")
+        if options.select is not None and not Path(options.index_file).exists():
+            parser.parser.error(f"no metadata index at {options.index_file}, run --triage first")
+        triage(options)
+        return
+    if options.tokens_since is not None:
+        if not Path(options.token_index_file).exists():
+            parser.parser.error(f"no token index at {options.token_index_file}, scan with --token-index first")
+        list_tokens(options)
+        return
+    if options.merge is not None:
+        merge(options)
+        return
+    if (options.shard is not None or options.checkpoint_dir) and not (options.inputs or options.manifest):
+        parser.parser.error("--shard and --checkpoint-dir need -d or -m")
+    if not (options.inputs or options.manifest or options.file):
         print("Please provide a file path.")
         exit(0)
+    warn_engine_fallbacks()
+
+    scan_options = ScanOptions(hash_algorithm=options.hash_algorithm,
+                               chunk_size=options.chunk_size * 1024 * 1024,
+                               max_token_length=options.max_token_length,
+                               profile=options.profile_file is not None,
+                               member_timeout=options.member_timeout,
+                               extension_timeout=options.extension_timeout,
+                               max_member_size=megabytes(options.max_member_size),
+                               max_extension_size=megabytes(options.max_extension_size),
+                               member_policy=member_policy(options),
+                               inflate_ahead=options.inflate_ahead)
+    if options.cache and scan_options.member_policy != DEFAULT_MEMBER_POLICY:
+        # Cached findings only stand in for scans under the default policy
+        parser.parser.error("--cache needs the default member selection")
+
+    checkpoint = None
+    if options.checkpoint_dir:
+        from shards import Checkpoint, CheckpointError, checkpoint_path
+        # Without --shard, a checkpoint makes the whole run resumable
+        index, count = options.shard or (0, 1)
+        try:
+            checkpoint = Checkpoint(checkpoint_path(Path(options.checkpoint_dir), index, count),
+                                    index, count, options.shard_key)
+        except CheckpointError as error:
+            parser.parser.error(f"--checkpoint-dir: {error}")
+
+    result_cache = None
+    if options.cache:
+        result_cache = ResultCache(Path(options.cache_file), options.cache_size * 1024 * 1024)
+    member_cache = None
+    if options.dedup_members:
+        member_cache = MemberCache(Path(options.member_cache_file),
+                                   max_bytes=options.member_cache_size * 1024 * 1024)
+    version_history = None
+    changes_output = None
+    if options.incremental:
+        from version_history import VersionHistory
+        version_history = VersionHistory(Path(options.history_file))
+        if options.changes_file:
+            changes_output = open(options.changes_file, "w", encoding="utf-8")
+
+    token_index = None
+    if options.index_tokens:
+        from token_index import TokenIndex
+        token_index = TokenIndex(Path(options.token_index_file))
+        token_index.start_run()
+
+    reporter, file_output = open_reporter(options.report_format, options.output_file)
+    reporter.changes = changes_output
+    try:
+        if options.inputs or options.manifest:
+            paths = collect_extension_paths(options.inputs, options.manifest)
+            if options.shard is not None:
+                from shards import select_shard
+                paths = select_shard(paths, *options.shard, options.shard_key, options.hash_algorithm)
+            if checkpoint is not None:
+                completed = len(checkpoint.completed())
+                if completed:
+                    print(f"Resuming from {checkpoint.path}, {completed} files already completed",
+                          file=sys.stderr)
+                paths = checkpoint.pending(paths)
+            statistics = search_api_keys_in_corpus(paths, options.jobs, reporter, scan_options,
+                                                   result_cache, member_cache, version_history,
+                                                   checkpoint, options.prefetch, token_index)
+            reporter.finish()
+            # Keep structured output on stdout parseable
+            summary_output = sys.stdout if options.report_format == "text" else sys.stderr
+            print(statistics.summary(include_cache=result_cache is not None,
+                                     include_members=member_cache is not None,
+                                     include_versions=version_history is not None,
+                                     include_pipeline=options.prefetch > 0 or options.inflate_ahead > 0),
+                  file=summary_output)
+        else:
+            statistics = search_api_keys_in_extension_file(Path(options.file), reporter, scan_options,
+                                                           result_cache, member_cache, version_history,
+                                                           token_index)
+            reporter.finish()
+            summary_output = sys.stdout if options.report_format == "text" else sys.stderr
+        if token_index is not None:
+            finish_token_index(token_index, summary_output)
 
-    search_api_keys_in_extension_file(Path(file_path), output_file)
+        if statistics.profile is not None:
+            write_profile(statistics.profile, options.profile_file)
+    finally:
+        if file_output is not None:
+            file_output.close()
+        if result_cache is not None:
+            result_cache.close()
+        if member_cache is not None:
+            member_cache.close()
+        if version_history is not None:
+            version_history.close()
+        if changes_output is not None:
+            changes_output.close()
+        if checkpoint is not None:
+            checkpoint.close()
+        if token_index is not None:
+            token_index.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,362 @@
+import json
+import tempfile
+import time
+from typing import IO, Iterator, Optional
+from configuration import (API_PATTERNS, KEYWORD_AUTOMATON, ApiKeyPattern,
+                           MatchCache)
+from candidate_scoring import CandidateThresholds, loosest, token_features
+from keywords import Content, KeywordAutomaton
+from profiling import ScanProfile, stage
+
+
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024  # 16mb
+DEFAULT_MAX_TOKEN_LENGTH = 4096
+MINIMUM_LOOKAHEAD = 64
+
+
+def read_chunk(stream: IO[bytes], size: int) -> bytes:
+    """Reads `size` bytes unless the stream ends first."""
+    chunk = stream.read(size)
+    if len(chunk) in (0, size):
+        return chunk
+
+    parts = [chunk]
+    remaining = size - len(chunk)
+    while remaining > 0:
+        part = stream.read(remaining)
+        if not part:
+            break
+        parts.append(part)
+        remaining -= len(part)
+    return b"".join(parts)
+
+
+def possible_thresholds(api_pattern: ApiKeyPattern, match_string: str,
+                        settled: set[int]) -> Optional[CandidateThresholds]:
+    """Loosest thresholds of the services a streamed token may resolve to.
+
+    Sub-services are tried in order, as `match_subservices` does; a settled
+    one, already found in the stream with one of its keywords, is where the
+    token resolves whatever follows.
+    """
+    thresholds = []
+    for service in api_pattern.sub_services:
+        if service.expression.match(match_string) is None:
+            continue
+        thresholds.append(service.thresholds)
+        if id(service) in settled:
+            return loosest(thresholds)
+    thresholds.append(api_pattern.thresholds)
+    return loosest(thresholds)
+
+
+class CandidateBuffer:
+    """Candidates of a stream per pattern, spilled to disk past a budget.
+
+    Candidates are held in memory until their tokens and contexts add up to
+    `max_bytes` characters; later ones go to a temporary file per pattern,
+    read back in order once the stream ends.
+    """
+
+    def __init__(self, keys: list[int], max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: dict[int, list[tuple]] = {key: [] for key in keys}
+        self.spilled: dict[int, IO[str]] = {}
+
+    def append(self, key: int, candidate: tuple) -> None:
+        if self.size < self.max_bytes:
+            self.entries[key].append(candidate)
+            self.size += len(candidate[0]) + len(candidate[1])
+            return
+        if key not in self.spilled:
+            self.spilled[key] = tempfile.TemporaryFile(
+                "w+", encoding="utf-8")
+        self.spilled[key].write(json.dumps(candidate) + "\n")
+
+    def get(self, key: int) -> Iterator[tuple]:
+        yield from self.entries[key]
+        spill = self.spilled.get(key)
+        if spill is not None:
+            spill.seek(0)
+            for line in spill:
+                yield tuple(json.loads(line))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception_args) -> bool:
+        self.close()
+        return False
+
+    def close(self) -> None:
+        for spill in self.spilled.values():
+            spill.close()
+
+
+class CompiledMatcher:
+    """Matches all API key patterns of a ruleset over one text.
+
+    A single keyword automaton pass over the text reports every keyword and
+    literal prefix present in it, which decides which patterns can match at
+    all; only those patterns run their own expression. The findings are
+    identical, and in the same order, as calling
+    `ApiKeyPattern.find_matches_with_context` for every pattern.
+    """
+
+    def __init__(self, api_patterns: list[ApiKeyPattern],
+                 automaton: Optional[KeywordAutomaton] = None):
+        self.api_patterns = api_patterns
+        self.automaton = automaton if automaton is not None \
+            else ApiKeyPattern.build_keyword_automaton(api_patterns)
+        # Broad patterns have no service name of their own
+        self.labels: dict[int, str] = {}
+        broad_count = 0
+        for api_pattern in api_patterns:
+            if api_pattern.service_name == "Unknown":
+                self.labels[id(api_pattern)] = f"broad[{broad_count}]"
+                broad_count += 1
+            else:
+                self.labels[id(api_pattern)] = api_pattern.service_name
+
+    def match_cache(self, content: Content) -> MatchCache:
+        """Scans the content once for every keyword of the ruleset."""
+        return MatchCache(self.automaton.scan(content), self.automaton)
+
+    def candidate_patterns(self, content: Content,
+                           cache: MatchCache) -> list[ApiKeyPattern]:
+        """Returns the patterns whose prefix and keywords occur in the text."""
+        return [
+            api_pattern for api_pattern in self.api_patterns
+            if (api_pattern.prefix is None
+                or cache.has_keyword(api_pattern.prefix, content))
+            and api_pattern.check_any_keyword(content, cache)
+        ]
+
+    def find_matches_with_context(
+            self, content: Content, context_length=250,
+            profile: Optional[ScanProfile] = None
+    ) -> list[(str, str, str, int, int)]:
+        # Keyword and sub-service lookups are shared by every pattern
+        with stage(profile, "keywords") as timing:
+            cache = self.match_cache(content)
+            timing.bytes += len(content)
+        candidates = self.candidate_patterns(content, cache)
+        if profile is not None:
+            return self.profile_patterns(content, context_length, cache,
+                                         candidates, profile)
+
+        matches: list[(str, str, str, int, int)] = []
+        for api_pattern in candidates:
+            matches.extend(api_pattern.find_matches_with_context(
+                content, context_length, cache))
+        return matches
+
+    def profile_patterns(self, content: Content, context_length: int,
+                         cache: MatchCache,
+                         candidates: list[ApiKeyPattern],
+                         profile: ScanProfile
+                         ) -> list[(str, str, str, int, int)]:
+        """Matches the candidate patterns, timing every one of them."""
+        candidate_ids = {id(api_pattern) for api_pattern in candidates}
+        matches: list[(str, str, str, int, int)] = []
+        for api_pattern in self.api_patterns:
+            candidate = id(api_pattern) in candidate_ids
+            found = []
+            started = time.perf_counter()
+            if candidate:
+                found = api_pattern.find_matches_with_context(
+                    content, context_length, cache)
+            profile.add_pattern(self.labels[id(api_pattern)],
+                                time.perf_counter() - started, len(content),
+                                candidate, len(found),
+                                api_pattern.engine_for(content))
+            matches.extend(found)
+        return matches
+
+    def find_matches_in_stream(
+            self, stream: IO[bytes], context_length=250,
+            chunk_size: int = DEFAULT_CHUNK_SIZE,
+            max_token_length: int = DEFAULT_MAX_TOKEN_LENGTH,
+            hasher=None) -> list[(str, str, str, int, int)]:
+        """Matches a byte stream in fixed-size chunks with bounded memory.
+
+        Consecutive windows overlap by the longest token plus the context
+        length, and every pattern resumes where its last accepted match
+        ended, so no match is lost or reported twice at a chunk boundary.
+        Matches too close to the end of a window are deferred to the next
+        one, where the text after them is known. Keywords gate a pattern on
+        the whole stream, so candidates are collected for every pattern and
+        filtered once the stream ends; past `chunk_size` characters of
+        tokens and contexts, they are spilled to a temporary file. Tokens
+        are scored on their raw bytes while their window is in memory, and
+        only those passing the loosest thresholds of the services they may
+        still resolve to get a context.
+
+        The findings are identical to `find_matches_with_context` over the
+        whole content, provided no match, including the text its expression
+        requires around the token, is longer than `max_token_length`.
+        Besides the findings returned, at most `chunk_size` plus the overlap
+        of content and `chunk_size` of candidates are held in memory. An
+        optional `hashlib` object receives every chunk read.
+        """
+        chunk_size = max(chunk_size, 1)
+        lookahead = max(context_length, MINIMUM_LOOKAHEAD)
+        longest_keyword = max(map(len, self.automaton.keywords), default=0)
+        overlap = max(max_token_length + lookahead + context_length + 1,
+                      longest_keyword)
+        sub_services = {
+            id(service): service
+            for api_pattern in self.api_patterns
+            for service in api_pattern.sub_services
+        }
+        # Tokens are scored if any service they may resolve to has thresholds
+        scored = {
+            id(api_pattern): any(
+                service.thresholds is not None
+                for service in [api_pattern, *api_pattern.sub_services])
+            for api_pattern in self.api_patterns
+        }
+
+        present_keywords: set[str] = set()
+        found_services: set[int] = set()
+        settled: set[int] = set()
+        resume = {id(api_pattern): 0 for api_pattern in self.api_patterns}
+        # Spill files are closed however the stream ends
+        with CandidateBuffer(
+                [id(api_pattern) for api_pattern in self.api_patterns],
+                chunk_size) as candidates:
+            window = bytearray()
+            window_start = 0
+            while True:
+                chunk = read_chunk(stream, chunk_size)
+                if hasher is not None:
+                    hasher.update(chunk)
+                final = len(chunk) < chunk_size
+                window += chunk
+                window_end = window_start + len(window)
+                # Matches must not touch the unread text, unless there is none
+                accept_limit = len(window) if final \
+                    else len(window) - lookahead
+
+                window_keywords = self.automaton.scan(window)
+                present_keywords |= window_keywords
+                # Positions before the first byte were covered by the last
+                # window
+                first_position = 0 if window_start == 0 else 1
+
+                for key, service in sub_services.items():
+                    if key in found_services or (
+                            service.prefix is not None
+                            and service.prefix not in window_keywords):
+                        continue
+                    result = service.byte_expression.search(window,
+                                                            first_position)
+                    if result is not None and result.end() <= accept_limit:
+                        found_services.add(key)
+                window_cache = MatchCache(present_keywords, self.automaton)
+                settled = {key for key in found_services
+                           if key in settled
+                           or sub_services[key].check_any_keyword(
+                               b"", window_cache)}
+
+                for api_pattern in self.api_patterns:
+                    key = id(api_pattern)
+                    if (api_pattern.prefix is not None
+                            and api_pattern.prefix not in window_keywords):
+                        resume[key] = max(resume[key], window_end - overlap)
+                        continue
+
+                    deferred = False
+                    found = []
+                    for result in api_pattern.byte_expression.finditer(
+                            window,
+                            max(resume[key] - window_start, first_position)):
+                        if result.end() > accept_limit:
+                            resume[key] = window_start + result.start()
+                            deferred = True
+                            break
+                        found.append(result)
+                        resume[key] = window_start + result.end()
+
+                    if not deferred:
+                        resume[key] = max(resume[key], window_end - overlap)
+                    if not found:
+                        continue
+
+                    token_groups = [1 if result.groups() else 0
+                                    for result in found]
+                    scores = [None] * len(found)
+                    if scored[key]:
+                        # Scored in one batch, before any context is built
+                        scores = list(zip(*token_features(
+                            [result.group(token_group) for result, token_group
+                             in zip(found, token_groups)])))
+                    for result, token_group, score in zip(found, token_groups,
+                                                          scores):
+                        match_string = result.group(token_group).decode(
+                            "utf-8", errors="replace")
+                        if score is not None:
+                            threshold = possible_thresholds(
+                                api_pattern, match_string, settled)
+                            if threshold is not None \
+                                    and not threshold.accepts(*score):
+                                continue
+                        start_index = max(0, result.start() - context_length)
+                        end_index = min(len(window),
+                                        result.end() + context_length)
+                        candidates.append(key, (
+                            match_string,
+                            window[start_index:end_index].decode(
+                                "utf-8", errors="replace"),
+                            window_start + result.start(token_group),
+                            window_start + result.end(token_group),
+                            score
+                        ))
+
+                if final:
+                    break
+
+                # Keep the overlap, which holds every deferred match and the
+                # context before it
+                retained_start = window_end - overlap
+                if retained_start > window_start:
+                    del window[:retained_start - window_start]
+                    window_start = retained_start
+                    for key in resume:
+                        resume[key] = max(resume[key],
+                                          window_start + context_length + 1)
+
+            # Gate the candidates on keywords and sub-services of the whole
+            # stream
+            cache = MatchCache(present_keywords, self.automaton)
+            for key, service in sub_services.items():
+                cache.service_matches[key] = (
+                    key in found_services
+                    and service.check_any_keyword(b"", cache))
+
+            matches: list[(str, str, str, int, int)] = []
+            for api_pattern in self.api_patterns:
+                if not api_pattern.check_any_keyword(b"", cache):
+                    continue
+                # Contexts and scores were computed while their window was in
+                # memory
+                for match_string, context, start, end, score in \
+                        candidates.get(id(api_pattern)):
+                    service_name = api_pattern.match_subservices(
+                        match_string, b"", cache)
+                    threshold = api_pattern.thresholds_for(service_name)
+                    if threshold is not None and not threshold.accepts(*score):
+                        continue
+                    matches.append((
+                        service_name if service_name is not None
+                        else api_pattern.service_name,
+                        match_string,
+                        context,
+                        start,
+                        end
+                    ))
+        return matches
+
+
+API_MATCHER = CompiledMatcher(API_PATTERNS, KEYWORD_AUTOMATON)
@@ -0,0 +1,103 @@
+from dataclasses import dataclass
+from typing import IO, Optional
+
+
+# Always scanned, whatever their size or content
+SCAN_EXTENSIONS = frozenset({
+    "js", "mjs", "cjs", "jsx", "ts", "mts", "cts", "tsx", "map", "json",
+    "json5", "webmanifest", "html", "htm", "xhtml", "css", "xml", "xul",
+    "rdf", "svg", "vue", "txt", "md", "yml", "yaml", "ini", "cfg", "conf",
+    "properties", "env",
+})
+# Images, fonts, media, compiled code and nested archives
+SKIP_EXTENSIONS = frozenset({
+    "png", "apng", "jpg", "jpeg", "gif", "webp", "bmp", "ico", "cur", "tif",
+    "tiff", "avif", "heic", "psd", "woff", "woff2", "ttf", "otf", "eot",
+    "wasm", "mp3", "mp4", "m4a", "m4v", "aac", "ogg", "oga", "ogv", "opus",
+    "wav", "flac", "webm", "mov", "avi", "mkv", "pdf", "zip", "gz", "tgz",
+    "bz2", "xz", "7z", "rar", "jar", "crx", "xpi", "exe", "dll", "so",
+    "dylib", "node", "pak", "class", "pyc",
+})
+MAGIC_NUMBERS = (
+    b"\x89PNG", b"\xff\xd8\xff", b"GIF8", b"\x00\x00\x01\x00",
+    b"RIFF", b"%PDF", b"PK\x03\x04", b"\x1f\x8b", b"BZh", b"\xfd7zXZ",
+    b"7z\xbc\xaf", b"Rar!", b"\x00asm", b"wOFF", b"wOF2", b"OTTO",
+    b"\x00\x01\x00\x00", b"ID3", b"OggS", b"fLaC", b"\x1aE\xdf\xa3",
+    b"\x7fELF", b"\xca\xfe\xba\xbe", b"\xcf\xfa\xed\xfe",
+    b"SQLite format 3",
+)
+# Bytes that do not occur in text, i.e. controls other than whitespace,
+# backspace and escape
+CONTROL_BYTES = bytes(set(range(32)) - {8, 9, 10, 12, 13, 27}) + b"\x7f"
+DEFAULT_SNIFF_SIZE = 4096  # 4kb
+DEFAULT_MAX_ASSET_SIZE = 4 * 1024 * 1024  # 4mb
+
+SKIPPED_BY_EXTENSION = "extension"
+SKIPPED_BY_SIZE = "size"
+SKIPPED_BY_CONTENT = "content"
+
+
+def member_extension(repository_path: str) -> str:
+    name = repository_path.rpartition("/")[2]
+    return name.rpartition(".")[2].lower() if "." in name else ""
+
+
+def is_binary(head: bytes) -> bool:
+    """Sniffs the first bytes of a member for a known binary format.
+
+    Anything else is binary if it holds a NUL byte, or if more than a tenth
+    of it are control bytes. UTF-8 text passes; UTF-16 text does not, but no
+    pattern would match it either.
+    """
+    if not head:
+        return False
+    if head.startswith(MAGIC_NUMBERS) or head[4:8] == b"ftyp":
+        return True
+    if b"\x00" in head:
+        return True
+    controls = len(head) - len(head.translate(None, CONTROL_BYTES))
+    return controls * 10 > len(head)
+
+
+@dataclass(frozen=True)
+class MemberPolicy:
+    """Chooses the archive members worth decompressing and matching.
+
+    Members with a scanned extension, such as scripts, source maps and
+    manifests, are always scanned. Members with a skipped extension, such as
+    images, fonts and WebAssembly, never are. Any other member is skipped if
+    its uncompressed size in the central directory exceeds `max_asset_size`,
+    or if its first `sniff_size` bytes look binary.
+    """
+    scan_extensions: frozenset[str] = SCAN_EXTENSIONS
+    skip_extensions: frozenset[str] = SKIP_EXTENSIONS
+    max_asset_size: Optional[int] = DEFAULT_MAX_ASSET_SIZE
+    sniff_size: int = DEFAULT_SNIFF_SIZE
+
+    def select(self, repository_path: str, size: int) -> Optional[str]:
+        """Returns why a member is skipped before decompression, if it is.
+
+        Returns `None` both for members that are always scanned and for
+        those that `needs_sniff` still has to look into.
+        """
+        extension = member_extension(repository_path)
+        if extension in self.scan_extensions:
+            return None
+        if extension in self.skip_extensions:
+            return SKIPPED_BY_EXTENSION
+        if self.max_asset_size is not None and size > self.max_asset_size:
+            return SKIPPED_BY_SIZE
+        return None
+
+    def needs_sniff(self, repository_path: str) -> bool:
+        return self.sniff_size > 0 \
+            and member_extension(repository_path) not in self.scan_extensions
+
+    def sniff(self, content: IO[bytes]) -> Optional[str]:
+        """Reads the head of a member and rewinds it."""
+        head = content.read(self.sniff_size)
+        content.seek(0)
+        return SKIPPED_BY_CONTENT if is_binary(head) else None
+
+
+DEFAULT_MEMBER_POLICY = MemberPolicy()
@@ -0,0 +1,280 @@
+import hashlib
+import os
+import struct
+import time
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+from zipfile import BadZipFile
+from archive_io import DEFAULT_HASH_ALGORITHM, MEMBER_ERRORS
+from configuration import DEFAULT_METADATA_INDEX
+from corpus import ordered_map
+from crx_file import BadCrx, CrxFile
+from scan_cache import connect
+from scanner import open_extension
+from xpi_file import BadXpi
+
+
+COMMIT_INTERVAL = 1000  # Files written per transaction
+
+
+@dataclass(slots=True)
+class MemberMetadata:
+    name: str
+    size: int
+    compressed_size: int
+    crc: int
+
+
+@dataclass
+class ExtensionMetadata:
+    """What the header and central directory of an extension file tell.
+
+    Nothing is decompressed, so the version of a CRX file, which is only
+    recorded in its manifest, is unknown; an XPI file takes its version from
+    the directory it is stored in.
+    """
+    path: str
+    size: int
+    modified: float
+    crx_version: Optional[int] = None
+    extension_id: Optional[str] = None
+    version: Optional[str] = None
+    digest: Optional[str] = None
+    rsa_proofs: int = 0
+    ecdsa_proofs: int = 0
+    public_key_hash: Optional[str] = None
+    members: list[MemberMetadata] = field(default_factory=list)
+    error: Optional[str] = None
+
+    @property
+    def uncompressed_size(self) -> int:
+        return sum(member.size for member in self.members)
+
+
+def public_key_hash(public_key: bytes) -> str:
+    return hashlib.sha256(public_key).hexdigest()
+
+
+def read_metadata(path: Path,
+                  hash_algorithm: Optional[str] = None) -> ExtensionMetadata:
+    """Reads the header and central directory of an extension file.
+
+    Only the pages holding the header and the central directory are read,
+    unless a `hash_algorithm` asks for the digest of the whole file.
+    """
+    metadata = ExtensionMetadata(str(path), 0, 0.0)
+    extension = None
+    try:
+        status = path.stat()
+        metadata.size, metadata.modified = status.st_size, status.st_mtime
+        extension = open_extension(
+            path, hash_algorithm or DEFAULT_HASH_ALGORITHM)
+        if extension is None:
+            metadata.error = "Unsupported file type"
+            return metadata
+
+        extension.setup(setup_resources=False,
+                        with_digest=hash_algorithm is not None)
+        metadata.digest = extension.digest
+        metadata.extension_id = extension.extension_id
+        if isinstance(extension, CrxFile):
+            metadata.crx_version = extension.crx_version
+            if extension.crx_version == 2:
+                public_key, _ = extension.rsa_proof
+                metadata.rsa_proofs = 1
+                metadata.public_key_hash = public_key_hash(public_key)
+            else:
+                metadata.rsa_proofs = len(extension.rsa_proof)
+                metadata.ecdsa_proofs = len(extension.ecdsa_proof)
+                if extension.rsa_proof:
+                    metadata.public_key_hash = public_key_hash(
+                        extension.rsa_proof[0].public_key)
+        else:
+            metadata.version = extension.xpi_version
+
+        zip_archive = extension.get_zip_archive()
+        if zip_archive is None:
+            raise BadZipFile("Could not identify the ZIP archive.")
+        with zip_archive:
+            metadata.members = [
+                MemberMetadata(info.filename, info.file_size,
+                               info.compress_size, info.CRC)
+                for info in zip_archive.infolist() if not info.is_dir()]
+    except (BadCrx, BadXpi, IndexError, struct.error, *MEMBER_ERRORS) \
+            as error:
+        # A truncated or undecodable header raises BadCrx, and a missing
+        # file or a damaged or unsupported central directory one of the
+        # member errors
+        metadata.members = []
+        metadata.error = f"Could not read {path}. {error}"
+    finally:
+        if extension is not None:
+            extension.close()
+    return metadata
+
+
+class MetadataIndex:
+    """SQLite index of the metadata of every triaged extension file.
+
+    Files are keyed by path; a file whose size and modification time did not
+    change since it was indexed is not read again. The tables are meant to
+    be queried directly, e.g. to pick the files worth a full scan.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS extensions (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            modified REAL NOT NULL,
+            crx_version INTEGER,
+            extension_id TEXT,
+            version TEXT,
+            digest TEXT,
+            rsa_proofs INTEGER NOT NULL,
+            ecdsa_proofs INTEGER NOT NULL,
+            public_key_hash TEXT,
+            members INTEGER NOT NULL,
+            uncompressed_size INTEGER NOT NULL,
+            error TEXT,
+            indexed_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS extensions_id
+            ON extensions (extension_id);
+        CREATE TABLE IF NOT EXISTS members (
+            path TEXT NOT NULL,
+            name TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            compressed_size INTEGER NOT NULL,
+            crc INTEGER NOT NULL,
+            PRIMARY KEY (path, name)
+        );
+        CREATE INDEX IF NOT EXISTS members_content ON members (crc, size);
+    """
+
+    def __init__(self, path: Path = DEFAULT_METADATA_INDEX,
+                 read_only: bool = False):
+        self.path = Path(path)
+        self.read_only = read_only
+        self.connection = connect(self.path, read_only)
+        if not read_only:
+            self.connection.executescript(self.SCHEMA)
+        self._pending = 0
+
+    def close(self) -> None:
+        if not self.read_only:
+            self.connection.commit()
+        self.connection.close()
+
+    def is_current(self, path: Path) -> bool:
+        """Returns whether a file is indexed as it is on disk now."""
+        row = self.connection.execute(
+            "SELECT size, modified FROM extensions WHERE path = ?",
+            (str(path),)).fetchone()
+        if row is None:
+            return False
+        try:
+            status = path.stat()
+        except OSError:
+            return False  # Read again, to record why it cannot be
+        return row == (status.st_size, status.st_mtime)
+
+    def add(self, metadata: ExtensionMetadata) -> None:
+        self.connection.execute(
+            "DELETE FROM members WHERE path = ?", (metadata.path,))
+        self.connection.execute(
+            "INSERT OR REPLACE INTO extensions VALUES "
+            "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (metadata.path, metadata.size, metadata.modified,
+             metadata.crx_version, metadata.extension_id, metadata.version,
+             metadata.digest, metadata.rsa_proofs, metadata.ecdsa_proofs,
+             metadata.public_key_hash, len(metadata.members),
+             metadata.uncompressed_size, metadata.error, time.time()))
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO members VALUES (?, ?, ?, ?, ?)",
+            ((metadata.path, member.name, member.size,
+              member.compressed_size, member.crc)
+             for member in metadata.members))
+        self._pending += 1
+        if self._pending >= COMMIT_INTERVAL:
+            self.connection.commit()
+            self._pending = 0
+
+    def select_paths(self, condition: str) -> list[Path]:
+        """Returns the indexed paths matching an SQL condition."""
+        return [Path(path) for path, in self.connection.execute(
+            f"SELECT path FROM extensions WHERE {condition} ORDER BY path")]
+
+
+class TriageStatistics:
+    """Counters of a triage run."""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.members = 0
+        self.unchanged = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    def add(self, metadata: ExtensionMetadata) -> None:
+        self.files += 1
+        self.bytes += metadata.size
+        self.members += len(metadata.members)
+        if metadata.error is not None:
+            self.errors += 1
+
+    def stop(self) -> None:
+        self.finished = time.perf_counter()
+
+    def summary(self) -> str:
+        finished = self.finished if self.finished is not None \
+            else time.perf_counter()
+        elapsed = max(finished - self.started, 1e-9)
+        return (f"Indexed {self.files} files "
+                f"({self.bytes / (1024 * 1024):.2f} MB, {self.members} members) "
+                f"in {elapsed:.2f}s: {self.files / elapsed:.2f} files/sec, "
+                f"{self.unchanged} unchanged, {self.errors} errors")
+
+
+def triage_corpus(paths: Iterable[Path], index: MetadataIndex,
+                  jobs: Optional[int] = None,
+                  hash_algorithm: Optional[str] = None,
+                  statistics: Optional[TriageStatistics] = None
+                  ) -> Iterator[ExtensionMetadata]:
+    """Indexes the metadata of extension files across worker processes.
+
+    Files already indexed with their current size and modification time are
+    skipped. The calling process is the single writer of the index.
+    """
+    jobs = jobs if jobs is not None else os.cpu_count() or 1
+
+    def changed(paths: Iterable[Path]) -> Iterator[Path]:
+        for path in paths:
+            if index.is_current(path):
+                if statistics is not None:
+                    statistics.unchanged += 1
+                continue
+            yield path
+
+    read = partial(read_metadata, hash_algorithm=hash_algorithm)
+    executor = None
+    if jobs <= 1:
+        results = map(read, changed(paths))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        results = ordered_map(executor, read, changed(paths),
+                              window=jobs * 4)
+
+    try:
+        for metadata in results:
+            index.add(metadata)
+            if statistics is not None:
+                statistics.add(metadata)
+            yield metadata
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
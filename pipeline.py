@@ -0,0 +1,100 @@
+import queue
+import threading
+import time
+from io import BytesIO
+from typing import Callable, Iterator, Union
+from crx_file import CrxResource
+from xpi_file import XpiResource
+
+Resource = Union[CrxResource, XpiResource]
+
+INFLATE_STAGE = "inflate"
+MATCH_STAGE = "match"
+READ_STAGE = "read"
+STAGES = (READ_STAGE, INFLATE_STAGE, MATCH_STAGE)
+POLL_INTERVAL = 0.1  # Seconds between checks for an abandoned pipeline
+
+_END = object()
+
+
+class MemberPrefetcher:
+    """Inflates upcoming archive members in a thread while others are matched.
+
+    Members accepted by `wanted` are read whole into memory by the thread,
+    at most `depth` of them ahead of the consumer, and yielded with their
+    content in a `BytesIO`. Any other member, e.g. one streamed in chunks or
+    never read, is yielded with its live stream; the thread waits for the
+    consumer to move past it, since members of one archive share a file.
+    Decompression and CRC checks release the GIL, so inflating overlaps
+    with matching.
+    """
+
+    def __init__(self, resources: Iterator[Resource],
+                 wanted: Callable[[Resource], bool], depth: int):
+        self.resources = resources
+        self.wanted = wanted
+        self.queue: queue.Queue = queue.Queue(maxsize=depth)
+        self.stopped = threading.Event()
+        # Time the thread spent inflating, and the consumer spent waiting
+        self.inflate_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.thread = threading.Thread(target=self.run, daemon=True,
+                                       name="member-prefetch")
+        self.thread.start()
+
+    def put(self, item) -> bool:
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(self) -> None:
+        try:
+            for resource in self.resources:
+                if resource.content is not None and self.wanted(resource):
+                    started = time.perf_counter()
+                    content = BytesIO(resource.content.read())
+                    self.inflate_seconds += time.perf_counter() - started
+                    # The archive iterator closes the original stream
+                    if not self.put((type(resource)(resource.repository_path,
+                                                    content, resource.info),
+                                     None)):
+                        return
+                    continue
+
+                released = threading.Event()
+                if not self.put((resource, released)):
+                    return
+                while not released.wait(POLL_INTERVAL):
+                    if self.stopped.is_set():
+                        return
+            self.put(_END)
+        except BaseException as error:
+            # Raised by the consumer, e.g. on a corrupted member
+            self.put(error)
+
+    def __iter__(self) -> Iterator[Resource]:
+        while True:
+            started = time.perf_counter()
+            item = self.queue.get()
+            self.wait_seconds += time.perf_counter() - started
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            resource, released = item
+            try:
+                yield resource
+            finally:
+                if released is not None:
+                    released.set()
+
+    def close(self) -> None:
+        """Stops the thread, e.g. when the consumer gives up early."""
+        self.stopped.set()
+        self.thread.join()
+        if hasattr(self.resources, "close"):
+            self.resources.close()
@@ -0,0 +1,173 @@
+import heapq
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass
+from typing import ContextManager, Iterator, Optional
+
+
+SLOWEST_COUNT = 10
+
+
+@dataclass
+class StageTiming:
+    seconds: float = 0.0
+    bytes: int = 0
+    calls: int = 0
+
+
+@dataclass
+class PatternTiming:
+    seconds: float = 0.0
+    bytes: int = 0
+    # Contents offered to the pattern, and those passing its prefilter
+    contents: int = 0
+    candidates: int = 0
+    matches: int = 0
+    # Engine that compiled the pattern, after any fallback to `re`
+    engine: str = ""
+
+
+@dataclass
+class MemberTiming:
+    seconds: float
+    path: str
+    repository_path: str
+    size: int
+    matches: int
+
+
+def megabytes_per_second(size: int, seconds: float) -> float:
+    return size / (1024 * 1024) / max(seconds, 1e-9)
+
+
+class ScanProfile:
+    """Wall time, bytes and match counts of the stages of a scan.
+
+    A profile is filled by one extension file scan, possibly in a worker
+    process, and merged into the profile of the whole run, which keeps
+    totals per stage and per pattern and the slowest extensions and members.
+    """
+
+    def __init__(self, path: Optional[str] = None,
+                 slowest_count: int = SLOWEST_COUNT):
+        self.path = path
+        self.slowest_count = slowest_count
+        self.files = 0
+        self.seconds = 0.0
+        self.stages: dict[str, StageTiming] = {}
+        self.patterns: dict[str, PatternTiming] = {}
+        # Min-heaps holding the slowest entries only
+        self.slowest_members: list[tuple[float, int, MemberTiming]] = []
+        self.slowest_extensions: list[tuple[float, str, int]] = []
+        self._counter = 0
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageTiming]:
+        """Times a block; the block may add the bytes it processed."""
+        timing = self.stages.setdefault(name, StageTiming())
+        started = time.perf_counter()
+        try:
+            yield timing
+        finally:
+            timing.seconds += time.perf_counter() - started
+            timing.calls += 1
+
+    def add_pattern(self, label: str, seconds: float, size: int,
+                    candidate: bool, matches: int, engine: str = "") -> None:
+        timing = self.patterns.setdefault(label, PatternTiming())
+        timing.engine = engine
+        timing.contents += 1
+        if candidate:
+            timing.seconds += seconds
+            timing.bytes += size
+            timing.candidates += 1
+            timing.matches += matches
+
+    def add_member(self, member: MemberTiming) -> None:
+        self._counter += 1
+        entry = (member.seconds, self._counter, member)
+        if len(self.slowest_members) < self.slowest_count:
+            heapq.heappush(self.slowest_members, entry)
+        else:
+            heapq.heappushpop(self.slowest_members, entry)
+
+    def merge(self, other: "ScanProfile", size: int = 0) -> None:
+        """Adds the profile of one extension file of `size` bytes."""
+        self.files += 1
+        self.seconds += other.seconds
+        for name, timing in other.stages.items():
+            total = self.stages.setdefault(name, StageTiming())
+            total.seconds += timing.seconds
+            total.bytes += timing.bytes
+            total.calls += timing.calls
+        for label, timing in other.patterns.items():
+            total = self.patterns.setdefault(label, PatternTiming())
+            total.seconds += timing.seconds
+            total.bytes += timing.bytes
+            total.contents += timing.contents
+            total.candidates += timing.candidates
+            total.matches += timing.matches
+            total.engine = timing.engine
+        for _, _, member in other.slowest_members:
+            self.add_member(member)
+
+        entry = (other.seconds, other.path or "", size)
+        if len(self.slowest_extensions) < self.slowest_count:
+            heapq.heappush(self.slowest_extensions, entry)
+        else:
+            heapq.heappushpop(self.slowest_extensions, entry)
+
+    def summary(self) -> dict:
+        """Returns the profile as plain JSON-serializable data."""
+        def rates(timing) -> dict:
+            return dict(asdict(timing), megabytes_per_second=round(
+                megabytes_per_second(timing.bytes, timing.seconds), 3))
+
+        return {
+            "files": self.files,
+            "seconds": self.seconds,
+            "stages": {name: rates(timing)
+                       for name, timing in self.stages.items()},
+            "patterns": {
+                label: rates(timing) for label, timing in sorted(
+                    self.patterns.items(), key=lambda x: -x[1].seconds)
+            },
+            "slowest_extensions": [
+                {"seconds": seconds, "path": path, "size": size}
+                for seconds, path, size in sorted(self.slowest_extensions,
+                                                  reverse=True)
+            ],
+            "slowest_members": [
+                asdict(member) for _, _, member in sorted(
+                    self.slowest_members, reverse=True)
+            ],
+        }
+
+    def report(self) -> str:
+        """Returns a short human readable digest of the summary."""
+        summary = self.summary()
+        lines = [f"Profile of {self.files} files, "
+                 f"{self.seconds:.2f}s scanning"]
+        for name, timing in summary["stages"].items():
+            lines.append(f"  stage {name:<16} {timing['seconds']:>9.3f}s "
+                         f"{timing['megabytes_per_second']:>10.2f} MB/s")
+        for label, timing in list(summary["patterns"].items())[:5]:
+            lines.append(f"  pattern {label:<14} {timing['seconds']:>9.3f}s "
+                         f"{timing['candidates']}/{timing['contents']} "
+                         f"candidates, {timing['matches']} matches, "
+                         f"{timing['engine']}")
+        for extension in summary["slowest_extensions"][:3]:
+            lines.append(f"  slow extension {extension['seconds']:.3f}s "
+                         f"{extension['path']}")
+        for member in summary["slowest_members"][:3]:
+            lines.append(f"  slow member {member['seconds']:.3f}s "
+                         f"{member['path']}:{member['repository_path']}")
+        return "\n".join(lines)
+
+
+def stage(profile: Optional[ScanProfile],
+          name: str) -> ContextManager[StageTiming]:
+    """Times a block when profiling, and costs next to nothing otherwise."""
+    if profile is None:
+        return nullcontext(StageTiming())
+    return profile.stage(name)
@@ -0,0 +1,54 @@
+import importlib
+import re
+from typing import Any, Optional, Union
+
+
+DEFAULT_ENGINE = "re"
+# Engine name: importable module
+ENGINE_MODULES = {
+    "re": "re",
+    "regex": "regex",  # Backtracking, with better worst cases than re
+    "re2": "re2",  # Linear time, from the google-re2 or pyre2 packages
+}
+ENGINES = tuple(ENGINE_MODULES)
+
+_modules: dict[str, Any] = {"re": re}
+
+
+class UnknownEngine(ValueError):
+    pass
+
+
+def engine_module(name: str) -> Optional[Any]:
+    """Imports an engine once; returns None if it is not installed."""
+    if name not in ENGINE_MODULES:
+        raise UnknownEngine(f"Unknown regular expression engine {name}, "
+                            f"expected one of {', '.join(ENGINES)}")
+    if name not in _modules:
+        try:
+            _modules[name] = importlib.import_module(ENGINE_MODULES[name])
+        except ImportError:
+            _modules[name] = None
+    return _modules[name]
+
+
+def available_engines() -> list[str]:
+    return [name for name in ENGINES if engine_module(name) is not None]
+
+
+def compile_expression(pattern: Union[str, bytes], engine: str = DEFAULT_ENGINE
+                       ) -> tuple[Any, str]:
+    """Compiles a pattern with an engine, falling back to `re`.
+
+    Falls back when the engine is not installed or does not support the
+    pattern, e.g. lookarounds under RE2. Returns the compiled pattern and
+    the engine that compiled it. Every engine's pattern offers the `search`,
+    `match` and `finditer` methods of `re` that the matchers use.
+    """
+    module = engine_module(engine)
+    if module is not None and module is not re:
+        try:
+            return module.compile(pattern), engine
+        except Exception:
+            pass  # Unsupported syntax; re compiles every ruleset pattern
+    return re.compile(pattern), DEFAULT_ENGINE
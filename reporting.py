@@ -0,0 +1,291 @@
+import json
+import shutil
+import sys
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import IO, Optional
+from scanner import BUDGETS, WORKER_EXITED, Finding, ScanResult
+
+
+TOOL_NAME = "CRX-Ray"
+SARIF_SCHEMA = "https://json.schemastore.org/sarif-2.1.0.json"
+RECORD_FIELDS = ("path", "extension_type", "extension_id", "digest",
+                 "repository_path", "service_name", "token", "start", "end",
+                 "context")
+
+
+def finding_record(result: ScanResult, finding: Finding) -> dict:
+    """Flattens a finding and the extension it was found in."""
+    return {
+        "path": str(result.path),
+        "extension_type": result.extension_type,
+        "extension_id": result.extension_id,
+        "digest": result.digest,
+        "repository_path": finding.repository_path,
+        "service_name": finding.service_name,
+        "token": finding.token,
+        "start": finding.start,
+        "end": finding.end,
+        "context": finding.context,
+    }
+
+
+def incomplete_reason(reason: str) -> str:
+    """Describes why a member was left unscanned, after its path."""
+    if reason in BUDGETS:
+        return f"exceeded the {reason}"
+    if reason == WORKER_EXITED:
+        return "was being scanned when its worker exited"
+    return f"was not scanned: {reason}"
+
+
+def changes_record(result: ScanResult) -> dict:
+    """The members of an extension file changed since its last version."""
+    changes = result.version_changes
+    return {
+        "path": str(result.path),
+        "extension_id": result.extension_id,
+        "digest": result.digest,
+        "previous_path": changes.previous_path,
+        "previous_digest": changes.previous_digest,
+        "added": changes.added,
+        "changed": changes.changed,
+        "removed": changes.removed,
+        "unchanged": changes.unchanged,
+    }
+
+
+class Reporter(ABC):
+    """Writes the results of one run to a single buffered output stream.
+
+    Structured reporters write findings only; unreadable files are reported
+    on `errors` so that the output stays machine readable. Changes since the
+    previous version of an extension are written to `changes`, if set, as
+    JSON lines.
+    """
+
+    def __init__(self, output: IO[str], errors: IO[str] = sys.stderr):
+        self.output = output
+        self.errors = errors
+        self.changes: Optional[IO[str]] = None
+
+    def write_result(self, result: ScanResult) -> None:
+        if result.error is not None:
+            self.write_error(result)
+            return
+        for finding in result.findings:
+            self.write_finding(result, finding)
+        for repository_path, reason in result.incomplete:
+            self.write_incomplete(result, repository_path, reason)
+        if result.version_changes is not None:
+            self.write_changes(result)
+
+    def write_error(self, result: ScanResult) -> None:
+        self.errors.write(f"{result.error}\n")
+
+    def write_incomplete(self, result: ScanResult, repository_path: str,
+                         reason: str) -> None:
+        self.errors.write(f"Incomplete scan of {result.path}: "
+                          f"{repository_path} {incomplete_reason(reason)}\n")
+
+    def write_changes(self, result: ScanResult) -> None:
+        if self.changes is not None:
+            self.changes.write(
+                json.dumps(changes_record(result), ensure_ascii=False))
+            self.changes.write("\n")
+
+    @abstractmethod
+    def write_finding(self, result: ScanResult, finding: Finding) -> None:
+        ...
+
+    def finish(self) -> None:
+        self.output.flush()
+
+
+class TextReporter(Reporter):
+    """Human readable report, colored only when the terminal is a TTY.
+
+    An optional `file_output` receives an uncolored copy of the findings.
+    """
+
+    def __init__(self, output: IO[str], file_output: Optional[IO[str]] = None,
+                 colors: Optional[bool] = None):
+        super().__init__(output, output)
+        self.file_output = file_output
+        self.colors = colors if colors is not None else output.isatty()
+        self.separator = "-" * shutil.get_terminal_size().columns + "\n"
+
+    def write_result(self, result: ScanResult) -> None:
+        if result.error is None:
+            self.output.write(f"Searching in {result.path} ...\n")
+        super().write_result(result)
+
+    def write_changes(self, result: ScanResult) -> None:
+        super().write_changes(result)
+        self.output.write(f"Changes: {result.version_changes.summary()}\n")
+
+    def format_finding(self, finding: Finding, colors: bool) -> str:
+        def paint(text: str, code: int) -> str:
+            return f"\033[{code}m{text}\033[0m" if colors else text
+
+        token = finding.token
+        # Highlight token in context
+        context = finding.context.replace(token, paint(token, 91))
+        return (f"{paint('Found API Keys', 94)}\n"
+                f"  {paint('Service Name:', 92)} {finding.service_name}\n"
+                f"  {paint('Token:', 93)} {token}\n"
+                f"  {paint('Extension Type:', 91)} {finding.extension_type}\n"
+                f"  {paint('Repository Path:', 95)} {finding.repository_path}\n"
+                f"  {paint('Context:', 96)}\n{context}\n"
+                + self.separator)
+
+    def write_finding(self, result: ScanResult, finding: Finding) -> None:
+        self.output.write(self.format_finding(finding, self.colors))
+        if self.file_output is not None:
+            self.file_output.write(self.format_finding(finding, False))
+
+    def finish(self) -> None:
+        super().finish()
+        if self.file_output is not None:
+            self.file_output.flush()
+
+
+class JsonLinesReporter(Reporter):
+    """One JSON object per finding."""
+
+    def write_finding(self, result: ScanResult, finding: Finding) -> None:
+        self.output.write(
+            json.dumps(finding_record(result, finding), ensure_ascii=False))
+        self.output.write("\n")
+
+
+class CsvReporter(Reporter):
+    """One CSV row per finding, after a header row."""
+
+    def __init__(self, output: IO[str], errors: IO[str] = sys.stderr):
+        import csv  # Only CSV reports need the module
+        super().__init__(output, errors)
+        self.writer = csv.DictWriter(output, fieldnames=RECORD_FIELDS)
+        self.writer.writeheader()
+
+    def write_finding(self, result: ScanResult, finding: Finding) -> None:
+        self.writer.writerow(finding_record(result, finding))
+
+
+class SarifReporter(Reporter):
+    """A SARIF 2.1.0 log with one result per finding, written on finish.
+
+    Every service is a rule, and an archive member is an artifact nested in
+    the artifact of its extension file. Token offsets are byte regions of
+    the member.
+    """
+
+    def __init__(self, output: IO[str], errors: IO[str] = sys.stderr,
+                 tool_version: Optional[str] = None):
+        super().__init__(output, errors)
+        self.tool_version = tool_version
+        self.rules: dict[str, int] = {}
+        self.artifacts: list[dict] = []
+        self.artifact_indices: dict[tuple[str, Optional[str]], int] = {}
+        self.results: list[dict] = []
+        self.notifications: list[dict] = []
+
+    def artifact_index(self, uri: str, parent_uri: Optional[str] = None) -> int:
+        key = (uri, parent_uri)
+        if key not in self.artifact_indices:
+            artifact = {"location": {"uri": uri}}
+            if parent_uri is not None:
+                artifact["parentIndex"] = self.artifact_index(parent_uri)
+            self.artifact_indices[key] = len(self.artifacts)
+            self.artifacts.append(artifact)
+        return self.artifact_indices[key]
+
+    def write_error(self, result: ScanResult) -> None:
+        super().write_error(result)
+        self.notifications.append({
+            "level": "error",
+            "message": {"text": result.error},
+            "locations": [{"physicalLocation": {"artifactLocation": {
+                "uri": Path(result.path).as_posix()}}}],
+        })
+
+    def write_incomplete(self, result: ScanResult, repository_path: str,
+                         reason: str) -> None:
+        super().write_incomplete(result, repository_path, reason)
+        extension_uri = Path(result.path).as_posix()
+        self.notifications.append({
+            "level": "warning",
+            "message": {"text": f"Not scanned: {repository_path} "
+                                f"{incomplete_reason(reason)}"},
+            "locations": [{"physicalLocation": {"artifactLocation": {
+                "uri": repository_path,
+                "index": self.artifact_index(repository_path, extension_uri),
+            }}}],
+        })
+
+    def write_finding(self, result: ScanResult, finding: Finding) -> None:
+        service_name = finding.service_name
+        rule_index = self.rules.setdefault(service_name, len(self.rules))
+        extension_uri = Path(result.path).as_posix()
+        artifact_location = {
+            "uri": finding.repository_path,
+            "index": self.artifact_index(finding.repository_path,
+                                         extension_uri),
+        }
+        physical_location = {"artifactLocation": artifact_location}
+        if finding.start is not None:
+            physical_location["region"] = {
+                "byteOffset": finding.start,
+                "byteLength": finding.end - finding.start,
+            }
+
+        self.results.append({
+            "ruleId": service_name,
+            "ruleIndex": rule_index,
+            "level": "error",
+            "message": {"text": f"{service_name} API key found in "
+                                f"{finding.repository_path}"},
+            "locations": [{"physicalLocation": physical_location}],
+            "properties": {
+                "token": finding.token,
+                "context": finding.context,
+                "extensionPath": extension_uri,
+                "extensionType": result.extension_type,
+                "extensionId": result.extension_id,
+                "digest": result.digest,
+            },
+        })
+
+    def finish(self) -> None:
+        driver = {
+            "name": TOOL_NAME,
+            "rules": [{"id": service_name,
+                       "shortDescription": {"text": f"{service_name} API key"}}
+                      for service_name in self.rules],
+        }
+        if self.tool_version is not None:
+            driver["version"] = self.tool_version
+        log = {
+            "$schema": SARIF_SCHEMA,
+            "version": "2.1.0",
+            "runs": [{
+                "tool": {"driver": driver},
+                "invocations": [{
+                    "executionSuccessful": True,
+                    "toolExecutionNotifications": self.notifications,
+                }],
+                "artifacts": self.artifacts,
+                "results": self.results,
+            }],
+        }
+        json.dump(log, self.output, ensure_ascii=False, indent=2)
+        self.output.write("\n")
+        super().finish()
+
+
+REPORT_FORMATS = {
+    "text": TextReporter,
+    "jsonl": JsonLinesReporter,
+    "csv": CsvReporter,
+    "sarif": SarifReporter,
+}
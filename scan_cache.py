@@ -0,0 +1,368 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+from configuration import CACHE_DIRECTORY, RULESET_VERSION
+
+if TYPE_CHECKING:
+    import sqlite3
+    from zipfile import ZipInfo
+
+
+DEFAULT_RESULT_CACHE = CACHE_DIRECTORY.joinpath("results.sqlite3")
+DEFAULT_CACHE_SIZE = 512 * 1024 * 1024  # 512mb
+FORMAT_VERSION = 3  # Bump when the stored findings change layout or scope
+
+
+def connect(path: Path, read_only: bool) -> "sqlite3.Connection":
+    """Opens a cache database; sqlite3 is only imported once it is used."""
+    import sqlite3
+    if read_only:
+        # Shared with the prefetch thread, by stores that lock their reads
+        return sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30,
+                               check_same_thread=False)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+class ResultCache:
+    """Persistent scan findings keyed by file digest and ruleset version.
+
+    Entries of another ruleset or findings format are never returned and are
+    purged when the cache is opened for writing. Once the stored findings
+    exceed `max_bytes`, the least recently used entries are evicted.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS results (
+            hash_algorithm TEXT NOT NULL,
+            digest TEXT NOT NULL,
+            ruleset TEXT NOT NULL,
+            findings TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            last_used REAL NOT NULL,
+            PRIMARY KEY (hash_algorithm, digest, ruleset)
+        );
+        CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+    """
+
+    def __init__(self, path: Path = DEFAULT_RESULT_CACHE,
+                 max_bytes: int = DEFAULT_CACHE_SIZE,
+                 read_only: bool = False,
+                 ruleset_version: str = RULESET_VERSION):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self.ruleset = f"{ruleset_version}:{FORMAT_VERSION}"
+        self.hits = 0
+        self.misses = 0
+
+        self.connection = connect(self.path, read_only)
+        if read_only:
+            self.total_bytes = 0
+            return
+
+        self.connection.executescript(self.SCHEMA)
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM results WHERE ruleset != ?", (self.ruleset,))
+        self.total_bytes = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception_args) -> bool:
+        self.close()
+        return False
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def get(self, digest: str, hash_algorithm: str) -> Optional[list[dict]]:
+        """Returns the cached findings of a file, or None on a miss."""
+        row = self.connection.execute(
+            "SELECT findings FROM results "
+            "WHERE hash_algorithm = ? AND digest = ? AND ruleset = ?",
+            (hash_algorithm, digest, self.ruleset)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return json.loads(row[0])
+
+    def touch(self, digest: str, hash_algorithm: str) -> None:
+        """Marks an entry as recently used."""
+        with self.connection:
+            self.connection.execute(
+                "UPDATE results SET last_used = ? "
+                "WHERE hash_algorithm = ? AND digest = ? AND ruleset = ?",
+                (time.time(), hash_algorithm, digest, self.ruleset))
+
+    def put(self, digest: str, hash_algorithm: str,
+            findings: list[dict]) -> None:
+        """Stores the findings of a file and evicts old entries if needed."""
+        payload = json.dumps(findings, separators=(",", ":"))
+        with self.connection:
+            previous = self.connection.execute(
+                "SELECT size FROM results "
+                "WHERE hash_algorithm = ? AND digest = ? AND ruleset = ?",
+                (hash_algorithm, digest, self.ruleset)).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (hash_algorithm, digest, self.ruleset, payload, len(payload),
+                 time.time()))
+        self.total_bytes += len(payload) - (previous[0] if previous else 0)
+
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self) -> None:
+        """Evicts least recently used entries down to 90% of the limit."""
+        target = int(self.max_bytes * 0.9)
+        with self.connection:
+            rows = self.connection.execute(
+                "SELECT rowid, size FROM results ORDER BY last_used")
+            evicted: list[int] = []
+            for rowid, size in rows:
+                if self.total_bytes <= target:
+                    break
+                evicted.append(rowid)
+                self.total_bytes -= size
+            self.connection.executemany(
+                "DELETE FROM results WHERE rowid = ?",
+                [(rowid,) for rowid in evicted])
+
+
+_shared_caches: dict[Path, ResultCache] = {}
+
+
+def shared_result_cache(path: Path) -> Optional[ResultCache]:
+    """Returns a read-only cache connection reused within this process."""
+    path = Path(path)
+    if path not in _shared_caches:
+        if not path.exists():
+            return None
+        _shared_caches[path] = ResultCache(path, read_only=True)
+    return _shared_caches[path]
+
+
+DEFAULT_MEMBER_CACHE = CACHE_DIRECTORY.joinpath("members.sqlite3")
+DEFAULT_MEMBER_CACHE_SIZE = 256 * 1024 * 1024  # 256mb
+MEMBER_MEMORY_ENTRIES = 65536
+
+# CRC32, uncompressed size, compressed size and compression method
+MemberKey = tuple[int, int, int, int]
+
+
+def member_key(info: "ZipInfo") -> MemberKey:
+    """Identifies a member by its ZIP central directory entry."""
+    return (info.CRC, info.file_size, info.compress_size, info.compress_type)
+
+
+class MemberCache:
+    """Findings of archive members keyed by their central directory entry.
+
+    A member is identified by the CRC32, uncompressed and compressed sizes
+    and compression method recorded in the ZIP central directory, so a
+    byte-identical `jquery.min.js` shipped by another extension is recognized
+    before it is decompressed. Such a hit trusts the key: a member colliding
+    with the key of another content on all four fields would reuse that
+    content's findings. The content hash of every scanned member is stored
+    as well; a key stored with two different contents, e.g. by parallel
+    scans, is ambiguous, and members with it are only reused after their
+    content hash matches.
+
+    Lookups go through an in-process LRU first and the database second.
+    Without a path, the cache only lives for the current process. Once the
+    stored findings exceed `max_bytes`, the least recently used entries are
+    evicted.
+    """
+
+    SCHEMA = """
+        -- Keyed by CRC32 and size only, before the compressed entry was
+        DROP TABLE IF EXISTS members;
+        CREATE TABLE IF NOT EXISTS member_findings (
+            crc INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            compress_size INTEGER NOT NULL,
+            compress_type INTEGER NOT NULL,
+            ruleset TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            findings TEXT NOT NULL,
+            bytes INTEGER NOT NULL,
+            last_used REAL NOT NULL,
+            PRIMARY KEY (crc, size, compress_size, compress_type, ruleset,
+                         content_hash)
+        );
+        CREATE INDEX IF NOT EXISTS member_findings_last_used
+            ON member_findings (last_used);
+    """
+    KEY_CONDITION = ("crc = ? AND size = ? AND compress_size = ? "
+                     "AND compress_type = ? AND ruleset = ?")
+
+    def __init__(self, path: Optional[Path] = DEFAULT_MEMBER_CACHE,
+                 read_only: bool = False,
+                 ruleset_version: str = RULESET_VERSION,
+                 max_bytes: int = DEFAULT_MEMBER_CACHE_SIZE):
+        self.path = Path(path) if path is not None else None
+        self.read_only = read_only
+        self.ruleset = f"{ruleset_version}:{FORMAT_VERSION}"
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._memory: OrderedDict[MemberKey, dict[str, list[dict]]] = \
+            OrderedDict()
+        # `knows` is also called from the prefetch thread
+        self._lock = threading.RLock()
+
+        self.connection: Optional["sqlite3.Connection"] = None
+        if self.path is None:
+            return
+        if read_only:
+            if self.path.exists():
+                self.connection = connect(self.path, read_only)
+            return
+
+        self.connection = connect(self.path, read_only)
+        self.connection.executescript(self.SCHEMA)
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM member_findings WHERE ruleset != ?",
+                (self.ruleset,))
+        self.total_bytes = self.connection.execute(
+            "SELECT COALESCE(SUM(bytes), 0) FROM member_findings"
+        ).fetchone()[0]
+
+    def close(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+
+    def _entries(self, key: MemberKey) -> dict[str, list[dict]]:
+        """Returns the findings stored per content hash for a key."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+            entries: dict[str, list[dict]] = {}
+            if self.connection is not None:
+                for content_hash, findings in self.connection.execute(
+                        "SELECT content_hash, findings FROM member_findings "
+                        f"WHERE {self.KEY_CONDITION}", (*key, self.ruleset)):
+                    entries[content_hash] = json.loads(findings)
+            if entries:
+                self._remember(key, entries)
+            return entries
+
+    def _remember(self, key: MemberKey,
+                  entries: dict[str, list[dict]]) -> None:
+        with self._lock:
+            self._memory[key] = entries
+            self._memory.move_to_end(key)
+            while len(self._memory) > MEMBER_MEMORY_ENTRIES:
+                self._memory.popitem(last=False)
+
+    def knows(self, key: MemberKey) -> bool:
+        """Whether `lookup` would reuse findings without reading the member."""
+        return len(self._entries(key)) == 1
+
+    def lookup(self, key: MemberKey) -> Optional[list[dict]]:
+        """Returns the findings of an unambiguous member without reading it."""
+        entries = self._entries(key)
+        if len(entries) != 1:
+            return None
+        self.hits += 1
+        return next(iter(entries.values()))
+
+    def lookup_content(self, key: MemberKey,
+                       content_hash: str) -> Optional[list[dict]]:
+        """Returns the findings of a member verified by its content hash."""
+        findings = self._entries(key).get(content_hash)
+        if findings is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return findings
+
+    def add(self, key: MemberKey, content_hash: str,
+            findings: list[dict]) -> None:
+        """Remembers the findings of a scanned member."""
+        entries = dict(self._entries(key))
+        entries[content_hash] = findings
+        self._remember(key, entries)
+
+        if self.connection is None or self.read_only:
+            return
+        payload = json.dumps(findings, separators=(",", ":"))
+        with self.connection:
+            previous = self.connection.execute(
+                "SELECT bytes FROM member_findings "
+                f"WHERE {self.KEY_CONDITION} AND content_hash = ?",
+                (*key, self.ruleset, content_hash)).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO member_findings "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (*key, self.ruleset, content_hash, payload, len(payload),
+                 time.time()))
+        self.total_bytes += len(payload) - (previous[0] if previous else 0)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def touch(self, keys: list[MemberKey]) -> None:
+        """Marks the entries of reused members as recently used."""
+        if self.connection is None or self.read_only or not keys:
+            return
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE member_findings SET last_used = ? "
+                f"WHERE {self.KEY_CONDITION}",
+                ((now, *key, self.ruleset) for key in keys))
+
+    def evict(self) -> None:
+        """Evicts least recently used entries down to 90% of the limit."""
+        target = int(self.max_bytes * 0.9)
+        with self.connection:
+            rows = self.connection.execute(
+                "SELECT rowid, bytes FROM member_findings ORDER BY last_used")
+            evicted: list[int] = []
+            for rowid, size in rows:
+                if self.total_bytes <= target:
+                    break
+                evicted.append(rowid)
+                self.total_bytes -= size
+            self.connection.executemany(
+                "DELETE FROM member_findings WHERE rowid = ?",
+                [(rowid,) for rowid in evicted])
+        # Evicted entries must not be reused from memory either
+        self._memory.clear()
+
+    @staticmethod
+    def hasher():
+        return hashlib.blake2b(digest_size=16)
+
+    @staticmethod
+    def content_hash(content: bytes) -> str:
+        hasher = MemberCache.hasher()
+        hasher.update(content)
+        return hasher.hexdigest()
+
+
+_shared_member_caches: dict[Optional[Path], MemberCache] = {}
+
+
+def shared_member_cache(path: Optional[Path]) -> MemberCache:
+    """Returns a read-only member cache reused within this process."""
+    path = Path(path) if path is not None else None
+    if path not in _shared_member_caches:
+        _shared_member_caches[path] = MemberCache(path, read_only=True)
+    return _shared_member_caches[path]
@@ -0,0 +1,442 @@
+import http.client
+import io
+import json
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import BinaryIO, Optional, Union
+from urllib.parse import parse_qs, urlsplit
+from configuration import API_PATTERNS
+from reporting import finding_record
+from scanner import ScanOptions, ScanResult, scan_extension_file
+
+
+UNIX_PREFIX = "unix:"
+LATENCY_SAMPLES = 10000  # Most recent requests kept for the percentiles
+THROUGHPUT_WINDOW = 60.0  # Seconds
+MAX_UPLOAD_SIZE = 512 * 1024 * 1024  # 512mb
+MAX_REQUEST_SIZE = 1024 * 1024  # 1mb, for a JSON body naming a path
+SPOOL_CHUNK = 1024 * 1024  # 1mb
+EXTENSION_SUFFIXES = (".crx", ".xpi")
+
+
+class QueueFull(Exception):
+    pass
+
+
+def warm_up() -> int:
+    """Runs in every worker once, so no request pays for the imports."""
+    return len(API_PATTERNS)
+
+
+def timed_scan(path: Path, options: ScanOptions) -> tuple[ScanResult, float]:
+    started = time.perf_counter()
+    result = scan_extension_file(path, options)
+    return result, time.perf_counter() - started
+
+
+def percentile(values: list[float], percent: float) -> Optional[float]:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    rank = max(int(len(values) * percent / 100.0 + 0.5) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class DaemonStatistics:
+    """Queue depth, latency percentiles and throughput of a scan daemon.
+
+    Latency runs from the arrival of a request to its result. The service
+    time is spent scanning in a worker; the overhead is the rest, i.e. the
+    time spent in the queue and dispatching to and from the worker.
+    """
+
+    def __init__(self, jobs: int):
+        self.jobs = jobs
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.errors = 0
+        self.restarts = 0
+        self.bytes = 0
+        # (finished, latency, service time) of the most recent requests
+        self.samples: deque[tuple[float, float, float]] = \
+            deque(maxlen=LATENCY_SAMPLES)
+
+    def add(self, result: ScanResult, latency: float, service: float) -> None:
+        with self.lock:
+            self.completed += 1
+            self.bytes += result.size
+            self.errors += result.error is not None
+            self.samples.append((time.monotonic(), latency, service))
+
+    def summary(self) -> dict:
+        with self.lock:
+            samples = list(self.samples)
+            pending = self.pending
+            summary = {
+                "uptime": time.monotonic() - self.started,
+                "workers": self.jobs,
+                "pending": pending,
+                "queue_depth": max(pending - self.jobs, 0),
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "errors": self.errors,
+                "restarts": self.restarts,
+                "bytes": self.bytes,
+            }
+
+        now = time.monotonic()
+        recent = [sample for sample in samples
+                  if sample[0] >= now - THROUGHPUT_WINDOW]
+        window = min(THROUGHPUT_WINDOW, max(summary["uptime"], 1e-9))
+        summary["files_per_second"] = len(recent) / window
+        latencies = sorted(latency for _, latency, _ in samples)
+        overheads = sorted(latency - service
+                           for _, latency, service in samples)
+        for name, values in (("latency_ms", latencies),
+                             ("overhead_ms", overheads)):
+            summary[name] = {}
+            for percent in (50, 90, 99):
+                value = percentile(values, percent)
+                summary[name][f"p{percent}"] = round(value * 1000, 3) \
+                    if value is not None else None
+        return summary
+
+
+class ScanDaemon:
+    """A warm worker pool serving scan requests through a bounded queue.
+
+    At most `queue_size` scans are pending, counting the running ones; a
+    request beyond that is rejected with `QueueFull` right away, so callers
+    back off instead of piling up work. Archives sent as bytes are spooled
+    to a temporary file that the workers read, once a slot is taken.
+
+    A worker killed by the system breaks the whole pool: the scans pending in
+    it fail, and the pool is replaced by the next request or health check,
+    once submitting to it or waiting on it raises `BrokenProcessPool`.
+    """
+
+    def __init__(self, jobs: Optional[int] = None,
+                 options: Optional[ScanOptions] = None,
+                 queue_size: Optional[int] = None):
+        self.jobs = jobs if jobs is not None else os.cpu_count() or 1
+        self.options = options if options is not None else ScanOptions()
+        self.queue_size = queue_size if queue_size is not None \
+            else self.jobs * 16
+        self.slots = threading.BoundedSemaphore(self.queue_size)
+        self.statistics = DaemonStatistics(self.jobs)
+        self.spool = tempfile.TemporaryDirectory(prefix="crx-ray-")
+        self.pool_lock = threading.Lock()
+        self.executor = self.start_pool()
+
+    def close(self) -> None:
+        self.executor.shutdown(cancel_futures=True)
+        self.spool.cleanup()
+
+    def start_pool(self) -> ProcessPoolExecutor:
+        executor = ProcessPoolExecutor(max_workers=self.jobs)
+        # Start every worker now rather than on the first requests
+        for future in [executor.submit(warm_up) for _ in range(self.jobs)]:
+            future.result()
+        return executor
+
+    def restart_pool(self, broken: ProcessPoolExecutor) -> bool:
+        """Replaces a pool that raised `BrokenProcessPool`.
+
+        Returns False if another request already replaced it.
+        """
+        with self.pool_lock:
+            if self.executor is not broken:
+                return False
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.executor = self.start_pool()
+        with self.statistics.lock:
+            self.statistics.restarts += 1
+        return True
+
+    def check_pool(self) -> bool:
+        """Replaces the pool if it is broken; returns whether it was.
+
+        A broken pool refuses new work, so a no-op is submitted to find out.
+        """
+        executor = self.executor
+        try:
+            executor.submit(warm_up)
+        except BrokenProcessPool:
+            return self.restart_pool(executor)
+        return False
+
+    def acquire(self) -> None:
+        """Takes a queue slot, or raises `QueueFull` if none is left."""
+        if not self.slots.acquire(blocking=False):
+            with self.statistics.lock:
+                self.statistics.rejected += 1
+            raise QueueFull(f"{self.queue_size} scans are already pending")
+        with self.statistics.lock:
+            self.statistics.pending += 1
+
+    def submit(self, path: Path, acquired: bool = False) -> Future:
+        """Submits a scan, in the slot taken by `acquire` if `acquired`."""
+        if not acquired:
+            self.acquire()
+        try:
+            executor = self.executor
+            try:
+                future = executor.submit(timed_scan, path, self.options)
+            except BrokenProcessPool:
+                self.restart_pool(executor)
+                future = self.executor.submit(timed_scan, path, self.options)
+        except BaseException:
+            self.release()
+            raise
+        future.add_done_callback(lambda _: self.release())
+        return future
+
+    def release(self) -> None:
+        with self.statistics.lock:
+            self.statistics.pending -= 1
+        self.slots.release()
+
+    def scan(self, path: Path, name: Optional[str] = None,
+             acquired: bool = False) -> dict:
+        """Scans an extension file and returns its result as a record."""
+        received = time.perf_counter()
+        try:
+            result, service = self.submit(path, acquired).result()
+        except BrokenProcessPool:
+            # This scan is lost with the pool, but the next ones need not be
+            self.check_pool()
+            raise
+        self.statistics.add(result, time.perf_counter() - received, service)
+        if name is not None:
+            if result.error is not None:
+                result.error = result.error.replace(str(path), name)
+            result.path = Path(name)
+        return result_record(result)
+
+    def scan_bytes(self, data: bytes, suffix: str,
+                   name: Optional[str] = None) -> dict:
+        """Scans an archive sent as bytes, with a ".crx" or ".xpi" suffix."""
+        return self.scan_upload(io.BytesIO(data), len(data), suffix, name)
+
+    def scan_upload(self, stream: BinaryIO, length: int, suffix: str,
+                    name: Optional[str] = None) -> dict:
+        """Scans an archive of `length` bytes read from a stream.
+
+        The slot is taken before the archive is read, so a full queue rejects
+        an upload without receiving it; the archive is then copied to the
+        spool in chunks rather than held in memory.
+        """
+        with tempfile.NamedTemporaryFile(suffix=suffix,
+                                         dir=self.spool.name) as spooled:
+            self.acquire()
+            try:
+                remaining = length
+                while remaining > 0:
+                    chunk = stream.read(min(remaining, SPOOL_CHUNK))
+                    if not chunk:
+                        raise ValueError(f"Expected {length} bytes, received "
+                                         f"{length - remaining}")
+                    spooled.write(chunk)
+                    remaining -= len(chunk)
+                spooled.flush()
+            except BaseException:
+                self.release()
+                raise
+            return self.scan(Path(spooled.name),
+                             name if name is not None else f"upload{suffix}",
+                             acquired=True)
+
+
+def result_record(result: ScanResult) -> dict:
+    return {
+        "path": str(result.path),
+        "extension_type": result.extension_type,
+        "extension_id": result.extension_id,
+        "digest": result.digest,
+        "size": result.size,
+        "error": result.error,
+        "incomplete": [{"repository_path": repository_path, "budget": budget}
+                       for repository_path, budget in result.incomplete],
+        "findings": [finding_record(result, finding)
+                     for finding in result.findings],
+    }
+
+
+class ScanRequestHandler(BaseHTTPRequestHandler):
+    """HTTP interface of a `ScanDaemon`.
+
+    - `POST /scan` with a JSON body `{"path": ...}` scans a local file.
+    - `POST /scan?type=crx|xpi[&name=...]` scans the archive in the body.
+    - `GET /stats` returns the queue depth, latencies and throughput.
+    - `GET /health` answers once the workers are warm, after replacing a
+      broken pool, and with `503` if that failed.
+
+    A full queue answers `503` with a `Retry-After` header.
+    """
+
+    protocol_version = "HTTP/1.1"
+    daemon: ScanDaemon = None
+
+    def log_message(self, format: str, *args) -> None:
+        pass  # One line per request would dominate the output
+
+    def address_string(self) -> str:
+        return str(self.client_address or "unix")
+
+    def send_json(self, status: int, body: dict,
+                  headers: Optional[dict] = None) -> None:
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self) -> None:
+        route = urlsplit(self.path).path
+        if route == "/stats":
+            self.send_json(200, self.daemon.statistics.summary())
+        elif route == "/health":
+            try:
+                self.daemon.check_pool()
+            except Exception as error:
+                self.send_json(503, {"status": "broken", "error": str(error)})
+            else:
+                self.send_json(200, {"status": "ok",
+                                     "workers": self.daemon.jobs})
+        else:
+            self.send_json(404, {"error": f"No route {route}"})
+
+    def do_POST(self) -> None:
+        url = urlsplit(self.path)
+        if url.path != "/scan":
+            self.send_json(404, {"error": f"No route {url.path}"})
+            return
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        upload = "type" in query
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            # Reading a negative length would wait for the client to close
+            self.send_json(400, {"error": "Invalid Content-Length"},
+                           {"Connection": "close"})
+            return
+        if length > (MAX_UPLOAD_SIZE if upload else MAX_REQUEST_SIZE):
+            self.send_json(413, {"error": "Request too large"},
+                           {"Connection": "close"})
+            return
+        # An upload is read only once it has a slot, so a failed one may
+        # leave its body unread on the connection
+        unread = {"Connection": "close"} if upload else {}
+
+        try:
+            if upload:
+                suffix = f".{query['type'].lower()}"
+                if suffix not in EXTENSION_SUFFIXES:
+                    raise ValueError(f"Unsupported type {query['type']}")
+                record = self.daemon.scan_upload(self.rfile, length, suffix,
+                                                 query.get("name"))
+            else:
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(request, dict) \
+                        or not isinstance(request.get("path"), str):
+                    raise ValueError("Expected a path or an archive body")
+                path = Path(request["path"])
+                if not path.is_file():
+                    raise ValueError(f"No such file {path}")
+                record = self.daemon.scan(path)
+        except QueueFull as error:
+            self.send_json(503, {"error": str(error)},
+                           {"Retry-After": "1", **unread})
+        except ValueError as error:
+            self.send_json(400, {"error": str(error)}, unread)
+        except BrokenProcessPool as error:
+            self.send_json(500, {"error": f"Could not scan. A worker exited "
+                                          f"and the pool was restarted. "
+                                          f"{error}"}, unread)
+        except Exception as error:
+            self.send_json(500, {"error": f"Could not scan. {error}"}, unread)
+        else:
+            self.send_json(200, record)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(address: str, daemon: ScanDaemon
+                  ) -> Union[ThreadingHTTPServer, UnixHTTPServer]:
+    """Binds `host:port`, or `unix:<path>` for a Unix socket."""
+    handler = type("BoundScanRequestHandler", (ScanRequestHandler,),
+                   {"daemon": daemon})
+    if address.startswith(UNIX_PREFIX):
+        socket_path = address[len(UNIX_PREFIX):]
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)  # Left over by a daemon that was killed
+        return UnixHTTPServer(socket_path, handler)
+
+    host, _, port = address.rpartition(":")
+    return ThreadingHTTPServer((host or "127.0.0.1", int(port)), handler)
+
+
+def serve(address: str, jobs: Optional[int] = None,
+          options: Optional[ScanOptions] = None,
+          queue_size: Optional[int] = None) -> None:
+    """Serves scan requests until interrupted."""
+    daemon = ScanDaemon(jobs, options, queue_size)
+    server = create_server(address, daemon)
+    print(f"Serving on {address} with {daemon.jobs} workers, "
+          f"{daemon.queue_size} pending scans at most", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.close()
+        if address.startswith(UNIX_PREFIX):
+            try:
+                os.unlink(address[len(UNIX_PREFIX):])
+            except FileNotFoundError:
+                pass
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP client connection over a Unix socket."""
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def connect(address: str,
+            timeout: Optional[float] = None) -> http.client.HTTPConnection:
+    """Opens a client connection to a daemon address."""
+    if address.startswith(UNIX_PREFIX):
+        return UnixHTTPConnection(address[len(UNIX_PREFIX):], timeout)
+    host, _, port = address.rpartition(":")
+    return http.client.HTTPConnection(host or "127.0.0.1", int(port),
+                                      timeout=timeout)
@@ -0,0 +1,251 @@
+import multiprocessing
+import time
+from dataclasses import dataclass, field, replace
+from multiprocessing.connection import Connection, wait
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+from scanner import (EXTENSION_TIME_BUDGET, MEMBER_TIME_BUDGET, WORKER_EXITED,
+                     Finding, ScanOptions, ScanResult, scan_extension_file)
+
+
+# Time left to an abandoned extension to list its remaining members
+FINISH_GRACE = 1.0
+
+
+def watchdog_worker(connection: Connection) -> None:
+    """Scans the extension files sent by the watchdog, reporting progress."""
+
+    def on_member(repository_path: str,
+                  findings: Optional[list[Finding]]) -> None:
+        connection.send(("member", repository_path, findings))
+
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        path, options = task
+        try:
+            result = scan_extension_file(path, options, on_member)
+        except Exception as error:
+            result = ScanResult(path, path.suffix)
+            result.error = f"Could not scan {path}. {error}"
+        connection.send(("result", result))
+
+
+@dataclass
+class WatchdogTask:
+    index: int
+    path: Path
+    started: float
+    deadline: Optional[float]
+    finishing: bool = False
+    # Progress of the current attempt
+    member: Optional[str] = None
+    member_deadline: Optional[float] = None
+    completed: list[str] = field(default_factory=list)
+    attempt_findings: list[Finding] = field(default_factory=list)
+    # Carried over from abandoned attempts
+    skipped: set[str] = field(default_factory=set)
+    findings: list[Finding] = field(default_factory=list)
+    incomplete: list[tuple[str, str]] = field(default_factory=list)
+
+
+class WatchdogWorker:
+    """A worker process that can be killed in the middle of a scan."""
+
+    def __init__(self, context):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=watchdog_worker,
+                                       args=(child_connection,), daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.task: Optional[WatchdogTask] = None
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+    def stop(self) -> None:
+        try:
+            self.connection.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+
+class WatchdogPool:
+    """Scans extension files in worker processes watched against budgets.
+
+    A regular expression cannot be interrupted once it runs, so a member
+    over `options.member_timeout` is abandoned by killing its worker. A new
+    worker resumes the extension, skipping the members already scanned and
+    the abandoned one, which is recorded as incomplete. Past the
+    `options.extension_timeout`, an extension only lists its remaining
+    members as incomplete. Results are yielded in input order.
+    """
+
+    def __init__(self, workers: int, options: ScanOptions):
+        self.context = multiprocessing.get_context()
+        self.options = options
+        self.workers = [WatchdogWorker(self.context)
+                        for _ in range(max(workers, 1))]
+        self.restarts = 0
+
+    def submit(self, worker: WatchdogWorker, task: WatchdogTask) -> None:
+        options = replace(self.options, skip_members=frozenset(task.skipped))
+        if task.deadline is not None:
+            remaining = task.deadline - time.monotonic()
+            if remaining <= 0:
+                # Only list the remaining members, within a short grace
+                task.finishing = True
+                task.deadline = time.monotonic() + FINISH_GRACE
+                remaining = 0.0
+            options = replace(options, extension_timeout=remaining)
+
+        task.member = None
+        task.member_deadline = None
+        task.completed = []
+        task.attempt_findings = []
+        worker.task = task
+        worker.connection.send((task.path, options))
+
+    def abandon(self, worker: WatchdogWorker,
+                reason: Optional[str] = None) -> Optional[ScanResult]:
+        """Kills an overdue worker; returns the result if the task is over."""
+        task = worker.task
+        worker.kill()
+        self.workers[self.workers.index(worker)] = replacement = \
+            WatchdogWorker(self.context)
+        self.restarts += 1
+
+        task.findings.extend(task.attempt_findings)
+        task.skipped.update(task.completed)
+        if task.member is not None:
+            if reason is None:
+                reason = MEMBER_TIME_BUDGET \
+                    if task.member_deadline is not None \
+                    and time.monotonic() >= task.member_deadline \
+                    else EXTENSION_TIME_BUDGET
+            task.incomplete.append((task.member, reason))
+            task.skipped.add(task.member)
+
+        if task.finishing or task.member is None:
+            # Stuck outside of any member, e.g. in the archive itself
+            result = ScanResult(task.path, task.path.suffix)
+            result.error = f"Could not scan {task.path} " + (
+                "before its worker exited" if reason == WORKER_EXITED
+                else f"within the {EXTENSION_TIME_BUDGET}")
+            return result
+
+        self.submit(replacement, task)
+        return None
+
+    def complete(self, task: WatchdogTask,
+                 result: ScanResult) -> ScanResult:
+        result.findings = task.findings + result.findings
+        result.incomplete = task.incomplete + result.incomplete
+        return result
+
+    def receive(self, worker: WatchdogWorker) -> Optional[ScanResult]:
+        task = worker.task
+        try:
+            message = worker.connection.recv()
+        except EOFError:
+            # The worker died on its own, e.g. out of memory
+            return self.abandon(worker, WORKER_EXITED)
+
+        if message[0] == "result":
+            worker.task = None
+            return self.complete(task, message[1])
+
+        _, repository_path, findings = message
+        if findings is None:
+            task.member = repository_path
+            if self.options.member_timeout is not None:
+                task.member_deadline = \
+                    time.monotonic() + self.options.member_timeout
+        else:
+            task.member = None
+            task.member_deadline = None
+            task.completed.append(repository_path)
+            task.attempt_findings.extend(findings)
+        return None
+
+    def deadline(self, task: WatchdogTask) -> Optional[float]:
+        deadlines = [deadline for deadline in (task.deadline,
+                                               task.member_deadline)
+                     if deadline is not None]
+        return min(deadlines, default=None)
+
+    def map(self, paths: Iterable[Path],
+            window: Optional[int] = None) -> Iterator[ScanResult]:
+        """Scans every path, holding at most `window` results in flight."""
+        window = window if window is not None else len(self.workers) * 4
+        paths = iter(paths)
+        finished: dict[int, ScanResult] = {}
+        submitted = 0
+        yielded = 0
+        exhausted = False
+
+        while True:
+            for worker in self.workers:
+                if worker.task is not None or exhausted \
+                        or submitted - yielded >= window:
+                    continue
+                path = next(paths, None)
+                if path is None:
+                    exhausted = True
+                    continue
+                now = time.monotonic()
+                extension_timeout = self.options.extension_timeout
+                self.submit(worker, WatchdogTask(
+                    submitted, Path(path), now,
+                    now + extension_timeout
+                    if extension_timeout is not None else None))
+                submitted += 1
+
+            while yielded in finished:
+                yield finished.pop(yielded)
+                yielded += 1
+
+            busy = [worker for worker in self.workers
+                    if worker.task is not None]
+            if not busy:
+                if exhausted:
+                    return
+                continue
+
+            deadlines = [deadline for deadline in map(
+                self.deadline, (worker.task for worker in busy))
+                if deadline is not None]
+            timeout = max(min(deadlines) - time.monotonic(), 0) \
+                if deadlines else None
+            ready = wait([worker.connection for worker in busy], timeout)
+
+            for worker in busy:
+                task = worker.task
+                if worker.connection in ready:
+                    result = self.receive(worker)
+                else:
+                    deadline = self.deadline(task)
+                    if deadline is None or time.monotonic() < deadline:
+                        continue
+                    result = self.abandon(worker)
+                if result is not None:
+                    finished[task.index] = result
+
+    def shutdown(self, cancel_futures: bool = True) -> None:
+        """Stops the workers; scans in progress are always abandoned."""
+        for worker in self.workers:
+            if worker.task is not None:
+                worker.kill()
+            else:
+                worker.stop()
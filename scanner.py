@@ -0,0 +1,506 @@
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Optional, Union
+from archive_io import DEFAULT_HASH_ALGORITHM, MEMBER_ERRORS
+from crx_file import CrxFile, CrxResource, BadCrx
+from xpi_file import XpiFile, XpiResource, BadXpi
+from matcher import API_MATCHER, DEFAULT_CHUNK_SIZE, DEFAULT_MAX_TOKEN_LENGTH
+from member_selection import DEFAULT_MEMBER_POLICY, MemberPolicy
+from pipeline import INFLATE_STAGE, MATCH_STAGE, MemberPrefetcher
+from profiling import MemberTiming, ScanProfile, stage
+from scan_cache import (MemberCache, MemberKey, ResultCache, member_key,
+                        shared_member_cache, shared_result_cache)
+
+if TYPE_CHECKING:
+    from version_history import PreviousVersion, VersionChanges, VersionHistory
+
+
+@dataclass
+class Finding:
+    service_name: str
+    token: str
+    context: str
+    repository_path: str
+    extension_type: str
+    # Offsets of the token in the archive member, in bytes
+    start: Optional[int] = None
+    end: Optional[int] = None
+
+
+@dataclass
+class ScanOptions:
+    hash_algorithm: str = DEFAULT_HASH_ALGORITHM
+    result_cache_path: Optional[Path] = None
+    deduplicate_members: bool = False
+    member_cache_path: Optional[Path] = None
+    # Members larger than a chunk are scanned as a stream of chunks
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+    max_token_length: int = DEFAULT_MAX_TOKEN_LENGTH
+    profile: bool = False
+    # Budgets; time budgets in seconds are enforced by the watchdog
+    member_timeout: Optional[float] = None
+    extension_timeout: Optional[float] = None
+    max_member_size: Optional[int] = None
+    max_extension_size: Optional[int] = None
+    # Members a previous, abandoned attempt already scanned or gave up on
+    skip_members: frozenset[str] = frozenset()
+    # Members unchanged since the last scanned version of the extension id
+    # are not scanned again
+    version_history_path: Optional[Path] = None
+    # Members skipped before decompression; None scans every member
+    member_policy: Optional[MemberPolicy] = DEFAULT_MEMBER_POLICY
+    # Members inflated ahead by a thread while others are matched
+    inflate_ahead: int = 0
+
+
+@dataclass
+class ScanResult:
+    path: Path
+    extension_type: str
+    size: int = 0
+    digest: Optional[str] = None
+    extension_id: Optional[str] = None
+    findings: list[Finding] = field(default_factory=list)
+    error: Optional[str] = None
+    cached: bool = False
+    member_hits: int = 0
+    member_misses: int = 0
+    # Members scanned for the first time: (key, content hash, findings)
+    member_entries: list[tuple[MemberKey, str, list[dict]]] = \
+        field(default_factory=list)
+    # Keys of the members whose cached findings were reused
+    member_reused: list[MemberKey] = field(default_factory=list)
+    profile: Optional[ScanProfile] = None
+    # Members left unscanned: (repository path, exceeded budget)
+    incomplete: list[tuple[str, str]] = field(default_factory=list)
+    # Compared with the last scanned version of the same extension id
+    version_changes: Optional["VersionChanges"] = None
+    # Members whose findings are complete: (repository path, crc, size)
+    version_members: Optional[list[tuple[str, int, int]]] = None
+    # Repository paths of the version members the member policy skipped
+    version_skipped: list[str] = field(default_factory=list)
+    # Members the member policy skipped, by reason
+    skipped_members: dict[str, int] = field(default_factory=dict)
+    # Busy time of the pipeline stages, in seconds
+    stage_seconds: dict[str, float] = field(default_factory=dict)
+
+
+MEMBER_TIME_BUDGET = "member time budget"
+EXTENSION_TIME_BUDGET = "extension time budget"
+MEMBER_SIZE_BUDGET = "member size budget"
+EXTENSION_SIZE_BUDGET = "extension size budget"
+BUDGETS = (MEMBER_TIME_BUDGET, EXTENSION_TIME_BUDGET, MEMBER_SIZE_BUDGET,
+           EXTENSION_SIZE_BUDGET)
+# Not a budget: the watched worker died while scanning the member
+WORKER_EXITED = "worker exited"
+
+# Called with no findings before a member is scanned and with its findings
+# once it is
+MemberCallback = Callable[[str, Optional[list[Finding]]], None]
+
+
+def attribute_findings(member_findings: list[dict], repository_path: str,
+                       extension_type: str) -> list[Finding]:
+    """Attributes the cached findings of a member to an extension."""
+    return [Finding(**finding, repository_path=repository_path,
+                    extension_type=extension_type)
+            for finding in member_findings]
+
+
+def open_extension(extension_file_path: Path,
+                   hash_algorithm: str = DEFAULT_HASH_ALGORITHM) \
+        -> Optional[Union[CrxFile, XpiFile]]:
+    """Returns the extension file wrapper matching the file suffix."""
+    extension_type = extension_file_path.suffix
+    if extension_type == ".crx":
+        return CrxFile(extension_file_path, filter_list=None,
+                       hash_algorithm=hash_algorithm)
+    elif extension_type == ".xpi":
+        return XpiFile(extension_file_path, filter_list=None,
+                       hash_algorithm=hash_algorithm)
+    return None
+
+
+def exceeded_budget(options: ScanOptions, member_size: int,
+                    scanned_bytes: int, elapsed: float) -> Optional[str]:
+    """Returns the budget that scanning a member would exceed, if any."""
+    if options.extension_timeout is not None \
+            and elapsed >= options.extension_timeout:
+        return EXTENSION_TIME_BUDGET
+    if options.max_member_size is not None \
+            and member_size > options.max_member_size:
+        return MEMBER_SIZE_BUDGET
+    if options.max_extension_size is not None \
+            and scanned_bytes + member_size > options.max_extension_size:
+        return EXTENSION_SIZE_BUDGET
+    return None
+
+
+def scan_extension_file(extension_file_path: Path,
+                        options: Optional[ScanOptions] = None,
+                        on_member: Optional[MemberCallback] = None,
+                        digest: Optional[str] = None) -> ScanResult:
+    """Scans every resource of an extension file for API keys.
+
+    With a result cache, an extension file whose digest was already scanned
+    under the current ruleset returns the cached findings without being
+    decompressed. With member deduplication, archive members already scanned
+    in this process or found in the member cache are skipped before
+    decompression and their findings are attributed to this extension.
+    With a version history, members unchanged since the last scanned version
+    of the same extension id are not decompressed either, and the result
+    lists the members added, changed and removed since that version.
+    Members larger than `options.chunk_size` are matched chunk by chunk.
+    With `options.profile`, the result carries the timings of the scan.
+    With `options.inflate_ahead`, a thread inflates upcoming members while
+    the current one is matched. A `digest` computed ahead, e.g. while the
+    file was prefetched, is not computed again.
+
+    Members the member policy rules out, such as images, fonts or other
+    binaries, are counted as skipped. Members that would exceed a size
+    budget, or the extension time budget, are recorded as incomplete instead
+    of being scanned.
+    """
+    options = options if options is not None else ScanOptions()
+    if not options.profile:
+        return scan_extension(extension_file_path, options,
+                              on_member=on_member, digest=digest)
+
+    profile = ScanProfile(str(extension_file_path))
+    started = time.perf_counter()
+    result = scan_extension(extension_file_path, options, profile, on_member,
+                            digest)
+    profile.seconds = time.perf_counter() - started
+    result.profile = profile
+    return result
+
+
+def scan_extension(extension_file_path: Path, options: ScanOptions,
+                   profile: Optional[ScanProfile] = None,
+                   on_member: Optional[MemberCallback] = None,
+                   digest: Optional[str] = None) -> ScanResult:
+    """Scans an extension file, timing its stages into the profile."""
+    hash_algorithm = options.hash_algorithm
+    extension_file_path = Path(extension_file_path)
+    extension_type = extension_file_path.suffix
+    result = ScanResult(extension_file_path, extension_type)
+
+    extension = None
+    try:
+        try:
+            result.size = extension_file_path.stat().st_size
+            extension = open_extension(extension_file_path, hash_algorithm)
+            if extension is None:
+                result.error = "Unsupported file type"
+                return result
+
+            extension.profile = profile
+            extension.setup(setup_resources=False, with_digest=digest is None)
+            result.digest = digest if digest is not None else extension.digest
+            result.extension_id = extension.extension_id
+
+            result_cache = shared_result_cache(options.result_cache_path) \
+                if options.result_cache_path is not None else None
+            if result_cache is not None:
+                cached_findings = result_cache.get(result.digest,
+                                                   hash_algorithm)
+                if cached_findings is not None:
+                    result.findings = [Finding(**finding)
+                                       for finding in cached_findings]
+                    result.cached = True
+                    return result
+
+            with stage(profile, "get_zip_archive") as timing:
+                resources = extension.iter_resources()
+                timing.bytes += result.size
+        except (BadCrx, BadXpi, *MEMBER_ERRORS) as error:
+            # Opening the archive reads its central directory, which may be as
+            # damaged as any member
+            result.error = f"Could not read {extension_type} " \
+                           f"{extension_file_path}. {error}"
+            return result
+
+        member_cache = shared_member_cache(options.member_cache_path) \
+            if options.deduplicate_members else None
+        previous = None
+        if options.version_history_path is not None:
+            # Only incremental scans import the version history
+            from version_history import VersionChanges, shared_version_history
+            result.version_members = []
+            version_history = shared_version_history(
+                options.version_history_path)
+            if version_history is not None and result.extension_id:
+                previous = version_history.previous(result.extension_id)
+            if previous is not None:
+                result.version_changes = VersionChanges(previous.path,
+                                                        previous.digest)
+
+        prefetcher = None
+        if options.inflate_ahead > 0:
+            prefetcher = MemberPrefetcher(
+                resources, lambda resource: prefetchable(
+                    resource, options, previous, member_cache),
+                options.inflate_ahead)
+            resources = prefetcher
+
+        policy = options.member_policy
+        started = time.monotonic()
+        scan_started = time.perf_counter()
+        scanned_bytes = 0
+        present: set[str] = set()
+        try:
+            for resource in resources:
+                repository_path = resource.repository_path
+                present.add(repository_path)
+                unchanged = previous is not None and compare_member(
+                    previous, resource, result.version_changes)
+                if resource.content is None \
+                        or repository_path in options.skip_members:
+                    continue
+                # A member the policy skipped in the previous version is
+                # selected again, in case the policy changed since
+                if unchanged \
+                        and previous.members[repository_path][2] is not None:
+                    carry_forward(previous, resource, result, on_member)
+                    continue
+
+                member_size = resource.info.file_size
+                if policy is not None:
+                    reason = policy.select(repository_path, member_size)
+                    if reason is None and policy.needs_sniff(repository_path):
+                        with stage(profile, "sniff") as timing:
+                            reason = policy.sniff(resource.content)
+                            timing.bytes += min(member_size, policy.sniff_size)
+                    if reason is not None:
+                        result.skipped_members[reason] = \
+                            result.skipped_members.get(reason, 0) + 1
+                        if result.version_members is not None:
+                            result.version_members.append(
+                                (repository_path, resource.info.CRC,
+                                 member_size))
+                            result.version_skipped.append(repository_path)
+                        continue
+
+                budget = exceeded_budget(options, member_size, scanned_bytes,
+                                         time.monotonic() - started)
+                if budget is not None:
+                    result.incomplete.append((repository_path, budget))
+                    continue
+                scanned_bytes += member_size
+
+                if on_member is not None:
+                    on_member(repository_path, None)
+                member_started = time.perf_counter()
+                finding_count = len(result.findings)
+                scan_resource(resource, result, options, member_cache, profile)
+                if profile is not None:
+                    profile.add_member(MemberTiming(
+                        time.perf_counter() - member_started,
+                        str(extension_file_path), repository_path, member_size,
+                        len(result.findings) - finding_count))
+                if on_member is not None:
+                    on_member(repository_path, result.findings[finding_count:])
+                if result.version_members is not None:
+                    result.version_members.append(
+                        (repository_path, resource.info.CRC, member_size))
+        except MEMBER_ERRORS as error:
+            # A corrupted, encrypted or unsupported member, found only once it
+            # is opened or read
+            result.findings = []
+            result.error = f"Could not read {extension_type} " \
+                           f"{extension_file_path}. {error}"
+            return result
+        finally:
+            match_seconds = time.perf_counter() - scan_started
+            if prefetcher is not None:
+                prefetcher.close()
+                result.stage_seconds[INFLATE_STAGE] = \
+                    prefetcher.inflate_seconds
+                match_seconds -= prefetcher.wait_seconds
+            result.stage_seconds[MATCH_STAGE] = match_seconds
+
+        if previous is not None:
+            result.version_changes.removed = sorted(
+                set(previous.members) - present)
+        return result
+    finally:
+        # The mapping of the file outlives none of its members
+        if extension is not None:
+            extension.close()
+
+
+def prefetchable(resource: Union[CrxResource, XpiResource],
+                 options: ScanOptions,
+                 previous: Optional["PreviousVersion"] = None,
+                 member_cache: Optional[MemberCache] = None) -> bool:
+    """Whether a member will be read whole, by its directory entry alone.
+
+    Runs in the prefetch thread, so it only reads state no one changes,
+    besides the member cache, which locks its lookups.
+    """
+    info = resource.info
+    repository_path = resource.repository_path
+    if repository_path in options.skip_members \
+            or info.file_size > options.chunk_size:
+        return False
+    if options.max_member_size is not None \
+            and info.file_size > options.max_member_size:
+        return False
+    entry = previous.members.get(repository_path) \
+        if previous is not None else None
+    if entry is not None and entry[:2] == (info.CRC, info.file_size) \
+            and entry[2] is not None:
+        return False  # Carried forward
+    policy = options.member_policy
+    if policy is not None \
+            and (policy.select(repository_path, info.file_size) is not None
+                 or policy.needs_sniff(repository_path)):
+        return False  # Skipped, or maybe skipped once its head is sniffed
+    # Findings reused without reading the member
+    return member_cache is None or not member_cache.knows(member_key(info))
+
+
+def compare_member(previous: "PreviousVersion",
+                   resource: Union[CrxResource, XpiResource],
+                   changes: "VersionChanges") -> bool:
+    """Records whether a member was added, changed or left unchanged."""
+    repository_path = resource.repository_path
+    entry = previous.members.get(repository_path)
+    if entry is None:
+        changes.added.append(repository_path)
+        return False
+    crc, size, _ = entry
+    if (crc, size) != (resource.info.CRC, resource.info.file_size):
+        changes.changed.append(repository_path)
+        return False
+    changes.unchanged += 1
+    return True
+
+
+def carry_forward(previous: "PreviousVersion",
+                  resource: Union[CrxResource, XpiResource],
+                  result: ScanResult,
+                  on_member: Optional[MemberCallback] = None) -> None:
+    """Attributes the findings of an unchanged member to the new version."""
+    repository_path = resource.repository_path
+    crc, size, member_findings = previous.members[repository_path]
+    if on_member is not None:
+        on_member(repository_path, None)
+    findings = attribute_findings(member_findings, repository_path,
+                                  result.extension_type)
+    result.findings.extend(findings)
+    result.version_members.append((repository_path, crc, size))
+    if on_member is not None:
+        on_member(repository_path, findings)
+
+
+def scan_resource(resource: Union[CrxResource, XpiResource],
+                  result: ScanResult, options: ScanOptions,
+                  member_cache: Optional[MemberCache] = None,
+                  profile: Optional[ScanProfile] = None) -> None:
+    """Matches one archive member and adds its findings to the result."""
+    if resource.content is None:
+        return
+
+    info = resource.info
+    key = member_key(info)
+    if member_cache is not None:
+        member_findings = member_cache.lookup(key)
+        if member_findings is not None:
+            result.member_hits += 1
+            result.member_reused.append(key)
+            result.findings.extend(attribute_findings(
+                member_findings, resource.repository_path,
+                result.extension_type))
+            return
+
+    if info.file_size > options.chunk_size:
+        # Bounded memory; the content hash is computed while streaming
+        hasher = MemberCache.hasher() if member_cache is not None else None
+        # Decompression and matching interleave, so they are timed together
+        with stage(profile, "stream") as timing:
+            matches = API_MATCHER.find_matches_in_stream(
+                resource.content, chunk_size=options.chunk_size,
+                max_token_length=options.max_token_length, hasher=hasher)
+            timing.bytes += info.file_size
+        if hasher is not None:
+            content_hash = hasher.hexdigest()
+            result.member_misses += 1
+    else:
+        # Matched as raw bytes; only the findings' context windows are
+        # decoded
+        with stage(profile, "decode") as timing:
+            content_bytes = resource.content.read()
+            timing.bytes += len(content_bytes)
+
+        if member_cache is not None:
+            content_hash = MemberCache.content_hash(content_bytes)
+            member_findings = member_cache.lookup_content(key, content_hash)
+            if member_findings is not None:
+                result.member_hits += 1
+                result.member_reused.append(key)
+                result.findings.extend(attribute_findings(
+                    member_findings, resource.repository_path,
+                    result.extension_type))
+                return
+            result.member_misses += 1
+
+        with stage(profile, "match") as timing:
+            matches = API_MATCHER.find_matches_with_context(
+                content_bytes, profile=profile)
+            timing.bytes += len(content_bytes)
+
+    member_findings: list[dict] = []
+    for service_name, token, context, start, end in matches:
+
+        # NOTE: removed the unknown service pattern
+        if service_name == "Unknown":
+            continue
+
+        member_findings.append({
+            "service_name": service_name,
+            "token": token,
+            "context": context,
+            "start": start,
+            "end": end,
+        })
+        result.findings.append(Finding(
+            service_name, token, context,
+            resource.repository_path, result.extension_type, start, end
+        ))
+
+    if member_cache is not None:
+        member_cache.add(key, content_hash, member_findings)
+        result.member_entries.append((key, content_hash, member_findings))
+
+
+def cache_scan_result(result_cache: Optional[ResultCache], result: ScanResult,
+                      hash_algorithm: str = DEFAULT_HASH_ALGORITHM,
+                      member_cache: Optional[MemberCache] = None) -> None:
+    """Stores the findings of a fresh scan, or refreshes a cached entry."""
+    if member_cache is not None:
+        for key, content_hash, findings in result.member_entries:
+            member_cache.add(key, content_hash, findings)
+        member_cache.touch(result.member_reused)
+
+    # Incomplete findings must not stand in for a full scan later on
+    if result_cache is None or result.error is not None \
+            or result.digest is None or result.incomplete:
+        return
+    if result.cached:
+        result_cache.touch(result.digest, hash_algorithm)
+    else:
+        result_cache.put(result.digest, hash_algorithm,
+                         [asdict(finding) for finding in result.findings])
+
+
+def record_scan_version(version_history: "VersionHistory",
+                        result: ScanResult) -> None:
+    """Stores a complete scan as the last version of its extension id."""
+    if result.error is not None or result.incomplete or result.cached \
+            or not result.extension_id or result.version_members is None:
+        return
+    version_history.record(result.extension_id, str(result.path),
+                           result.digest, result.version_members,
+                           result.findings, result.version_skipped)
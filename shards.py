@@ -0,0 +1,222 @@
+import hashlib
+import heapq
+import json
+import re
+import time
+from dataclasses import asdict
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+from archive_io import DEFAULT_HASH_ALGORITHM, digest_mapping, map_file
+from configuration import RULESET_VERSION
+from scan_cache import FORMAT_VERSION, connect
+from scanner import Finding, ScanResult
+
+
+CHECKPOINT_PATTERN = re.compile(r"shard-(\d+)-of-(\d+)\.sqlite3")
+
+
+class CheckpointError(Exception):
+    pass
+
+
+def parse_shard(text: str) -> tuple[int, int]:
+    """Parses "INDEX/COUNT", with 0 <= INDEX < COUNT."""
+    index, separator, count = text.partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise ValueError(f"Expected INDEX/COUNT, got {text}") from None
+    if not separator or count < 1 or not 0 <= index < count:
+        raise ValueError(f"Expected 0 <= INDEX < COUNT, got {text}")
+    return index, count
+
+
+def shard_of(key: str, count: int) -> int:
+    """Assigns a key to a shard, the same way on every machine."""
+    return int.from_bytes(
+        hashlib.sha256(key.encode("utf-8")).digest()[:8], "big") % count
+
+
+def shard_key(path: Path, key: str = "path",
+              hash_algorithm: str = DEFAULT_HASH_ALGORITHM) -> str:
+    """Returns the path as listed, or the digest of the file.
+
+    Sharding by digest sends copies of a file stored under different paths
+    to the same shard, at the cost of reading every file to assign it.
+    """
+    if key == "digest":
+        try:
+            mapping = map_file(path)
+            try:
+                return digest_mapping(mapping, hash_algorithm)
+            finally:
+                mapping.close()
+        except OSError:
+            pass  # Scanned, and reported, by the shard of its path
+    return str(path)
+
+
+def select_shard(paths: Iterable[Path], index: int, count: int,
+                 key: str = "path",
+                 hash_algorithm: str = DEFAULT_HASH_ALGORITHM
+                 ) -> Iterator[Path]:
+    for path in paths:
+        if shard_of(shard_key(path, key, hash_algorithm), count) == index:
+            yield path
+
+
+def checkpoint_path(directory: Path, index: int, count: int) -> Path:
+    return Path(directory).joinpath(f"shard-{index}-of-{count}.sqlite3")
+
+
+class Checkpoint:
+    """Durable record of the files a shard completed, with their results.
+
+    Every result is committed as soon as it arrives, so a shard restarted
+    after a crash skips the files it completed and rescans the rest. A
+    checkpoint only resumes the run it was created for: the same shard,
+    shard key and ruleset.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS run (
+            shard INTEGER NOT NULL,
+            shards INTEGER NOT NULL,
+            shard_key TEXT NOT NULL,
+            ruleset TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS completed (
+            path TEXT PRIMARY KEY,
+            result TEXT NOT NULL,
+            completed_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path: Path, index: int = 0, count: int = 1,
+                 key: str = "path", read_only: bool = False,
+                 ruleset_version: str = RULESET_VERSION):
+        self.path = Path(path)
+        self.ruleset = f"{ruleset_version}:{FORMAT_VERSION}"
+        self.connection = connect(self.path, read_only)
+        if read_only:
+            return
+
+        self.connection.executescript(self.SCHEMA)
+        run = self.connection.execute(
+            "SELECT shard, shards, shard_key, ruleset FROM run").fetchone()
+        if run is None:
+            with self.connection:
+                self.connection.execute("INSERT INTO run VALUES (?, ?, ?, ?)",
+                                        (index, count, key, self.ruleset))
+        elif run != (index, count, key, self.ruleset):
+            self.connection.close()
+            if run[3] != self.ruleset:
+                raise CheckpointError(
+                    f"{self.path} was created under another ruleset")
+            raise CheckpointError(
+                f"{self.path} belongs to shard {run[0]}/{run[1]} by {run[2]}, "
+                f"not {index}/{count} by {key}")
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def completed(self) -> set[str]:
+        return {path for path, in self.connection.execute(
+            "SELECT path FROM completed")}
+
+    def pending(self, paths: Iterable[Path]) -> Iterator[Path]:
+        """Yields the paths this shard has not completed yet."""
+        completed = self.completed()
+        for path in paths:
+            if str(path) not in completed:
+                yield path
+
+    def add(self, result: ScanResult) -> None:
+        record = {
+            "extension_type": result.extension_type,
+            "size": result.size,
+            "digest": result.digest,
+            "extension_id": result.extension_id,
+            "error": result.error,
+            "incomplete": result.incomplete,
+            "skipped_members": result.skipped_members,
+            "findings": [asdict(finding) for finding in result.findings],
+        }
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO completed VALUES (?, ?, ?)",
+                (str(result.path), json.dumps(record), time.time()))
+
+    def result(self, path: Path) -> Optional[ScanResult]:
+        row = self.connection.execute(
+            "SELECT result FROM completed WHERE path = ?",
+            (str(path),)).fetchone()
+        return checkpoint_result(str(path), json.loads(row[0])) \
+            if row is not None else None
+
+    def results(self) -> Iterator[ScanResult]:
+        for path, record in self.connection.execute(
+                "SELECT path, result FROM completed ORDER BY path"):
+            yield checkpoint_result(path, json.loads(record))
+
+
+def checkpoint_result(path: str, record: dict) -> ScanResult:
+    result = ScanResult(Path(path), record["extension_type"], record["size"],
+                        record["digest"], record["extension_id"],
+                        [Finding(**finding) for finding in record["findings"]],
+                        record["error"])
+    result.incomplete = [tuple(entry) for entry in record["incomplete"]]
+    result.skipped_members = record["skipped_members"]
+    return result
+
+
+def open_checkpoints(directory: Path) -> list[Checkpoint]:
+    """Opens the checkpoint of every shard of the run in a directory.
+
+    Raises `CheckpointError` unless exactly one checkpoint per shard exists.
+    """
+    checkpoint_files: dict[int, Path] = {}
+    counts: set[int] = set()
+    for checkpoint_file in Path(directory).glob("shard-*-of-*.sqlite3"):
+        match = CHECKPOINT_PATTERN.fullmatch(checkpoint_file.name)
+        if match is None:
+            continue
+        checkpoint_files[int(match.group(1))] = checkpoint_file
+        counts.add(int(match.group(2)))
+    if len(counts) != 1:
+        raise CheckpointError(
+            f"Expected the checkpoints of one run in {directory}, found "
+            f"shard counts {sorted(counts) or 'none'}")
+    count, = counts
+    missing_shards = sorted(set(range(count)) - set(checkpoint_files))
+    if missing_shards:
+        raise CheckpointError(f"Missing the checkpoints of shards "
+                              f"{missing_shards} of {count} in {directory}")
+    return [Checkpoint(checkpoint_files[index], read_only=True)
+            for index in range(count)]
+
+
+def merge_checkpoints(checkpoints: list[Checkpoint],
+                      paths: Optional[Iterable[Path]] = None
+                      ) -> Iterator[ScanResult]:
+    """Combines the results of every shard of a run.
+
+    Results come in the order of `paths` if given, and sorted by path
+    otherwise. A listed path no shard completed yields an error result.
+    """
+    if paths is None:
+        yield from heapq.merge(*(checkpoint.results()
+                                 for checkpoint in checkpoints),
+                               key=lambda result: str(result.path))
+        return
+
+    for path in paths:
+        for checkpoint in checkpoints:
+            result = checkpoint.result(path)
+            if result is not None:
+                yield result
+                break
+        else:
+            result = ScanResult(path, path.suffix)
+            result.error = f"Could not find {path} in any shard checkpoint"
+            yield result
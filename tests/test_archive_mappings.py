@@ -0,0 +1,38 @@
+import pytest
+import shards
+import xpi_file
+from metadata_index import read_metadata
+from scanner import ScanOptions, scan_extension_file
+from conftest import GOOGLE_KEY
+
+
+@pytest.fixture
+def mappings(monkeypatch):
+    """Records every file mapping the extension wrappers and shards open."""
+    opened = []
+
+    def tracked_map_file(path):
+        opened.append(map_file(path))
+        return opened[-1]
+
+    map_file = xpi_file.map_file
+    monkeypatch.setattr(xpi_file, "map_file", tracked_map_file)
+    monkeypatch.setattr(shards, "map_file", tracked_map_file)
+    return opened
+
+
+def test_mappings_are_closed_after_every_read(mappings, write_xpi):
+    intact = write_xpi("intact", "1.0", {
+        "background.js": f'const key = "{GOOGLE_KEY}";'.encode()})
+    damaged = write_xpi("damaged", "1.0", {"a.js": b"const a = 1;"})
+    damaged.write_bytes(damaged.read_bytes()[:-10])
+
+    result = scan_extension_file(intact, ScanOptions(inflate_ahead=2))
+    assert [finding.token for finding in result.findings] == [GOOGLE_KEY]
+    assert scan_extension_file(damaged).error.startswith("Could not read")
+    assert read_metadata(intact).error is None
+    assert read_metadata(damaged).error.startswith("Could not read")
+    assert shards.shard_key(intact, "digest") != str(intact)
+
+    assert len(mappings) == 5
+    assert all(mapping.closed for mapping in mappings)
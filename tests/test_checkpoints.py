@@ -0,0 +1,67 @@
+import pytest
+from corpus import scan_corpus
+from scanner import ScanOptions
+from shards import (Checkpoint, CheckpointError, checkpoint_path,
+                    merge_checkpoints, open_checkpoints, parse_shard,
+                    select_shard)
+from conftest import GOOGLE_KEY
+
+
+@pytest.fixture
+def corpus(write_xpi):
+    return [write_xpi(f"ext{index}", "1.0", {
+        "background.js": f'const key = "{GOOGLE_KEY}"; // {index}'.encode()})
+        for index in range(6)]
+
+
+def test_parse_shard():
+    assert parse_shard("1/3") == (1, 3)
+    for text in ("3/3", "1", "a/b", "0/0"):
+        with pytest.raises(ValueError):
+            parse_shard(text)
+
+
+def test_resume_skips_completed_files(corpus, tmp_path):
+    path = checkpoint_path(tmp_path, 0, 1)
+    checkpoint = Checkpoint(path)
+    for result in scan_corpus(corpus[:4], 1, ScanOptions()):
+        checkpoint.add(result)
+    checkpoint.close()
+
+    checkpoint = Checkpoint(path)
+    assert list(checkpoint.pending(corpus)) == corpus[4:]
+    restored = checkpoint.result(corpus[0])
+    assert [finding.token for finding in restored.findings] == [GOOGLE_KEY]
+    checkpoint.close()
+
+
+def test_checkpoint_belongs_to_its_shard(tmp_path):
+    path = checkpoint_path(tmp_path, 0, 2)
+    Checkpoint(path, 0, 2).close()
+    with pytest.raises(CheckpointError, match="belongs to shard 0/2"):
+        Checkpoint(path, 1, 2)
+    with pytest.raises(CheckpointError, match="another ruleset"):
+        Checkpoint(path, 0, 2, ruleset_version="other")
+
+
+def test_merged_shards_cover_the_corpus_in_order(corpus, tmp_path):
+    for index in range(3):
+        checkpoint = Checkpoint(checkpoint_path(tmp_path, index, 3), index, 3)
+        for result in scan_corpus(select_shard(corpus, index, 3), 1,
+                                  ScanOptions()):
+            checkpoint.add(result)
+        checkpoint.close()
+
+    checkpoints = open_checkpoints(tmp_path)
+    merged = list(merge_checkpoints(checkpoints, corpus))
+    assert [result.path for result in merged] == corpus
+    assert all(result.error is None and len(result.findings) == 1
+               for result in merged)
+    for checkpoint in checkpoints:
+        checkpoint.close()
+
+
+def test_missing_shard_is_an_error(tmp_path):
+    Checkpoint(checkpoint_path(tmp_path, 0, 2), 0, 2).close()
+    with pytest.raises(CheckpointError, match="Missing"):
+        open_checkpoints(tmp_path)
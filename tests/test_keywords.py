@@ -0,0 +1,25 @@
+import pytest
+import keywords
+from keywords import KeywordAutomaton
+
+KEYWORDS = ["sk-", "sk-ant-api", "api.cohere.ai", "clé_", "hf_"]
+
+
+@pytest.mark.parametrize("aho_corasick", [False, True])
+def test_backends_find_keywords_in_raw_bytes(aho_corasick, monkeypatch):
+    if aho_corasick and keywords.ahocorasick is None:
+        pytest.skip("pyahocorasick is not installed")
+    if not aho_corasick:
+        monkeypatch.setattr(keywords, "ahocorasick", None)
+    automaton = KeywordAutomaton(KEYWORDS)
+
+    text = "\xff é x=clé_1; fetch('https://api.cohere.ai');sk-ant-api03"
+    content = text.encode("utf-8") + b"\xff\xfe"
+    expected = {"sk-", "sk-ant-api", "api.cohere.ai", "clé_"}
+    assert automaton.scan(text) == expected
+    assert automaton.scan(content) == expected
+    assert automaton.scan(bytearray(content)) == expected
+    assert automaton.scan("clé".encode("latin-1") + b"_") == set()
+    backend = keywords._AhoCorasickBackend if aho_corasick \
+        else keywords._RegexBackend
+    assert isinstance(automaton.binary_backend, backend)
@@ -0,0 +1,29 @@
+import pytest
+from corpus import scan_corpus
+from scanner import ScanOptions
+from conftest import GOOGLE_KEY
+
+
+def patch_directory(path, offset: int, value: bytes) -> None:
+    """Overwrites a field of the first central directory entry of a ZIP."""
+    content = bytearray(path.read_bytes())
+    entry = content.index(b"PK\x01\x02")
+    content[entry + offset:entry + offset + len(value)] = value
+    path.write_bytes(bytes(content))
+
+
+@pytest.mark.parametrize("offset, value", [
+    (6, b"\x63\x00"),  # Needs a ZIP version newer than zipfile reads
+    (10, b"\x63\x00"),  # Compressed by an unknown method
+    (46, b"\xff"),  # Names it in invalid UTF-8
+])
+def test_malformed_archives_are_reported_as_errors(write_xpi, offset, value):
+    damaged = write_xpi("damaged", "1.0", {"\xe9.js": b"const a = 1;"})
+    patch_directory(damaged, offset, value)
+    intact = write_xpi("intact", "1.0", {
+        "background.js": f'const key = "{GOOGLE_KEY}";'.encode()})
+
+    results = list(scan_corpus([damaged, intact], 1, ScanOptions()))
+    assert results[0].error.startswith("Could not read")
+    assert results[0].findings == []
+    assert [finding.token for finding in results[1].findings] == [GOOGLE_KEY]
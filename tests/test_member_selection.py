@@ -0,0 +1,75 @@
+from io import BytesIO
+from zipfile import ZipInfo
+from member_selection import (DEFAULT_MEMBER_POLICY, SKIPPED_BY_CONTENT,
+                              SKIPPED_BY_EXTENSION, SKIPPED_BY_SIZE,
+                              MemberPolicy, is_binary, member_extension)
+from scan_cache import MemberCache, member_key
+from scanner import ScanOptions, prefetchable, scan_extension_file
+from xpi_file import XpiResource
+from conftest import GOOGLE_KEY
+
+
+def test_member_extension():
+    assert member_extension("js/App.MIN.JS") == "js"
+    assert member_extension("dir.v2/LICENSE") == ""
+
+
+def test_select_by_extension_and_size():
+    policy = MemberPolicy(max_asset_size=100)
+    assert policy.select("background.js", 10 ** 9) is None
+    assert policy.select("icons/icon.png", 10) == SKIPPED_BY_EXTENSION
+    assert policy.select("data.bin", 101) == SKIPPED_BY_SIZE
+    assert policy.select("data.bin", 100) is None
+    assert policy.needs_sniff("data.bin")
+    assert not policy.needs_sniff("background.js")
+
+
+def test_sniff_rewinds_the_content():
+    content = BytesIO(b"\x89PNG\r\n\x1a\n" + b"\x00" * 100)
+    assert DEFAULT_MEMBER_POLICY.sniff(content) == SKIPPED_BY_CONTENT
+    assert content.tell() == 0
+    assert DEFAULT_MEMBER_POLICY.sniff(BytesIO(b"const a = 1;\n")) is None
+
+
+def test_is_binary():
+    assert not is_binary(b"")
+    assert not is_binary("const é = '\t';\n".encode("utf-8"))
+    assert is_binary(b"text\x00text")
+    assert is_binary(b"\x01\x02\x03abc")
+
+
+def test_skipped_members_are_counted_not_matched(write_xpi):
+    key = f'const key = "{GOOGLE_KEY}";'.encode()
+    path = write_xpi("ext", "1.0", {
+        "background.js": key,
+        "icon.png": key,
+        "blob.bin": b"\x00" + key,
+        "notes": key,
+    })
+    result = scan_extension_file(path, ScanOptions())
+    assert [finding.repository_path for finding in result.findings] \
+        == ["background.js", "notes"]
+    assert result.skipped_members == {SKIPPED_BY_EXTENSION: 1,
+                                      SKIPPED_BY_CONTENT: 1}
+
+    everything = scan_extension_file(path, ScanOptions(member_policy=None))
+    assert len(everything.findings) == 4
+
+
+def test_prefetch_skips_sniffed_and_cached_members():
+    def resource(name: str, crc: int = 1) -> XpiResource:
+        info = ZipInfo(name)
+        info.CRC, info.file_size, info.compress_size = crc, 100, 100
+        return XpiResource(name, BytesIO(b""), info)
+
+    options = ScanOptions()
+    assert prefetchable(resource("background.js"), options)
+    assert not prefetchable(resource("icon.png"), options)
+    assert not prefetchable(resource("data.bin"), options)
+
+    member_cache = MemberCache(None)
+    known = resource("known.js", crc=2)
+    member_cache.add(member_key(known.info), "hash", [])
+    assert not prefetchable(known, options, member_cache=member_cache)
+    assert prefetchable(resource("background.js"), options,
+                        member_cache=member_cache)
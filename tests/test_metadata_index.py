@@ -0,0 +1,50 @@
+import struct
+from metadata_index import (MetadataIndex, TriageStatistics, read_metadata,
+                            triage_corpus)
+
+
+def test_damaged_headers_are_recorded_as_errors(tmp_path):
+    files = {
+        "truncated.crx": b"Cr24\x03\x00",
+        "undecodable.crx": b"Cr24" + struct.pack("<II", 3, 8) + b"\xff" * 8,
+        "unknown.crx": b"Cr24" + struct.pack("<I", 9) + b"\x00" * 16,
+        "not_a_zip.xpi": b"PK\x03\x04 truncated",
+    }
+    for name, content in files.items():
+        path = tmp_path.joinpath(name)
+        path.write_bytes(content)
+        metadata = read_metadata(path)
+        assert metadata.error.startswith("Could not read")
+        assert metadata.members == []
+
+
+def test_damaged_directories_are_recorded_as_errors(write_xpi):
+    for offset, value in ((6, b"\x63\x00"), (46, b"\xff")):
+        path = write_xpi("damaged", "1.0", {"\xe9.js": b"const a = 1;"})
+        content = bytearray(path.read_bytes())
+        entry = content.index(b"PK\x01\x02") + offset
+        content[entry:entry + len(value)] = value
+        path.write_bytes(bytes(content))
+
+        metadata = read_metadata(path)
+        assert metadata.error.startswith("Could not read")
+        assert metadata.members == []
+
+
+def test_missing_files_are_recorded_as_errors(tmp_path, write_xpi):
+    index = MetadataIndex(tmp_path.joinpath("metadata.sqlite3"))
+    removed = write_xpi("removed", "1.0", {"background.js": b"const a = 1;"})
+    intact = write_xpi("intact", "1.0", {"background.js": b"const a = 1;"})
+    list(triage_corpus([removed, intact], index, jobs=1))
+    removed.unlink()
+
+    statistics = TriageStatistics()
+    missing = tmp_path.joinpath("missing.crx")
+    results = list(triage_corpus([missing, removed, intact], index, jobs=1,
+                                 statistics=statistics))
+    assert [metadata.path for metadata in results] == [str(missing),
+                                                       str(removed)]
+    assert all(metadata.error.startswith("Could not read")
+               for metadata in results)
+    assert statistics.unchanged == 1
+    index.close()
@@ -0,0 +1,35 @@
+import io
+import json
+from pathlib import Path
+from reporting import SarifReporter, TextReporter
+from scanner import MEMBER_TIME_BUDGET, WORKER_EXITED, ScanResult
+
+
+def incomplete_result() -> ScanResult:
+    result = ScanResult(Path("crawl/evil.xpi"), ".xpi")
+    result.incomplete = [("a.js", MEMBER_TIME_BUDGET), ("b.js", WORKER_EXITED)]
+    return result
+
+
+def test_text_report_of_incomplete_members():
+    output = io.StringIO()
+    TextReporter(output, colors=False).write_result(incomplete_result())
+    lines = output.getvalue().splitlines()
+    assert lines[1:] == [
+        "Incomplete scan of crawl/evil.xpi: a.js exceeded the member time "
+        "budget",
+        "Incomplete scan of crawl/evil.xpi: b.js was being scanned when its "
+        "worker exited",
+    ]
+
+
+def test_sarif_notifications_of_incomplete_members():
+    output = io.StringIO()
+    reporter = SarifReporter(output, errors=io.StringIO())
+    reporter.write_result(incomplete_result())
+    reporter.finish()
+    notifications = json.loads(output.getvalue())["runs"][0]["invocations"][0][
+        "toolExecutionNotifications"]
+    assert [notification["message"]["text"] for notification in notifications] \
+        == ["Not scanned: a.js exceeded the member time budget",
+            "Not scanned: b.js was being scanned when its worker exited"]
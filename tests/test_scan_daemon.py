@@ -0,0 +1,78 @@
+import io
+import json
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import pytest
+from scan_daemon import QueueFull, ScanDaemon, connect, create_server
+from conftest import GOOGLE_KEY
+
+
+@pytest.fixture
+def daemon():
+    daemon = ScanDaemon(1, queue_size=1)
+    yield daemon
+    daemon.close()
+
+
+@pytest.fixture
+def extension(write_xpi):
+    return write_xpi("ext", "1.0", {
+        "background.js": f'const key = "{GOOGLE_KEY}";'.encode()})
+
+
+def test_full_queue_rejects_an_upload_unread(daemon, extension):
+    daemon.acquire()
+    upload = io.BytesIO(extension.read_bytes())
+    with pytest.raises(QueueFull):
+        daemon.scan_upload(upload, len(upload.getvalue()), ".xpi")
+    assert upload.tell() == 0
+    daemon.release()
+
+    record = daemon.scan_upload(upload, len(upload.getvalue()), ".xpi")
+    assert [finding["token"] for finding in record["findings"]] == [GOOGLE_KEY]
+    assert daemon.statistics.pending == 0
+
+
+def test_pool_is_replaced_once_a_worker_dies(daemon, extension):
+    for worker in multiprocessing.active_children():
+        os.kill(worker.pid, signal.SIGKILL)
+    deadline = time.monotonic() + 10
+    while not daemon.check_pool() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert daemon.statistics.restarts == 1
+    assert not daemon.check_pool()
+
+    record = daemon.scan(extension)
+    assert [finding["token"] for finding in record["findings"]] == [GOOGLE_KEY]
+    assert daemon.statistics.restarts == 1
+    assert daemon.statistics.pending == 0
+
+
+@pytest.mark.parametrize("length, body", [
+    ("many", b""),
+    ("-1", b"{}"),
+    (None, b"5"),
+    (None, b'"x"'),
+    (None, b'{"path": 5}'),
+])
+def test_invalid_requests_are_rejected(daemon, tmp_path, length, body):
+    address = f"unix:{tmp_path.joinpath('daemon.sock')}"
+    server = create_server(address, daemon)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        connection = connect(address, timeout=10)
+        connection.putrequest("POST", "/scan")
+        connection.putheader("Content-Length",
+                             length if length is not None else len(body))
+        connection.endheaders(body)
+        response = connection.getresponse()
+        assert response.status == 400
+        assert "error" in json.loads(response.read())
+        connection.close()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,18 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+from benchmarks.bench_startup import DEFERRED_MODULES
+
+REPOSITORY = Path(__file__).resolve().parent.parent
+
+
+def test_import_main_defers_the_modules_of_other_modes(tmp_path):
+    environment = dict(os.environ, CRX_RAY_CACHE_DIR=str(tmp_path))
+    command = [sys.executable, "-c", "import main, sys; print(*sys.modules)"]
+    subprocess.run(command, cwd=REPOSITORY, env=environment, check=True,
+                   capture_output=True)  # Writes the ruleset cache
+    modules = subprocess.run(command, cwd=REPOSITORY, env=environment,
+                             check=True, capture_output=True,
+                             text=True).stdout.split()
+    assert [name for name in DEFERRED_MODULES if name in modules] == []
@@ -0,0 +1,115 @@
+import copy
+import random
+import tempfile
+from io import BytesIO
+import pytest
+from benchmarks.bench_scoring import KEYWORDS, member
+from benchmarks.synthetic import filler, plant, plantable_services
+from configuration import API_PATTERNS, KEYWORD_AUTOMATON
+from matcher import API_MATCHER, CandidateBuffer, CompiledMatcher
+from regex_engines import ENGINES, engine_module
+
+
+def planted_content(seed: int, size: int, tokens: int) -> bytes:
+    generator = random.Random(seed)
+    services = plantable_services(API_PATTERNS)
+    parts = []
+    for _ in range(tokens):
+        parts.append(filler(generator.randint(0, size // tokens), generator))
+        parts.append(plant(*generator.choice(services), generator)[1])
+    parts.append(filler(generator.randint(0, 200), generator))
+    return "".join(parts).encode("utf-8")
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("chunk_size", [97, 4096])
+def test_stream_matches_whole_content(seed, chunk_size):
+    content = planted_content(seed, 20000, 12)
+    expected = API_MATCHER.find_matches_with_context(content)
+    assert expected
+    assert API_MATCHER.find_matches_in_stream(
+        BytesIO(content), chunk_size=chunk_size) == expected
+
+
+def test_matches_spanning_every_chunk_boundary():
+    content = planted_content(1, 600, 30)
+    expected = API_MATCHER.find_matches_with_context(content)
+    for chunk_size in range(1, 64):
+        assert API_MATCHER.find_matches_in_stream(
+            BytesIO(content), chunk_size=chunk_size) == expected
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engines_match_windows_in_place(engine):
+    # Streamed windows are bytearrays searched from an offset
+    if engine_module(engine) is None:
+        pytest.skip(f"{engine} is not installed")
+    api_patterns = copy.deepcopy(API_PATTERNS)
+    for api_pattern in api_patterns:
+        for service in [api_pattern, *api_pattern.sub_services]:
+            service.engine = engine
+            if service.expression is not None:
+                service.pattern = service.expression.pattern
+    matcher = CompiledMatcher(api_patterns, KEYWORD_AUTOMATON)
+    content = planted_content(2, 20000, 12)
+    assert matcher.find_matches_in_stream(BytesIO(content), chunk_size=97) \
+        == API_MATCHER.find_matches_with_context(content)
+
+
+@pytest.mark.parametrize("keywords_first", [True, False])
+def test_stream_scores_tokens_as_whole_content(keywords_first, monkeypatch):
+    content, _ = member(400, 8, random.Random(3))
+    if not keywords_first:
+        content = content[len(KEYWORDS):] + KEYWORDS.encode()
+    buffered = []
+    append = CandidateBuffer.append
+
+    def counting_append(buffer, key, candidate):
+        buffered.append(candidate)
+        append(buffer, key, candidate)
+
+    monkeypatch.setattr(CandidateBuffer, "append", counting_append)
+
+    expected = API_MATCHER.find_matches_with_context(content)
+    assert API_MATCHER.find_matches_in_stream(
+        BytesIO(content), chunk_size=4096) == expected
+    # Once their sub-service is settled, low scoring tokens get no context
+    if keywords_first:
+        assert len(buffered) == len(expected)
+    else:
+        assert len(buffered) > len(expected)
+
+
+def test_candidate_buffer_spills_in_order():
+    buffer = CandidateBuffer([1, 2], max_bytes=10)
+    candidates = [(f"token{index}", "context", index, index + 6)
+                  for index in range(6)]
+    for index, candidate in enumerate(candidates):
+        buffer.append(1 + index % 2, candidate)
+    assert buffer.spilled
+    assert list(buffer.get(1)) == candidates[0::2]
+    assert list(buffer.get(2)) == candidates[1::2]
+    buffer.close()
+
+
+def test_spilled_candidates_are_closed_when_the_stream_fails(monkeypatch):
+    spills = []
+    temporary_file = tempfile.TemporaryFile
+
+    def tracked_temporary_file(*args, **kwargs):
+        spills.append(temporary_file(*args, **kwargs))
+        return spills[-1]
+
+    class FailingStream(BytesIO):
+        def read(self, size=-1):
+            if self.tell() > 10000:
+                raise OSError("read error")
+            return super().read(size)
+
+    monkeypatch.setattr(tempfile, "TemporaryFile", tracked_temporary_file)
+    content = planted_content(2, 20000, 40)
+    with pytest.raises(OSError):
+        API_MATCHER.find_matches_in_stream(FailingStream(content),
+                                           chunk_size=97)
+    assert spills
+    assert all(spill.closed for spill in spills)
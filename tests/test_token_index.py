@@ -0,0 +1,33 @@
+from pathlib import Path
+from scanner import Finding, ScanResult
+from token_index import TokenIndex
+
+
+def result(extension_id: str, tokens: list[str]) -> ScanResult:
+    return ScanResult(Path(f"{extension_id}.crx"), "crx", 0, extension_id * 2,
+                      extension_id,
+                      [Finding("AI21", f'"{token}"', "", "background.js", "crx")
+                       for token in tokens])
+
+
+def test_new_tokens_are_counted_once(tmp_path):
+    path = tmp_path.joinpath("tokens.sqlite3")
+    index = TokenIndex(path)
+    index.start_run()
+    assert index.add(result("a", ["one", "two", "one"])) == 2
+    assert index.add(result("b", ["two", "three"])) == 1
+    index.close()
+
+    reader = TokenIndex(path, read_only=True)
+    index = TokenIndex(path)
+    index.start_run()
+    assert index.add(result("c", ["three", "four"])) == 1
+    index.close()
+    assert reader.seen("'four'") and not reader.seen("five")
+
+    records = {record.token: record for record in reader.tokens_since(0)}
+    assert [record.token for record in reader.tokens_since(1)] == ["four"]
+    assert sorted(records["two"].extension_ids) == ["a", "b"]
+    assert (records["three"].first_run, records["three"].last_run) == (1, 2)
+    assert records["three"].last_path == "c.crx"
+    reader.close()
@@ -0,0 +1,69 @@
+from dataclasses import replace
+from scanner import ScanOptions, record_scan_version, scan_extension_file
+from version_history import VersionHistory
+from conftest import GOOGLE_KEY
+
+
+def key_member(comment: str) -> bytes:
+    return f'const key = "{GOOGLE_KEY}"; // {comment}'.encode()
+
+
+def scan_version(path, history_path):
+    history = VersionHistory(history_path)
+    result = scan_extension_file(
+        path, replace(ScanOptions(), version_history_path=history_path))
+    record_scan_version(history, result)
+    history.close()
+    return result
+
+
+def test_changes_since_the_previous_version(write_xpi, tmp_path):
+    history_path = tmp_path.joinpath("versions.sqlite3")
+    VersionHistory(history_path).close()
+    first = write_xpi("ext", "1.0", {
+        "unchanged.js": key_member("same"),
+        "changed.js": key_member("old"),
+        "removed.js": key_member("gone"),
+    })
+    second = write_xpi("ext", "2.0", {
+        "unchanged.js": key_member("same"),
+        "changed.js": key_member("new"),
+        "added.js": key_member("added"),
+    })
+    assert scan_version(first, history_path).version_changes is None
+
+    result = scan_version(second, history_path)
+    changes = result.version_changes
+    assert changes.previous_path == str(first)
+    assert (changes.added, changes.changed, changes.removed,
+            changes.unchanged) == (["added.js"], ["changed.js"],
+                                   ["removed.js"], 1)
+
+    # Carried forward findings are the findings of a full scan
+    full = scan_extension_file(second, ScanOptions())
+    assert sorted((finding.repository_path, finding.context)
+                  for finding in result.findings) \
+        == sorted((finding.repository_path, finding.context)
+                  for finding in full.findings)
+
+
+def test_skipped_members_are_not_reported_as_added(write_xpi, tmp_path):
+    history_path = tmp_path.joinpath("versions.sqlite3")
+    VersionHistory(history_path).close()
+    members = {"icon.png": key_member("image"),
+               "blob.bin": b"\x00" + key_member("binary")}
+    first = write_xpi("ext", "1.0", {**members, "a.js": key_member("old")})
+    second = write_xpi("ext", "2.0", {**members, "a.js": key_member("new")})
+    scan_version(first, history_path)
+
+    result = scan_version(second, history_path)
+    changes = result.version_changes
+    assert (changes.added, changes.changed, changes.removed,
+            changes.unchanged) == ([], ["a.js"], [], 2)
+    assert sum(result.skipped_members.values()) == 2
+
+    # Skipped members are selected again rather than carried forward
+    everything = scan_extension_file(second, ScanOptions(
+        member_policy=None, version_history_path=history_path))
+    assert sorted(finding.repository_path for finding in everything.findings) \
+        == ["a.js", "blob.bin", "icon.png"]
@@ -0,0 +1,165 @@
+import string
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Optional
+from configuration import DEFAULT_TOKEN_INDEX
+from scan_cache import connect
+from scanner import ScanResult
+
+
+STRIPPED = string.whitespace + "\"'`"
+
+
+def normalize_token(token: str) -> str:
+    """Strips the white space and quotes a pattern may capture around a key."""
+    return token.strip(STRIPPED)
+
+
+@dataclass
+class TokenRecord:
+    """A normalized token and every sighting of it in the index."""
+    token: str
+    service_name: str
+    extension_ids: list[str]
+    digests: list[str]
+    first_run: int
+    first_seen: float
+    first_path: str
+    last_run: int
+    last_seen: float
+    last_path: str
+
+
+class TokenIndex:
+    """Every normalized token ever found, across runs and corpora.
+
+    A token is stored once, with its service, the extension ids and digests
+    it was found in, and the run, time and path of its first and last
+    sightings. Runs are numbered, so the tokens new since a run are read
+    from an index on `first_run` rather than from the reports.
+
+    An index has one writer at a time, which numbers the runs and counts the
+    new tokens; any number of read-only connections may query it meanwhile.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS runs (
+            run INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at REAL NOT NULL,
+            finished_at REAL,
+            findings INTEGER NOT NULL DEFAULT 0,
+            new_tokens INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS tokens (
+            token TEXT PRIMARY KEY,
+            service_name TEXT NOT NULL,
+            first_run INTEGER NOT NULL,
+            first_seen REAL NOT NULL,
+            first_path TEXT NOT NULL,
+            last_run INTEGER NOT NULL,
+            last_seen REAL NOT NULL,
+            last_path TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS tokens_first_run ON tokens (first_run);
+        CREATE TABLE IF NOT EXISTS sightings (
+            token TEXT NOT NULL,
+            extension_id TEXT NOT NULL,
+            digest TEXT NOT NULL,
+            PRIMARY KEY (token, extension_id, digest)
+        ) WITHOUT ROWID;
+        DROP TABLE IF EXISTS bloom;
+    """
+
+    def __init__(self, path: Path = DEFAULT_TOKEN_INDEX,
+                 read_only: bool = False):
+        self.path = Path(path)
+        self.read_only = read_only
+        self.connection = connect(self.path, read_only)
+        self.run: Optional[int] = None
+        self.findings = 0
+        self.new_tokens = 0
+        if not read_only:
+            self.connection.executescript(self.SCHEMA)
+
+    def close(self) -> None:
+        if self.run is not None:
+            self.finish_run()
+        self.connection.close()
+
+    def start_run(self) -> int:
+        with self.connection:
+            self.run = self.connection.execute(
+                "INSERT INTO runs (started_at) VALUES (?)",
+                (time.time(),)).lastrowid
+        self.findings = self.new_tokens = 0
+        return self.run
+
+    def finish_run(self) -> None:
+        with self.connection:
+            self.connection.execute(
+                "UPDATE runs SET finished_at = ?, findings = ?, "
+                "new_tokens = ? WHERE run = ?",
+                (time.time(), self.findings, self.new_tokens, self.run))
+        self.run = None
+
+    def seen(self, token: str) -> bool:
+        """Whether a token was ever indexed."""
+        return self.connection.execute(
+            "SELECT 1 FROM tokens WHERE token = ?", (normalize_token(token),)
+        ).fetchone() is not None
+
+    def add(self, result: ScanResult) -> int:
+        """Indexes the findings of a result in the current run.
+
+        Returns how many of its tokens were never seen before.
+        """
+        now = time.time()
+        path = str(result.path)
+        services: dict[str, str] = {}
+        for finding in result.findings:
+            token = normalize_token(finding.token)
+            if token:
+                services.setdefault(token, finding.service_name)
+        self.findings += len(result.findings)
+
+        with self.connection:
+            # Tokens are never deleted, so the new ones get the row ids past
+            # the largest stored one
+            last_row = self.connection.execute(
+                "SELECT COALESCE(MAX(rowid), 0) FROM tokens").fetchone()[0]
+            self.connection.executemany(
+                "INSERT INTO tokens VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (token) DO UPDATE SET "
+                "last_run = excluded.last_run, "
+                "last_seen = excluded.last_seen, "
+                "last_path = excluded.last_path",
+                ((token, service_name, self.run, now, path,
+                  self.run, now, path)
+                 for token, service_name in services.items()))
+            new_tokens = self.connection.execute(
+                "SELECT COUNT(*) FROM tokens WHERE rowid > ?",
+                (last_row,)).fetchone()[0]
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO sightings VALUES (?, ?, ?)",
+                ((token, result.extension_id or "", result.digest or "")
+                 for token in services))
+
+        self.new_tokens += new_tokens
+        return new_tokens
+
+    def tokens_since(self, run: int) -> Iterator[TokenRecord]:
+        """Yields the tokens first seen after a run, oldest first."""
+        for row in self.connection.execute(
+                "SELECT tokens.token, service_name, "
+                "GROUP_CONCAT(DISTINCT NULLIF(extension_id, '')), "
+                "GROUP_CONCAT(DISTINCT NULLIF(digest, '')), "
+                "first_run, first_seen, first_path, "
+                "last_run, last_seen, last_path "
+                "FROM tokens LEFT JOIN sightings USING (token) "
+                "WHERE first_run > ? GROUP BY tokens.token "
+                "ORDER BY first_run, first_seen, tokens.token", (run,)):
+            yield TokenRecord(row[0], row[1],
+                              row[2].split(",") if row[2] else [],
+                              row[3].split(",") if row[3] else [],
+                              *row[4:])
@@ -0,0 +1,144 @@
+import json
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Optional
+from configuration import DEFAULT_VERSION_HISTORY, RULESET_VERSION
+from scan_cache import FORMAT_VERSION, connect
+
+if TYPE_CHECKING:
+    from scanner import Finding
+
+
+@dataclass
+class PreviousVersion:
+    """The last complete scan of an extension id."""
+    path: str
+    digest: Optional[str]
+    # Findings of every member, by repository path: (crc, size, findings),
+    # with no findings for the members the member policy skipped
+    members: dict[str, tuple[int, int, Optional[list[dict]]]]
+
+
+@dataclass
+class VersionChanges:
+    """Members of an extension file compared with its previous version."""
+    previous_path: str
+    previous_digest: Optional[str]
+    added: list[str] = field(default_factory=list)
+    changed: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    unchanged: int = 0
+
+    def summary(self) -> str:
+        return (f"{len(self.added)} added, {len(self.changed)} changed, "
+                f"{len(self.removed)} removed, {self.unchanged} unchanged "
+                f"members since {self.previous_path}")
+
+
+class VersionHistory:
+    """Central directory and findings of the last scan of every extension id.
+
+    A member of a new version whose path, CRC32 and size match the previous
+    version is not decompressed again; its findings are carried forward.
+    Histories of another ruleset or findings format are purged when the
+    database is opened for writing.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS versions (
+            extension_id TEXT PRIMARY KEY,
+            ruleset TEXT NOT NULL,
+            path TEXT NOT NULL,
+            digest TEXT,
+            scanned_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS members (
+            extension_id TEXT NOT NULL,
+            repository_path TEXT NOT NULL,
+            crc INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            findings TEXT NOT NULL,
+            PRIMARY KEY (extension_id, repository_path)
+        );
+    """
+
+    def __init__(self, path: Path = DEFAULT_VERSION_HISTORY,
+                 read_only: bool = False,
+                 ruleset_version: str = RULESET_VERSION):
+        self.path = Path(path)
+        self.read_only = read_only
+        self.ruleset = f"{ruleset_version}:{FORMAT_VERSION}"
+        self.connection = connect(self.path, read_only)
+        if read_only:
+            return
+
+        self.connection.executescript(self.SCHEMA)
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM members WHERE extension_id IN (SELECT "
+                "extension_id FROM versions WHERE ruleset != ?)",
+                (self.ruleset,))
+            self.connection.execute(
+                "DELETE FROM versions WHERE ruleset != ?", (self.ruleset,))
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def previous(self, extension_id: str) -> Optional[PreviousVersion]:
+        row = self.connection.execute(
+            "SELECT path, digest FROM versions "
+            "WHERE extension_id = ? AND ruleset = ?",
+            (extension_id, self.ruleset)).fetchone()
+        if row is None:
+            return None
+        members = {
+            repository_path: (crc, size, json.loads(findings))
+            for repository_path, crc, size, findings in self.connection.execute(
+                "SELECT repository_path, crc, size, findings FROM members "
+                "WHERE extension_id = ?", (extension_id,))
+        }
+        return PreviousVersion(row[0], row[1], members)
+
+    def record(self, extension_id: str, path: str, digest: Optional[str],
+               members: list[tuple[str, int, int]],
+               findings: list["Finding"],
+               skipped: Iterable[str] = ()) -> None:
+        """Replaces the history of an extension id with a complete scan.
+
+        The `skipped` members are recorded as such rather than as members
+        without findings, so they are not carried forward.
+        """
+        skipped = set(skipped)
+        member_findings: dict[str, list[dict]] = defaultdict(list)
+        for finding in findings:
+            record = asdict(finding)
+            del record["repository_path"], record["extension_type"]
+            member_findings[finding.repository_path].append(record)
+
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM members WHERE extension_id = ?", (extension_id,))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?, ?)",
+                (extension_id, self.ruleset, path, digest, time.time()))
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO members VALUES (?, ?, ?, ?, ?)",
+                ((extension_id, repository_path, crc, size,
+                  json.dumps(None if repository_path in skipped
+                             else member_findings.get(repository_path, [])))
+                 for repository_path, crc, size in members))
+
+
+_shared_histories: dict[Path, VersionHistory] = {}
+
+
+def shared_version_history(path: Path) -> Optional[VersionHistory]:
+    """Returns a read-only history connection reused within this process."""
+    path = Path(path)
+    if path not in _shared_histories:
+        if not path.exists():
+            return None
+        _shared_histories[path] = VersionHistory(path, read_only=True)
+    return _shared_histories[path]
@@ -1,11 +1,13 @@
 from io import BufferedReader, BytesIO, TextIOWrapper
 import os
-from typing import IO, Optional
-from zipfile import BadZipFile, ZipFile
-from hashlib import md5
+from typing import IO, Iterator, Optional
+from zipfile import BadZipFile, ZipFile, ZipInfo
 from pathlib import Path
 from dataclasses import dataclass
 import struct
+from archive_io import (ArchiveView, DEFAULT_HASH_ALGORITHM, digest_mapping,
+                        iter_archive_resources, map_file, mapping_size)
+from profiling import ScanProfile, stage
 
 
 DEFAULT_FILTER_LIST = [
@@ -13,10 +15,11 @@ DEFAULT_FILTER_LIST = [
 ]
 
 
-@dataclass
+@dataclass(slots=True)
 class XpiResource:
     repository_path: str
     content: Optional[IO[bytes]] = None
+    info: Optional[ZipInfo] = None
 
 
 @dataclass
@@ -34,19 +37,25 @@ class XpiFile:
 
     DIGEST_BUFFER = 65536  # 64kb
 
-    def __init__(self, xpi_path: Path, filter_list: Optional[list[str]] = None):
+    def __init__(self, xpi_path: Path, filter_list: Optional[list[str]] = None,
+                    hash_algorithm: str = DEFAULT_HASH_ALGORITHM):
         
         assert xpi_path.exists()
         self.path = xpi_path
         self.xpi_version: Optional[int] = Path(xpi_path).parent.name  # TODO: 只是为了简化
         self._file_buffer: Optional[BufferedReader] = None
+        self._mapping = None
         
         self.is_corrupted = False
         self.reader: BufferedReader = None
+
+        self.digest: str = None
+        self.hash_algorithm = hash_algorithm
         
         self.extension_id: Optional[str] = Path(xpi_path).parent.parent.name  # TODO：得到extension_id
         self.resources: list[XpiResource] = None
         self.filter_list: Optional[list[str]] = filter_list
+        self.profile: Optional[ScanProfile] = None
 
 
     def __enter__(self) -> BufferedReader:
@@ -59,33 +68,70 @@ class XpiFile:
     
 
     def __exit__(self, *exception_args) -> bool:
-        """Closes the file buffer without raised exceptions."""
+        """Closes the file buffer and the mapping without raised exceptions."""
+        self.close()
+        return False  # Do not suppress raised exceptions
+
+
+    def close(self) -> None:
+        """Closes the file buffer and the mapping the archive is read from.
+
+        Members still open read from the mapping, so the archive is closed
+        once they are done.
+        """
         if self._file_buffer is not None:
             self._file_buffer.close()
             self._file_buffer = None
-
-        return False  # Do not suppress raised exceptions
+        if self._mapping is not None:
+            self._mapping.close()
+            self._mapping = None
     
 
-    def setup(self, setup_resources: Optional[bool] = True) -> None:
+    def compute_digest(self) -> str:
+        if self._mapping is None:
+            self._mapping = map_file(self.path)
+        return digest_mapping(self._mapping, self.hash_algorithm)
+
+    def setup(self, setup_resources: Optional[bool] = True,
+              with_digest: bool = True) -> None:
         
-        self._file_buffer = None  # reset the file buffer
+        self.close()  # Reset the file buffer and any earlier mapping
+        # The digest and the archive read the same mapping of the file
+        self._mapping = map_file(self.path)
+        if with_digest:
+            with stage(self.profile, "compute_digest") as timing:
+                self.digest = self.compute_digest()
+                timing.bytes += mapping_size(self._mapping)
         if setup_resources:
             self.setup_resources()
 
 
     def get_zip_archive(self) -> Optional[ZipFile]:
-        with self as zip_buffer:
-            try:
-                zip_file = ZipFile(BytesIO(zip_buffer.read()))
+        try:
+            # Read the archive in place instead of copying it into memory
+            source = self._mapping if self._mapping is not None else self.path
+            zip_file = ZipFile(ArchiveView(source))
 
-            except (BadZipFile, BadXpi):
-                self.is_corrupted = True
-                return None
+        except (BadZipFile, BadXpi):
+            self.is_corrupted = True
+            return None
 
         self.is_corrupted = False
         return zip_file
         
+    def iter_resources(self) -> Iterator[XpiResource]:
+        """Yields the resources one at a time, opening each member lazily.
+
+        Unlike `setup_resources`, no member is opened up front and each one
+        is closed once the next is requested. A missing archive is reported
+        immediately rather than on the first iteration.
+        """
+        zip_archive = self.get_zip_archive()
+        if zip_archive is None:
+            raise BadXpi("Could not identify the ZIP archive.")
+
+        return iter_archive_resources(zip_archive, XpiResource, self.filter_list)
+
     def setup_resources(self) -> None:
 
         zip_archive = self.get_zip_archive()
@@ -97,7 +143,7 @@ class XpiFile:
             if resource_info.is_dir(): continue
             
             filename = resource_info.filename
-            resource = XpiResource(filename)
+            resource = XpiResource(filename, info=resource_info)
             if (self.filter_list is None
                 or filename.split(".")[-1] in self.filter_list):
                 # If there is no filter list specified or the extension of the